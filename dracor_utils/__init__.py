@@ -0,0 +1 @@
+"""Helpers shared by the DraCor notebooks to retrieve and process data of the DraCor API at corpus scale"""
@@ -0,0 +1,185 @@
+"""Persistent cache of spaCy annotations of the spoken text of characters
+
+speech_analysis, parts_of_speech and contrastive-text-analysis run spaCy on the same texts again whenever
+a notebook is restarted; with de_dep_news_trf this takes minutes per play. The cache stores the annotated text of
+each character as a serialized DocBin in its own file:
+
+    {directory}/{corpusname}/{playname}/{model}-{version}[-without-{components}]/{character}-{text hash}.spacy
+
+so the key consists of corpus, play, character, a hash of the text, name and version of the model and the disabled
+components. A changed text, another model version or another set of disabled components never returns stale
+annotations. Docs are read back one character at a time; reading only needs the vocabulary, so a notebook can use
+the annotations of a transformer model without loading it.
+
+Example:
+    >>> nlp = spacy.load("de_core_news_sm")
+    >>> cache = AnnotationCache(nlp, disable=["ner", "sentencizer"])
+    >>> for character, doc in cache.annotate_play("ger", "goethe-faust-eine-tragoedie", characters):
+    ...     lemmata = get_lemmata_by_pos(doc)
+"""
+
+import hashlib
+import logging
+import os
+import re
+from typing import Iterable, Iterator
+
+# Extension of the cached files
+DOCBIN_EXTENSION = ".spacy"
+
+
+def character_text(character: dict, separator: str = "\n") -> str:
+    """Join the speeches of a character of /spoken-text-by-character, as done in the speech_analysis notebook"""
+    return separator.join(character.get("text", []))
+
+
+def text_hash(text: str) -> str:
+    """Get a short hash identifying a text"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _safe_name(name: str) -> str:
+    """Replace characters that are not allowed in file names"""
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class AnnotationCache:
+    """spaCy Docs of the texts of characters, stored on disk by play, character, text and model
+    """
+
+    def __init__(self,
+                 nlp=None,
+                 directory: str = "data/annotations",
+                 disable: Iterable[str] = (),
+                 model_name: str = None,
+                 model_version: str = None,
+                 vocab=None):
+        """
+
+        Args:
+            nlp (spacy.Language, optional): Loaded pipeline used to annotate texts that are not in the cache.
+                Without it, only cached annotations can be read; model_name and model_version must be given.
+            directory (str, optional): Folder of the cache. Defaults to "data/annotations".
+            disable (optional): Components of the pipeline that are not run, e.g. ["ner", "sentencizer"].
+            model_name (str, optional): Name of the model, e.g. "de_dep_news_trf". Defaults to the name of nlp.
+            model_version (str, optional): Version of the model. Defaults to the version of nlp.
+            vocab (spacy.vocab.Vocab, optional): Vocabulary used to read the Docs. Defaults to the vocabulary of nlp
+                or to an empty vocabulary; the strings of the Docs are stored with them.
+        """
+        if nlp is not None:
+            model_name = model_name or f"{nlp.meta['lang']}_{nlp.meta['name']}"
+            model_version = model_version or nlp.meta["version"]
+        if model_name is None or model_version is None:
+            raise ValueError("Pass a pipeline or the name and version of the model.")
+
+        self.nlp = nlp
+        self.directory = directory
+        self.disable = sorted(set(disable))
+        self.model_name = model_name
+        self.model_version = model_version
+        self.__vocab = vocab if vocab is not None else (nlp.vocab if nlp is not None else None)
+
+    @property
+    def model_key(self) -> str:
+        """Part of the path identifying model, version and disabled components"""
+        key = f"{self.model_name}-{self.model_version}"
+        if self.disable:
+            key += "-without-" + "+".join(self.disable)
+        return _safe_name(key)
+
+    @property
+    def vocab(self):
+        if self.__vocab is None:
+            from spacy.vocab import Vocab
+            self.__vocab = Vocab()
+        return self.__vocab
+
+    def play_directory(self, corpusname: str, playname: str) -> str:
+        """Folder of the annotations of a play with this model"""
+        return os.path.join(self.directory, _safe_name(corpusname), _safe_name(playname), self.model_key)
+
+    def path(self, corpusname: str, playname: str, character_id: str, text: str) -> str:
+        """Path of the cached annotations of the text of a character"""
+        return os.path.join(self.play_directory(corpusname, playname),
+                            f"{_safe_name(character_id)}-{text_hash(text)}{DOCBIN_EXTENSION}")
+
+    def write(self, path: str, doc):
+        """Serialize a Doc to a file"""
+        from spacy.tokens import DocBin
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        doc_bin = DocBin(store_user_data=False)
+        doc_bin.add(doc)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(doc_bin.to_bytes())
+        os.replace(tmp_path, path)
+
+    def read(self, path: str):
+        """Deserialize the Doc of a file"""
+        from spacy.tokens import DocBin
+
+        with open(path, "rb") as f:
+            doc_bin = DocBin().from_bytes(f.read())
+        return next(doc_bin.get_docs(self.vocab))
+
+    def get(self, corpusname: str, playname: str, character_id: str, text: str):
+        """Get the cached annotations of a text, None if the text has not been annotated with this model"""
+        path = self.path(corpusname, playname, character_id, text)
+        return self.read(path) if os.path.exists(path) else None
+
+    def cached_characters(self, corpusname: str, playname: str) -> dict:
+        """Get the paths of all cached annotations of a play {character_id: [path, ...]}, regardless of the text"""
+        directory = self.play_directory(corpusname, playname)
+        paths = {}
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(DOCBIN_EXTENSION):
+                    character_id = name[:-len(DOCBIN_EXTENSION)].rsplit("-", 1)[0]
+                    paths.setdefault(character_id, []).append(os.path.join(directory, name))
+        return paths
+
+    def annotate(self, corpusname: str, playname: str, character_id: str, text: str):
+        """Get the annotations of a text from the cache or annotate and store it"""
+        path = self.path(corpusname, playname, character_id, text)
+        if os.path.exists(path):
+            return self.read(path)
+        if self.nlp is None:
+            raise KeyError(f"No annotations of '{character_id}' in {corpusname}/{playname} and no pipeline to "
+                           f"annotate the text.")
+        doc = self.nlp(text, disable=self.disable)
+        self.write(path, doc)
+        return doc
+
+    def annotate_play(self,
+                      corpusname: str,
+                      playname: str,
+                      characters: list,
+                      batch_size: int = 16) -> Iterator[tuple]:
+        """Annotate the texts of the characters of a play that are not in the cache, then read them one by one
+
+        Args:
+            corpusname (str): Name of the corpus.
+            playname (str): Name of the play.
+            characters (list): Characters as returned by /spoken-text-by-character, i.e. dictionaries with
+                the fields "id" and "text" (list of speeches).
+            batch_size (int, optional): Number of texts passed to nlp.pipe at once. Defaults to 16.
+
+        Yields:
+            tuple: (character, doc) in the order of the characters. Only one Doc is held in memory at a time
+                if the consumer does not keep them.
+        """
+        paths = [(character, self.path(corpusname, playname, character["id"], character_text(character)))
+                 for character in characters]
+        missing = [(character_text(character), path) for character, path in paths if not os.path.exists(path)]
+
+        if missing:
+            if self.nlp is None:
+                raise KeyError(f"{len(missing)} characters of {corpusname}/{playname} have not been annotated "
+                               f"with {self.model_key} and no pipeline is given.")
+            logging.info(f"Annotating {len(missing)} of {len(paths)} characters of {corpusname}/{playname}.")
+            for doc, path in self.nlp.pipe(missing, as_tuples=True, batch_size=batch_size, disable=self.disable):
+                self.write(path, doc)
+
+        for character, path in paths:
+            yield character, self.read(path)
@@ -0,0 +1,182 @@
+"""Annotation of the spoken text of all characters of a corpus with spaCy on several processes
+
+The speech_analysis notebook annotates one character after the other with nlp(text). Here the texts are streamed
+from the concurrent downloader into nlp.pipe, which annotates them in batches on n_process processes. Every text
+travels through the pipeline together with the key of its character (as_tuples), so the annotated Docs arrive
+aligned with corpus, play and character. Throughput (texts and tokens per second) is logged while the pipeline runs.
+With an AnnotationCache, characters that have already been annotated are read from disk instead.
+
+Example:
+    >>> nlp = spacy.load("de_core_news_sm")
+    >>> annotator = CorpusAnnotator(nlp, n_process=4, batch_size=16, disable=["ner"])
+    >>> for key, doc in annotator.annotate_corpus("ger"):
+    ...     lemma_counts[key.gender].update(token.lemma_ for token in doc if token.pos_ == "NOUN")
+    >>> annotator.stats
+"""
+
+import logging
+import os
+import time
+from collections import deque, namedtuple
+from typing import Iterable, Iterator
+
+from .annotation_cache import AnnotationCache, character_text
+from .api import DEFAULT_API_BASE_URL
+from .downloader import download_corpus
+
+# Key of the annotated text of a character
+CharacterKey = namedtuple("CharacterKey", ["corpus", "play", "id", "label", "gender"])
+
+
+def stream_character_texts(corpusname: str,
+                           playnames: list = None,
+                           api_base_url: str = DEFAULT_API_BASE_URL,
+                           max_workers: int = 8) -> Iterator[tuple]:
+    """Download the spoken text of the characters of a corpus and yield it character by character
+
+    Args:
+        corpusname (str): Name of the corpus, e.g. "ger".
+        playnames (list, optional): Names of the plays. Defaults to all plays of the corpus.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Yields:
+        tuple: (text, CharacterKey), the speeches of a character joined by line breaks.
+    """
+    for result in download_corpus(corpusname, "spoken-text-by-character", playnames=playnames,
+                                  api_base_url=api_base_url, max_workers=max_workers, parse_json=True):
+        if not result.ok:
+            continue
+        for character in result.data:
+            key = CharacterKey(result.corpusname, result.playname, character.get("id"),
+                               character.get("label"), character.get("gender"))
+            yield character_text(character), key
+
+
+class CorpusAnnotator:
+    """Annotates streams of texts with nlp.pipe and keeps them aligned with their keys
+    """
+
+    def __init__(self,
+                 nlp,
+                 batch_size: int = 16,
+                 n_process: int = 1,
+                 disable: Iterable[str] = (),
+                 cache: AnnotationCache = None,
+                 log_interval: float = 30):
+        """
+
+        Args:
+            nlp (spacy.Language): Loaded pipeline.
+            batch_size (int, optional): Number of texts sent to a process at once. Texts of characters are long,
+                so small batches keep the processes busy. Defaults to 16.
+            n_process (int, optional): Number of processes; -1 uses all CPUs. Defaults to 1. Transformer models
+                should run on a single process (and a GPU) instead.
+            disable (optional): Components of the pipeline that are not run, e.g. ["ner"].
+            cache (AnnotationCache, optional): Cache to read annotated texts from and to store new annotations in.
+                Its disabled components are used if it is given.
+            log_interval (float, optional): Seconds between two log messages on the throughput. Defaults to 30.
+        """
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.disable = list(cache.disable) if cache is not None else list(disable)
+        self.cache = cache
+        self.log_interval = log_interval
+        self.num_texts = 0
+        self.num_tokens = 0
+        self.num_cached = 0
+        self.seconds = 0.0
+
+    @property
+    def stats(self) -> dict:
+        """Number of annotated texts and tokens and the throughput of the last run"""
+        seconds = max(self.seconds, 1e-9)
+        return {
+            "texts": self.num_texts,
+            "cachedTexts": self.num_cached,
+            "tokens": self.num_tokens,
+            "seconds": round(self.seconds, 3),
+            "textsPerSecond": self.num_texts / seconds,
+            "tokensPerSecond": self.num_tokens / seconds,
+        }
+
+    def __log(self):
+        stats = self.stats
+        logging.info(f"Annotated {stats['texts']} texts ({stats['cachedTexts']} from the cache), "
+                     f"{stats['tokens']} tokens in {stats['seconds']:.0f} s: "
+                     f"{stats['tokensPerSecond']:.0f} tokens/s.")
+
+    def annotate(self, items: Iterable[tuple]) -> Iterator[tuple]:
+        """Annotate texts and yield them with their keys
+
+        Args:
+            items: Tuples (text, key). With a cache, the key must be a CharacterKey (or have the fields
+                corpus, play and id).
+
+        Yields:
+            tuple: (key, doc). Without a cache the order of the input is kept; cached texts are yielded as soon
+                as the pipeline passes them.
+        """
+        self.num_texts = self.num_tokens = self.num_cached = 0
+        self.seconds = 0.0
+        start = last_log = time.perf_counter()
+        cached = deque()
+
+        def uncached(items):
+            # Texts in the cache bypass spaCy, only their paths are kept until they are yielded
+            for text, key in items:
+                path = None
+                if self.cache is not None:
+                    path = self.cache.path(key.corpus, key.play, key.id, text)
+                    if os.path.exists(path):
+                        cached.append((key, path))
+                        continue
+                yield text, (key, path)
+
+        def count(key, doc, from_cache=False):
+            nonlocal last_log
+            self.num_texts += 1
+            self.num_cached += from_cache
+            self.num_tokens += len(doc)
+            now = time.perf_counter()
+            self.seconds = now - start
+            if now - last_log >= self.log_interval:
+                self.__log()
+                last_log = now
+            return key, doc
+
+        docs = self.nlp.pipe(uncached(items), as_tuples=True, batch_size=self.batch_size,
+                             n_process=self.n_process, disable=self.disable)
+        for doc, (key, path) in docs:
+            while cached:
+                key_cached, path_cached = cached.popleft()
+                yield count(key_cached, self.cache.read(path_cached), from_cache=True)
+            if path is not None:
+                self.cache.write(path, doc)
+            yield count(key, doc)
+        while cached:
+            key_cached, path_cached = cached.popleft()
+            yield count(key_cached, self.cache.read(path_cached), from_cache=True)
+
+        self.seconds = time.perf_counter() - start
+        self.__log()
+
+    def annotate_corpus(self,
+                        corpusname: str,
+                        playnames: list = None,
+                        api_base_url: str = DEFAULT_API_BASE_URL,
+                        max_workers: int = 8) -> Iterator[tuple]:
+        """Download and annotate the texts of the characters of a corpus; annotation starts with the first play
+
+        Args:
+            corpusname (str): Name of the corpus, e.g. "ger".
+            playnames (list, optional): Names of the plays. Defaults to all plays of the corpus.
+            api_base_url (str, optional): Base URL of the DraCor API.
+            max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+        Yields:
+            tuple: (CharacterKey, doc)
+        """
+        return self.annotate(stream_character_texts(corpusname, playnames=playnames,
+                                                    api_base_url=api_base_url, max_workers=max_workers))
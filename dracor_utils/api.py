@@ -0,0 +1,146 @@
+"""Basic access to the DraCor API using a pooled HTTP session with retries"""
+
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Base URL of the production DraCor API
+DEFAULT_API_BASE_URL = "https://dracor.org/api/v1/"
+
+# HTTP status codes that are worth a retry
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Genders of characters in the responses of the API, in the order of their codes
+GENDERS = ["MALE", "FEMALE", "UNKNOWN"]
+
+
+def gender_code(gender: str) -> int:
+    """Get the code of a gender (its position in GENDERS), -1 if it is missing or unknown"""
+    return GENDERS.index(gender) if gender in GENDERS else -1
+
+
+def construct_request_url(
+        api_base_url: str = DEFAULT_API_BASE_URL,
+        corpusname: str = None,
+        playname: str = None,
+        method: str = None) -> str:
+    """Construct the request url
+
+    Args:
+        api_base_url (str, optional): Base URL of the DraCor API.
+        corpusname (str, optional): Identifier of corpus 'corpusname'.
+        playname (str, optional): Identifier of play 'playname'.
+        method (str, optional): API method, e.g. "tei", "cast", ...
+    """
+    if not api_base_url.endswith("/"):
+        api_base_url = api_base_url + "/"
+
+    if corpusname and playname:
+        if method:
+            return f"{api_base_url}corpora/{corpusname}/plays/{playname}/{method}"
+        return f"{api_base_url}corpora/{corpusname}/plays/{playname}"
+    elif corpusname:
+        if method:
+            return f"{api_base_url}corpora/{corpusname}/{method}"
+        return f"{api_base_url}corpora/{corpusname}"
+    elif method:
+        return f"{api_base_url}{method}"
+    return f"{api_base_url}info"
+
+
+def create_session(
+        max_connections: int = 16,
+        retries: int = 5,
+        backoff_factor: float = 0.5) -> requests.Session:
+    """Create a session that keeps connections open and retries failed requests
+
+    Requests that fail because of connection problems or with one of the status codes
+    in RETRY_STATUS_CODES are retried with an exponential backoff. A "Retry-After" header
+    sent by the server is respected.
+
+    Args:
+        max_connections (int, optional): Number of connections kept open per host. Defaults to 16.
+        retries (int, optional): Maximum number of retries of a single request. Defaults to 5.
+        backoff_factor (float, optional): Factor of the exponential backoff between retries
+            in seconds. Defaults to 0.5.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def api_get(
+        session: requests.Session = None,
+        api_base_url: str = DEFAULT_API_BASE_URL,
+        corpusname: str = None,
+        playname: str = None,
+        method: str = None,
+        params: dict = None,
+        headers: dict = None,
+        parse_json: bool = None,
+        timeout: float = 60):
+    """Send GET request to a DraCor API
+
+    Args:
+        session (requests.Session, optional): Session used to send the request. A new session
+            with retries is created if not set.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        corpusname (str, optional): Identifier of corpus 'corpusname'.
+        playname (str, optional): Identifier of play 'playname'.
+        method (str, optional): API method, e.g. "tei", "cast", ...
+        params (dict, optional): Query parameters, e.g. {"include": "metrics"}.
+        headers (dict, optional): HTTP headers to send with the request.
+        parse_json (bool, optional): Parse the result as JSON. If not set, the response is parsed
+            if the server declares it as JSON.
+        timeout (float, optional): Timeout of a single request in seconds. Defaults to 60.
+
+    Raises:
+        requests.HTTPError: The server did not return the status code 200.
+    """
+    if session is None:
+        session = create_session()
+
+    request_url = construct_request_url(api_base_url=api_base_url,
+                                        corpusname=corpusname,
+                                        playname=playname,
+                                        method=method)
+
+    logging.debug(f"Will send GET request to: {request_url}")
+    r = session.get(request_url, params=params, headers=headers, timeout=timeout)
+    r.raise_for_status()
+
+    if parse_json is None:
+        parse_json = "json" in r.headers.get("Content-Type", "")
+
+    if parse_json is True:
+        logging.debug("Parsed response to JSON.")
+        return json.loads(r.text)
+    return r.text
+
+
+def list_playnames(
+        corpusname: str,
+        session: requests.Session = None,
+        api_base_url: str = DEFAULT_API_BASE_URL) -> list:
+    """List the names of all plays in a corpus
+
+    Args:
+        corpusname (str): Identifier of corpus 'corpusname'.
+        session (requests.Session, optional): Session used to send the request.
+        api_base_url (str, optional): Base URL of the DraCor API.
+    """
+    corpus = api_get(session=session, api_base_url=api_base_url, corpusname=corpusname, parse_json=True)
+    return [play["name"] for play in corpus["plays"]]
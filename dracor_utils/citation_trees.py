@@ -0,0 +1,164 @@
+"""Types of citation-tree structures across the plays of one or more corpora
+
+The DTS notebook collects distinct body structures by comparing the nested citeStructure dictionaries of every play
+with all structures found before, and draws each one with treelib (cite_structure_to_tree). Here citation trees are
+encoded as compact canonical strings ("body(act(scene(speech,stage_direction)))", see citation_tree_shape in
+dts_catalog.py) that are already stored in the catalog of the collection crawler. The distinct encodings of a
+corpus are few, so parsing, selecting a part (e.g. the body) and hashing is done once per distinct encoding and
+mapped back to all plays. The result lists the structure types with the number of plays and corpora and example
+plays; render_structure draws a type as text in the layout of treelib's Tree.show.
+
+Example:
+    >>> catalog = DTSCatalog("data/dts")
+    >>> types = structure_types(catalog.table, part="body", by="corpus")
+    >>> print(render_structure(types["structure"].iloc[0]))
+    Body
+    └── Act
+        └── Scene
+            ├── Speech
+            └── Stage direction
+"""
+
+import hashlib
+import logging
+from typing import Iterable
+
+import pandas as pd
+
+from .dts_catalog import resource_record
+
+
+def parse_structure(encoding: str) -> list:
+    """Parse an encoded citation tree into nested tuples (citeType, children)
+
+    Args:
+        encoding (str): Encoded citation tree, e.g. "front,body(act(scene(speech,stage_direction)))".
+
+    Raises:
+        ValueError: The parentheses of the encoding are not balanced.
+    """
+    root = []
+    stack = [root]
+    name = ""
+    for char in encoding or "":
+        if char in "(),":
+            if name:
+                stack[-1].append((name, []))
+                name = ""
+            if char == "(":
+                if not stack[-1]:
+                    raise ValueError(f"Unexpected '(' in {encoding}.")
+                stack.append(stack[-1][-1][1])
+            elif char == ")":
+                if len(stack) == 1:
+                    raise ValueError(f"Unbalanced ')' in {encoding}.")
+                stack.pop()
+        else:
+            name += char
+    if name:
+        stack[-1].append((name, []))
+    if len(stack) != 1:
+        raise ValueError(f"Unbalanced '(' in {encoding}.")
+    return root
+
+
+def encode_structure(nodes: list) -> str:
+    """Encode nested tuples (citeType, children) as returned by parse_structure"""
+    return ",".join(f"{name}({encode_structure(children)})" if children else name for name, children in nodes)
+
+
+def depth_of(nodes: list) -> int:
+    """Get the number of levels of nested tuples (citeType, children)"""
+    return max((1 + depth_of(children) for _, children in nodes), default=0)
+
+
+def structure_part(encoding: str, cite_type: str = "body") -> str:
+    """Get the encoding of the top-level parts of a citation tree with a citeType, e.g. the body
+
+    Returns:
+        str: The encoding of the parts, None if the tree has no part of this citeType.
+    """
+    parts = [node for node in parse_structure(encoding) if node[0] == cite_type]
+    return encode_structure(parts) if parts else None
+
+
+def structure_id(encoding: str) -> str:
+    """Get a short stable hash of an encoded citation tree"""
+    return hashlib.blake2b((encoding or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+def render_structure(encoding: str) -> str:
+    """Draw an encoded citation tree as text, as cite_structure_to_tree(...).show() in the DTS notebook"""
+    lines = []
+
+    def draw(nodes, prefix):
+        for i, (name, children) in enumerate(nodes):
+            last = i == len(nodes) - 1
+            lines.append(f"{prefix}{'└── ' if last else '├── '}{name.capitalize().replace('_', ' ')}")
+            draw(children, prefix + ("    " if last else "│   "))
+
+    for name, children in parse_structure(encoding):
+        lines.append(name.capitalize().replace("_", " "))
+        draw(children, "")
+    return "\n".join(lines)
+
+
+def structure_records(resources: Iterable[dict]) -> pd.DataFrame:
+    """Get the encoded citation trees of Resource objects of the collection endpoint
+
+    Args:
+        resources: Resource objects with "citationTrees", e.g. responses of /dts/collection?id={play}.
+
+    Returns:
+        pd.DataFrame: Columns "id", "corpus" and "citationTree", as in the catalog of DTSCatalog.
+    """
+    records = [resource_record(resource) for resource in resources]
+    return pd.DataFrame([{key: record.get(key) for key in ("id", "corpus", "citationTree")} for record in records])
+
+
+def structure_types(catalog: pd.DataFrame,
+                    part: str = None,
+                    by: str = None,
+                    num_examples: int = 3) -> pd.DataFrame:
+    """Get the distinct citation-tree structures of many plays with their frequencies and example plays
+
+    Args:
+        catalog (pd.DataFrame): One row per play with the columns "id" and "citationTree"; "corpus" is
+            needed for the number of corpora. The table of DTSCatalog or of structure_records.
+        part (str, optional): Compare only the top-level parts of this citeType, e.g. "body" as in the DTS
+            notebook. Defaults to the whole tree.
+        by (str, optional): Column to count the types in separately, e.g. "corpus". The counts are added
+            as one column per group.
+        num_examples (int, optional): Number of example plays per type. Defaults to 3.
+
+    Returns:
+        pd.DataFrame: One row per structure type sorted by frequency, with the columns "structureId",
+            "structure", "depth", "numOfPlays", "numOfCorpora" and "examplePlays".
+    """
+    catalog = catalog[catalog["citationTree"].notna()].reset_index(drop=True)
+    # Parse and hash each distinct encoding only once
+    codes, encodings = pd.factorize(catalog["citationTree"].astype(str))
+    if part is not None:
+        encodings = pd.Index([structure_part(encoding, part) or "" for encoding in encodings])
+        codes, encodings = pd.Index(encodings[codes]).factorize()
+    depths = [depth_of(parse_structure(encoding)) for encoding in encodings]
+
+    plays = pd.DataFrame({"code": codes, "id": catalog["id"].to_numpy()})
+    grouped = plays.groupby("code", sort=False)
+    types = pd.DataFrame({
+        "structureId": [structure_id(encoding) for encoding in encodings],
+        "structure": list(encodings),
+        "depth": depths,
+    })
+    types["numOfPlays"] = grouped.size().reindex(range(len(encodings)), fill_value=0).to_numpy()
+    if "corpus" in catalog:
+        types["numOfCorpora"] = catalog["corpus"].groupby(codes).nunique().reindex(
+            range(len(encodings)), fill_value=0).to_numpy()
+    types["examplePlays"] = grouped["id"].agg(lambda ids: list(ids[:num_examples])).reindex(
+        range(len(encodings))).to_numpy()
+    if by is not None:
+        counts = pd.crosstab(codes, catalog[by].to_numpy()).reindex(range(len(encodings)), fill_value=0)
+        types = pd.concat([types, counts.reset_index(drop=True)], axis=1)
+
+    logging.info(f"Found {len(types)} distinct structures in {len(catalog)} plays.")
+    return types.sort_values("numOfPlays", ascending=False, ignore_index=True)
@@ -0,0 +1,203 @@
+"""Contrastive analysis of the vocabulary of two groups of characters across many plays
+
+The scattertext notebook parses the text of one play with a transformer model and writes a standalone HTML page
+with all data inline. This module computes the term-association statistics from sparse count matrices, i.e. from
+a TermMatrix (term_matrix.py) or from the lemma counts of cached annotations (lemma_frequencies.py), for any split
+of the characters by an attribute (gender, or genre after merging metadata) and for any number of plays:
+
+* the scaled F-score of Scattertext (harmonic mean of the normal-CDF-scaled precision and frequency of a term),
+* the log-odds ratio with an informative Dirichlet prior (Monroe et al. 2008) and its z-score.
+
+The result is written as a CSV file next to a small HTML viewer that loads the file when it is opened.
+
+Example:
+    >>> term_matrix = fetch_term_matrix("ger", lowercase=True)
+    >>> table = contrast(term_matrix, by="gender", category="MALE", not_categories=["FEMALE"])
+    >>> write_viewer(table, "data/ger_gender", category_name="Male", not_category_name="Female")
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from .term_matrix import TermMatrix
+
+
+def normcdf_scale(values: np.ndarray) -> np.ndarray:
+    """Scale values to [0, 1] with the cumulative distribution function of a normal distribution fitted to them
+
+    The distribution is fitted to the finite values. Falls back to percentile ranks of the values if it is
+    undefined (all values equal), as Scattertext does. Missing values stay missing.
+    """
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.full(len(values), np.nan)
+    mean, std = np.nanmean(values[finite]), np.nanstd(values[finite])
+    if std > 0 and np.isfinite(std):
+        scaled = stats.norm.cdf(values, mean, std)
+    else:
+        scaled = stats.rankdata(np.where(finite, values, np.nan), nan_policy="omit") / finite.sum()
+    scaled[~finite] = np.nan
+    return scaled
+
+
+def _min_max_scale(values: np.ndarray) -> np.ndarray:
+    if len(values) == 0:
+        return values
+    if values.min() == values.max():
+        return np.full(len(values), 0.5)
+    return (values - values.min()) / (values.max() - values.min())
+
+
+def scaled_f_scores(category_counts: np.ndarray, not_category_counts: np.ndarray, beta: float = 1.0) -> np.ndarray:
+    """Get the scaled F-scores of terms for a category, as Scattertext computes them
+
+    Args:
+        category_counts (np.ndarray): Frequencies of the terms in the category.
+        not_category_counts (np.ndarray): Frequencies of the terms in the contrasting category.
+        beta (float, optional): Weight of the frequency relative to the precision. Defaults to 1.
+
+    Returns:
+        np.ndarray: Scores in [-1, 1]; positive scores are characteristic of the category, negative scores
+            of the contrasting category.
+    """
+    def category_scores(counts, other_counts):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = normcdf_scale(counts / (counts + other_counts))
+            # Terms that occur in neither category are neutral
+            precision[np.isnan(precision)] = 0.5
+            frequency = normcdf_scale(counts / counts.sum())
+            scores = (1 + beta ** 2) * precision * frequency / (beta ** 2 * precision + frequency)
+        scores[np.isnan(scores)] = 0
+        return scores
+
+    category_counts = np.asarray(category_counts, dtype=float)
+    not_category_counts = np.asarray(not_category_counts, dtype=float)
+    scores = category_scores(category_counts, not_category_counts)
+    not_scores = category_scores(not_category_counts, category_counts)
+
+    # Keep the higher of both scores and scale the scores of each side to [0, 1]; terms that occur in neither
+    # category keep the score 0
+    balanced = np.zeros(len(scores))
+    present = category_counts + not_category_counts > 0
+    positive = present & (scores > not_scores)
+    negative = present & (scores < not_scores)
+    balanced[positive] = _min_max_scale(scores[positive])
+    balanced[negative] = 0.0 - _min_max_scale(not_scores[negative])
+    return balanced
+
+
+def log_odds_z_scores(category_counts: np.ndarray,
+                      not_category_counts: np.ndarray,
+                      prior_counts: np.ndarray = None,
+                      prior_scale: float = None) -> np.ndarray:
+    """Get the z-scores of the log-odds ratios of terms with an informative Dirichlet prior (Monroe et al. 2008)
+
+    Args:
+        category_counts (np.ndarray): Frequencies of the terms in the category.
+        not_category_counts (np.ndarray): Frequencies of the terms in the contrasting category.
+        prior_counts (np.ndarray, optional): Background frequencies of the terms. Defaults to the sum of both.
+        prior_scale (float, optional): Size of the prior in tokens. Defaults to the size of the smaller category.
+    """
+    y_i = np.asarray(category_counts, dtype=float)
+    y_j = np.asarray(not_category_counts, dtype=float)
+    prior = y_i + y_j if prior_counts is None else np.asarray(prior_counts, dtype=float)
+    scale = min(y_i.sum(), y_j.sum()) if prior_scale is None else prior_scale
+    alpha = prior / prior.sum() * scale + 0.01
+    alpha_0 = alpha.sum()
+    n_i, n_j = y_i.sum(), y_j.sum()
+    delta = (np.log((y_i + alpha) / (n_i + alpha_0 - y_i - alpha))
+             - np.log((y_j + alpha) / (n_j + alpha_0 - y_j - alpha)))
+    return delta / np.sqrt(1 / (y_i + alpha) + 1 / (y_j + alpha))
+
+
+def contrast(term_matrix: TermMatrix,
+             by: str,
+             category,
+             not_categories: list = None,
+             min_frequency: int = 3,
+             beta: float = 1.0) -> pd.DataFrame:
+    """Compute term-association statistics of one group of characters against another
+
+    Args:
+        term_matrix (TermMatrix): Counts of the terms per character with the attributes of the characters.
+        by (str): Column of the row table that splits the characters, e.g. "gender".
+        category: Value of the column that defines the category, e.g. "MALE".
+        not_categories (list, optional): Values that define the contrasting category, e.g. ["FEMALE"].
+            Defaults to all other values, missing values excluded.
+        min_frequency (int, optional): Minimum frequency of a term in both categories together. Defaults to 3.
+        beta (float, optional): Weight of the frequency in the scaled F-score. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: One row per term, sorted by scaled F-score, with the columns "term", "categoryFreq",
+            "notCategoryFreq", "categoryPer10k", "notCategoryPer10k", "scaledFScore" and "logOddsZ".
+    """
+    values = term_matrix.rows[by]
+    if not_categories is None:
+        not_categories = [value for value in values.dropna().unique() if value != category]
+    rows = term_matrix.rows.assign(_category=np.where(values == category, "category",
+                                                      np.where(values.isin(not_categories), "notCategory", None)))
+    grouped, _ = TermMatrix(term_matrix.matrix, term_matrix.vocabulary, rows).group_matrix(
+        by="_category", groups=["category", "notCategory"])
+    counts = grouped.toarray().astype(float)
+
+    keep = counts.sum(axis=0) >= min_frequency
+    category_counts, not_category_counts = counts[0, keep], counts[1, keep]
+    table = pd.DataFrame({
+        "term": np.asarray(term_matrix.vocabulary, dtype=object)[keep],
+        "categoryFreq": category_counts.astype(np.int64),
+        "notCategoryFreq": not_category_counts.astype(np.int64),
+        "categoryPer10k": category_counts / max(counts[0].sum(), 1) * 10000,
+        "notCategoryPer10k": not_category_counts / max(counts[1].sum(), 1) * 10000,
+        "scaledFScore": scaled_f_scores(category_counts, not_category_counts, beta=beta),
+        "logOddsZ": log_odds_z_scores(category_counts, not_category_counts),
+    })
+    logging.info(f"Contrasted {keep.sum()} terms of {(rows['_category'] == 'category').sum()} and "
+                 f"{(rows['_category'] == 'notCategory').sum()} characters.")
+    return table.sort_values("scaledFScore", ascending=False, ignore_index=True)
+
+
+def write_viewer(table: pd.DataFrame,
+                 path_prefix: str,
+                 category_name: str = "Category",
+                 not_category_name: str = "Not category",
+                 width: int = 800,
+                 height: int = 600):
+    """Write the statistics to "{path_prefix}.csv" and a viewer "{path_prefix}.html" that loads the CSV file
+
+    The viewer is a scatter plot of the frequencies per 10,000 tokens in both categories, colored by scaled
+    F-score, with a search field. The page holds no data, so the browser needs to load the CSV file from the
+    same folder (e.g. served by `python -m http.server`).
+
+    Args:
+        table (pd.DataFrame): Statistics as returned by contrast.
+        path_prefix (str): Prefix of the files, e.g. "data/ger_gender".
+        category_name (str, optional): Name of the category shown in the viewer.
+        not_category_name (str, optional): Name of the contrasting category shown in the viewer.
+        width (int, optional): Width of the plot in pixels. Defaults to 800.
+        height (int, optional): Height of the plot in pixels. Defaults to 600.
+    """
+    import altair as alt
+
+    csv_path = f"{path_prefix}.csv"
+    table.to_csv(csv_path, index=False, float_format="%.6g")
+
+    search = alt.param(name="search", value="", bind=alt.binding(input="search", name="Search term "))
+    chart = alt.Chart(alt.UrlData(os.path.basename(csv_path), format=alt.CsvDataFormat(type="csv"))).mark_circle(
+        size=30, opacity=0.7
+    ).encode(
+        x=alt.X("notCategoryPer10k:Q", scale=alt.Scale(type="symlog"), title=f"{not_category_name} (per 10,000)"),
+        y=alt.Y("categoryPer10k:Q", scale=alt.Scale(type="symlog"), title=f"{category_name} (per 10,000)"),
+        color=alt.Color("scaledFScore:Q", scale=alt.Scale(scheme="redblue", domain=[-1, 1], reverse=True),
+                        title="Scaled F-score"),
+        tooltip=["term:N", "categoryFreq:Q", "notCategoryFreq:Q", "scaledFScore:Q", "logOddsZ:Q"],
+    ).transform_filter(
+        "search == '' || test(regexp(search, 'i'), datum.term)"
+    ).add_params(search).properties(
+        width=width, height=height, title=f"{category_name} vs. {not_category_name}"
+    )
+    chart.save(f"{path_prefix}.html")
@@ -0,0 +1,460 @@
+"""Compact in-memory model of the plays, characters, speeches and segments of whole corpora
+
+The notebooks keep corpora as lists of the JSON dictionaries returned by the API, with one dictionary per character
+holding a list of speeches (and often an attached spaCy Doc). Every string, list and dictionary is a separate Python
+object, so memory grows much faster than the text itself. Here a corpus is stored column-wise (struct of arrays),
+as the networks in graph_store.py:
+
+* strings that repeat (character ids and labels, corpus names, segment titles and types) are interned once and
+  referenced by integer codes,
+* genders are int8 codes of GENDERS (-1 if missing), flags are boolean arrays,
+* the speeches of all characters are concatenated into one text buffer and addressed by offsets,
+* characters, speeches and segments of a play, and the speakers of a segment, are ranges given by offset arrays.
+
+Plays, characters and segments are accessed through light views with __slots__ that read from these arrays. The
+model is built from the API (play endpoint and spoken-text-by-character), from TEI passages (dts_document.py) or
+loaded from a compressed NumPy archive written before.
+
+Example:
+    >>> model = fetch_corpus_model("ger")
+    >>> model.save("data/ger_model.npz")
+    >>> model = CorpusModel.load("data/ger_model.npz")
+    >>> play = model.play("lessing-emilia-galotti")
+    >>> [(character.label, character.gender, len(character.text)) for character in play.characters]
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .api import DEFAULT_API_BASE_URL, GENDERS, api_get, create_session, gender_code, list_playnames
+
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+
+def _pack_strings(strings: list) -> tuple:
+    """Encode strings as one UTF-8 buffer and the offsets of the strings in it"""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(buffer: np.ndarray, offsets: np.ndarray) -> list:
+    data = buffer.tobytes()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+class Character:
+    """View of a character of a CorpusModel
+    """
+    __slots__ = ("model", "index")
+
+    def __init__(self, model, index: int):
+        self.model = model
+        self.index = index
+
+    @property
+    def id(self) -> str:
+        return self.model.string(self.model.arrays["character_ids"][self.index])
+
+    @property
+    def label(self) -> str:
+        return self.model.string(self.model.arrays["character_labels"][self.index])
+
+    @property
+    def gender(self) -> str:
+        """Gender as in the API ("MALE", "FEMALE", "UNKNOWN"), None if missing"""
+        code = self.model.arrays["character_genders"][self.index]
+        return GENDERS[code] if code >= 0 else None
+
+    @property
+    def is_group(self) -> bool:
+        return bool(self.model.arrays["character_is_group"][self.index])
+
+    @property
+    def speeches(self) -> list:
+        """Speeches of the character as in the field "text" of spoken-text-by-character"""
+        offsets = self.model.arrays["speech_offsets"]
+        start, end = self.model.arrays["character_speech_offsets"][self.index:self.index + 2]
+        return [self.model.text[offsets[i]:offsets[i + 1] - 1] for i in range(start, end)]
+
+    @property
+    def text(self) -> str:
+        """Speeches of the character joined by line breaks, a single slice of the text buffer"""
+        offsets = self.model.arrays["speech_offsets"]
+        start, end = self.model.arrays["character_speech_offsets"][self.index:self.index + 2]
+        # Speeches are stored consecutively with a line break after each speech
+        return self.model.text[offsets[start]:max(offsets[end] - 1, offsets[start])]
+
+    def __repr__(self) -> str:
+        return f"Character({self.id!r}, {self.label!r}, {self.gender!r})"
+
+
+class Segment:
+    """View of a segment of a CorpusModel
+    """
+    __slots__ = ("model", "index", "play")
+
+    def __init__(self, model, index: int, play):
+        self.model = model
+        self.index = index
+        self.play = play
+
+    @property
+    def number(self) -> int:
+        return self.index - self.model.arrays["play_segment_offsets"][self.play.index] + 1
+
+    @property
+    def type(self) -> str:
+        return self.model.string(self.model.arrays["segment_types"][self.index])
+
+    @property
+    def title(self) -> str:
+        return self.model.string(self.model.arrays["segment_titles"][self.index])
+
+    @property
+    def speaker_indices(self) -> np.ndarray:
+        """Positions of the speakers in the cast of the play"""
+        start, end = self.model.arrays["segment_speaker_offsets"][self.index:self.index + 2]
+        return self.model.arrays["segment_speakers"][start:end]
+
+    @property
+    def speakers(self) -> list:
+        """Ids of the speakers, as in the field "speakers" of the segments of the API (None if not in the cast)"""
+        first = self.model.arrays["play_character_offsets"][self.play.index]
+        return [self.model.string(self.model.arrays["character_ids"][first + i]) if i >= 0 else None
+                for i in self.speaker_indices.tolist()]
+
+    def __repr__(self) -> str:
+        return f"Segment({self.number}, {self.type!r}, {self.title!r})"
+
+
+class Play:
+    """View of a play of a CorpusModel
+    """
+    __slots__ = ("model", "index")
+
+    def __init__(self, model, index: int):
+        self.model = model
+        self.index = index
+
+    @property
+    def corpus(self) -> str:
+        return self.model.string(self.model.arrays["play_corpora"][self.index])
+
+    @property
+    def id(self) -> str:
+        return self.model.string(self.model.arrays["play_ids"][self.index])
+
+    @property
+    def name(self) -> str:
+        return self.model.string(self.model.arrays["play_names"][self.index])
+
+    @property
+    def title(self) -> str:
+        return self.model.string(self.model.arrays["play_titles"][self.index])
+
+    @property
+    def characters(self) -> list:
+        start, end = self.model.arrays["play_character_offsets"][self.index:self.index + 2]
+        return [Character(self.model, i) for i in range(start, end)]
+
+    @property
+    def segments(self) -> list:
+        start, end = self.model.arrays["play_segment_offsets"][self.index:self.index + 2]
+        return [Segment(self.model, i, self) for i in range(start, end)]
+
+    def character(self, character_id: str) -> Character:
+        """Get a character of the play by its id"""
+        for character in self.characters:
+            if character.id == character_id:
+                return character
+        raise KeyError(f"Play {self.name} has no character {character_id}.")
+
+    def __repr__(self) -> str:
+        return f"Play({self.corpus!r}, {self.name!r})"
+
+
+class CorpusModelBuilder:
+    """Collects plays into the arrays of a CorpusModel
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.__codes = {}
+        self.__text = []
+        self.__text_length = 0
+        self.lists = {name: [] for name in CorpusModel.ARRAYS}
+        for name in ("play_character_offsets", "play_segment_offsets", "character_speech_offsets",
+                     "speech_offsets", "segment_speaker_offsets"):
+            self.lists[name].append(0)
+
+    def intern(self, value) -> int:
+        """Get the code of a string, adding it to the pool; -1 for None"""
+        if value is None:
+            return -1
+        code = self.__codes.get(value)
+        if code is None:
+            code = self.__codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def add_play(self, corpusname: str, play: dict, characters: list = None):
+        """Add a play
+
+        Args:
+            corpusname (str): Name of the corpus.
+            play (dict): Play as returned by /corpora/{corpusname}/plays/{playname} with the fields "id", "name",
+                "title", "characters" and "segments"; only "name" is required.
+            characters (list, optional): Characters with their speeches as returned by spoken-text-by-character.
+                Characters missing in the cast of the play are added.
+        """
+        lists = self.lists
+        cast = list(play.get("characters", []))
+        positions = {character.get("id"): i for i, character in enumerate(cast)}
+        speeches = {}
+        for character in characters or []:
+            if character.get("id") not in positions:
+                positions[character.get("id")] = len(cast)
+                cast.append(character)
+            speeches[character.get("id")] = character.get("text", [])
+
+        lists["play_corpora"].append(self.intern(corpusname))
+        lists["play_ids"].append(self.intern(play.get("id")))
+        lists["play_names"].append(self.intern(play["name"]))
+        lists["play_titles"].append(self.intern(play.get("title")))
+
+        for character in cast:
+            lists["character_ids"].append(self.intern(character.get("id")))
+            lists["character_labels"].append(self.intern(character.get("name", character.get("label"))))
+            lists["character_genders"].append(gender_code(character.get("gender", character.get("sex"))))
+            lists["character_is_group"].append(bool(character.get("isGroup", False)))
+            for speech in speeches.get(character.get("id"), []):
+                self.__text.append(speech)
+                self.__text.append("\n")
+                self.__text_length += len(speech) + 1
+                lists["speech_offsets"].append(self.__text_length)
+            lists["character_speech_offsets"].append(len(lists["speech_offsets"]) - 1)
+
+        for segment in play.get("segments", []):
+            lists["segment_types"].append(self.intern(segment.get("type")))
+            lists["segment_titles"].append(self.intern(segment.get("title")))
+            lists["segment_speakers"].extend(positions.get(speaker, -1) for speaker in segment.get("speakers", []))
+            lists["segment_speaker_offsets"].append(len(lists["segment_speakers"]))
+
+        lists["play_character_offsets"].append(len(lists["character_ids"]))
+        lists["play_segment_offsets"].append(len(lists["segment_types"]))
+
+    def add_tei(self, corpusname: str, source, play: dict = None, segments: list = None):
+        """Add a play from its TEI document (or a TEI passage of the DTS document endpoint)
+
+        The cast is read from the particDesc, the speeches are read incrementally with iter_passage;
+        a speech with several speakers is added to each of them.
+
+        Args:
+            corpusname (str): Name of the corpus.
+            source: File name or binary file object of the TEI document.
+            play (dict, optional): Fields "id", "name" and "title" of the play. The name defaults to the id.
+            segments (list, optional): Segments of the play, e.g. segments_as_api(navigation_segments(index))
+                of dts_segments.py.
+        """
+        from lxml import etree
+
+        from .dts_document import iter_passage
+
+        if hasattr(source, "seek"):
+            position = source.tell()
+        cast = []
+        for _, element in etree.iterparse(source, events=("end",), huge_tree=True,
+                                          tag=(f"{{{TEI_NAMESPACE}}}person", f"{{{TEI_NAMESPACE}}}personGrp")):
+            name = element.find(f"{{{TEI_NAMESPACE}}}persName")
+            name = name if name is not None else element.find(f"{{{TEI_NAMESPACE}}}name")
+            cast.append({"id": element.get(XML_ID), "name": " ".join(name.itertext()).strip() if name is not None
+                         else element.get(XML_ID), "gender": element.get("sex", element.get("gender")),
+                         "isGroup": element.tag.endswith("personGrp")})
+            element.clear(keep_tail=True)
+        if hasattr(source, "seek"):
+            source.seek(position)
+
+        speeches = {}
+        for item in iter_passage(source):
+            if item.type == "speech":
+                for who in item.who:
+                    speeches.setdefault(who, []).append(item.text)
+        play = dict(play or {})
+        play.setdefault("name", play.get("id"))
+        play["characters"] = cast
+        play["segments"] = segments or []
+        self.add_play(corpusname, play, [{"id": who, "text": texts} for who, texts in speeches.items()])
+
+    def build(self):
+        """Get the model of the added plays"""
+        arrays = {name: np.asarray(values, dtype=CorpusModel.ARRAYS[name]) for name, values in self.lists.items()}
+        return CorpusModel(arrays, list(self.strings), "".join(self.__text))
+
+
+class CorpusModel:
+    """Plays, characters, speeches and segments of one or more corpora as arrays
+    """
+
+    # Arrays of the model and their types
+    ARRAYS = {
+        "play_corpora": np.int32,
+        "play_ids": np.int32,
+        "play_names": np.int32,
+        "play_titles": np.int32,
+        "play_character_offsets": np.int64,
+        "play_segment_offsets": np.int64,
+        "character_ids": np.int32,
+        "character_labels": np.int32,
+        "character_genders": np.int8,
+        "character_is_group": bool,
+        "character_speech_offsets": np.int64,
+        "speech_offsets": np.int64,
+        "segment_types": np.int32,
+        "segment_titles": np.int32,
+        "segment_speaker_offsets": np.int64,
+        "segment_speakers": np.int32,
+    }
+
+    def __init__(self, arrays: dict, strings: list, text: str):
+        """
+
+        Args:
+            arrays (dict): Arrays named as in ARRAYS.
+            strings (list): Interned strings the codes refer to.
+            text (str): Text buffer of all speeches.
+        """
+        self.arrays = arrays
+        self.strings = strings
+        self.text = text
+        self.__play_index = None
+
+    def string(self, code: int) -> str:
+        """Get an interned string by its code, None for -1"""
+        return self.strings[code] if code >= 0 else None
+
+    def __len__(self) -> int:
+        return len(self.arrays["play_names"])
+
+    def __iter__(self) -> Iterator[Play]:
+        return (Play(self, i) for i in range(len(self)))
+
+    def play(self, key: str) -> Play:
+        """Get a play by its name or id
+
+        Raises:
+            KeyError: The model has no such play.
+        """
+        if self.__play_index is None:
+            self.__play_index = {}
+            for i in range(len(self)):
+                for name in ("play_names", "play_ids"):
+                    code = self.arrays[name][i]
+                    if code >= 0:
+                        self.__play_index.setdefault(self.strings[code], i)
+        try:
+            return Play(self, self.__play_index[key])
+        except KeyError:
+            raise KeyError(f"The model has no play {key}.") from None
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory use of the model in bytes"""
+        import sys
+        return (sum(array.nbytes for array in self.arrays.values()) + sys.getsizeof(self.text)
+                + sum(sys.getsizeof(string) for string in self.strings) + sys.getsizeof(self.strings))
+
+    def characters_frame(self) -> pd.DataFrame:
+        """Get a table of all characters with their play and the number of speeches and characters of text"""
+        arrays = self.arrays
+        strings = np.asarray(self.strings + [None], dtype=object)
+        plays = np.repeat(np.arange(len(self)), np.diff(arrays["play_character_offsets"]))
+        speech_offsets = arrays["character_speech_offsets"]
+        text_offsets = arrays["speech_offsets"][speech_offsets]
+        return pd.DataFrame({
+            "corpus": strings[arrays["play_corpora"][plays]],
+            "play": strings[arrays["play_names"][plays]],
+            "id": strings[arrays["character_ids"]],
+            "label": strings[arrays["character_labels"]],
+            "gender": pd.Categorical.from_codes(arrays["character_genders"], categories=GENDERS),
+            "isGroup": arrays["character_is_group"],
+            "numOfSpeeches": np.diff(speech_offsets),
+            "numOfChars": np.maximum(np.diff(text_offsets) - np.diff(speech_offsets), 0),
+        })
+
+    def character_texts(self) -> Iterator[tuple]:
+        """Yield (text, key) of all characters with speeches, as stream_character_texts in annotation_pipeline.py"""
+        from .annotation_pipeline import CharacterKey
+
+        for play in self:
+            for character in play.characters:
+                text = character.text
+                if text:
+                    yield text, CharacterKey(play.corpus, play.name, character.id, character.label, character.gender)
+
+    def save(self, path: str):
+        """Write the model to a compressed NumPy archive"""
+        string_buffer, string_offsets = _pack_strings(self.strings)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, string_buffer=string_buffer, string_offsets=string_offsets,
+                            text=np.frombuffer(self.text.encode("utf-8"), dtype=np.uint8), **self.arrays)
+        logging.info(f"Stored {len(self)} plays in {path}.")
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a model written with save"""
+        with np.load(path) as archive:
+            arrays = {name: archive[name] for name in cls.ARRAYS}
+            strings = _unpack_strings(archive["string_buffer"], archive["string_offsets"])
+            text = archive["text"].tobytes().decode("utf-8")
+        return cls(arrays, strings, text)
+
+
+def fetch_corpus_model(corpusname: str,
+                       playnames: Iterable[str] = None,
+                       api_base_url: str = DEFAULT_API_BASE_URL,
+                       max_workers: int = 8,
+                       builder: CorpusModelBuilder = None) -> CorpusModel:
+    """Download the cast, segments and spoken text of the plays of a corpus and build the model
+
+    The responses of a play are added to the arrays as soon as they arrive and are not kept.
+
+    Args:
+        corpusname (str): Name of the corpus, e.g. "ger".
+        playnames (optional): Names of the plays. Defaults to all plays of the corpus.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        builder (CorpusModelBuilder, optional): Builder to add the plays to, e.g. to combine several corpora.
+    """
+    session = create_session(max_connections=max_workers)
+    if playnames is None:
+        playnames = list_playnames(corpusname, session=session, api_base_url=api_base_url)
+    builder = builder if builder is not None else CorpusModelBuilder()
+
+    def fetch(playname):
+        try:
+            play = api_get(session=session, api_base_url=api_base_url, corpusname=corpusname, playname=playname,
+                           parse_json=True)
+            characters = api_get(session=session, api_base_url=api_base_url, corpusname=corpusname,
+                                 playname=playname, method="spoken-text-by-character", parse_json=True)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Could not download play '{playname}' of corpus '{corpusname}': {e}")
+            return None
+        return play, characters
+
+    num_plays = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(fetch, playnames):
+            if result is not None:
+                builder.add_play(corpusname, *result)
+                num_plays += 1
+    logging.info(f"Added {num_plays} plays of corpus '{corpusname}'.")
+    return builder.build()
@@ -0,0 +1,190 @@
+"""Metadata of all DraCor corpora in a single table partitioned by corpus
+
+The metadata of each corpus is stored as a Parquet file in its own partition (folder "corpus={corpusname}").
+When the table is refreshed, only corpora whose metrics (number of plays, characters, words, ...) or version
+changed since the last refresh are downloaded again. Queries are run on the whole table as a pyarrow dataset,
+filters on the corpus or on metadata fields are pushed down to the Parquet files.
+
+Example:
+    >>> import pyarrow.dataset as ds
+    >>> table = CorpusTable()
+    >>> table.refresh()
+    >>> tragedies = table.query(filter=(ds.field("normalizedGenre") == "Tragedy") & (ds.field("yearNormalized") < 1800),
+    ...                         columns=["corpus", "name", "yearNormalized", "numOfSpeakers"])
+"""
+
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import requests
+
+from .api import DEFAULT_API_BASE_URL, api_get, create_session
+from .metadata_store import METADATA_SCHEMA, parse_metadata_csv, nullable_pandas_type
+
+# Name of the partition column
+PARTITION_KEY = "corpus"
+
+# Fields of a corpus in the response of /corpora that indicate a new version of the corpus
+VERSION_FIELDS = ("commit", "version", "updated")
+
+
+def corpus_signature(corpus: dict) -> dict:
+    """Get the fields of a corpus description that change when the corpus changes
+
+    Args:
+        corpus (dict): Item of the response of /corpora?include=metrics.
+    """
+    signature = {"metrics": corpus.get("metrics", {})}
+    for field in VERSION_FIELDS:
+        if field in corpus:
+            signature[field] = corpus[field]
+    return signature
+
+
+class CorpusTable:
+    """Metadata of all corpora of a DraCor API in a single Parquet dataset partitioned by corpus
+    """
+
+    def __init__(self,
+                 directory: str = "data/corpora",
+                 api_base_url: str = DEFAULT_API_BASE_URL,
+                 session: requests.Session = None):
+        """
+
+        Args:
+            directory (str, optional): Folder of the dataset. Defaults to "data/corpora".
+            api_base_url (str, optional): Base URL of the DraCor API.
+            session (requests.Session, optional): Session used to send requests to the API.
+        """
+        self.directory = directory
+        self.api_base_url = api_base_url
+        self.__session = session if session is not None else create_session()
+        self.schema = METADATA_SCHEMA.append(pa.field(PARTITION_KEY, pa.string()))
+
+    @property
+    def manifest_path(self) -> str:
+        """Path of the file that keeps track of the stored corpora and their signatures"""
+        return os.path.join(self.directory, "manifest.json")
+
+    def __partition_path(self, corpusname: str) -> str:
+        return os.path.join(self.directory, f"{PARTITION_KEY}={corpusname}")
+
+    def load_manifest(self) -> dict:
+        """Load the signatures of the stored corpora {corpusname: signature}"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def __write_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def list_corpora(self) -> list:
+        """Get the description of all corpora including metrics from /corpora?include=metrics"""
+        return api_get(session=self.__session,
+                       api_base_url=self.api_base_url,
+                       method="corpora",
+                       params={"include": "metrics"},
+                       parse_json=True)
+
+    def __fetch_corpus(self, corpusname: str) -> pa.Table:
+        """Download the metadata of a corpus and restrict it to the fixed schema"""
+        logging.info(f"Downloading metadata of corpus '{corpusname}'.")
+        csv_text = api_get(session=self.__session,
+                           api_base_url=self.api_base_url,
+                           corpusname=corpusname,
+                           method="metadata",
+                           headers={"accept": "text/csv"},
+                           parse_json=False)
+        return parse_metadata_csv(csv_text.encode("utf-8")).select(METADATA_SCHEMA.names)
+
+    def __write_partition(self, corpusname: str, table: pa.Table):
+        """Replace the partition of a corpus"""
+        partition_path = self.__partition_path(corpusname)
+        # The prefix "_" excludes the folder from the dataset while it is being written
+        tmp_path = os.path.join(self.directory, f"_{PARTITION_KEY}={corpusname}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        pq.write_table(table, os.path.join(tmp_path, "part-0.parquet"), compression="zstd")
+        shutil.rmtree(partition_path, ignore_errors=True)
+        os.replace(tmp_path, partition_path)
+
+    def refresh(self, corpora: list = None, force: bool = False, max_workers: int = 4) -> list:
+        """Download the metadata of the corpora that are new or have changed since the last refresh
+
+        Corpora are compared by their metrics and version as returned by /corpora?include=metrics.
+        Partitions of corpora that are no longer available on the server are removed.
+
+        Args:
+            corpora (list, optional): Names of the corpora to include. Defaults to all corpora of the API.
+            force (bool, optional): Download all corpora, even if they have not changed. Defaults to False.
+            max_workers (int, optional): Number of corpora downloaded at the same time. Defaults to 4.
+
+        Returns:
+            list: Names of the corpora that were downloaded.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.load_manifest()
+
+        available = {corpus["name"]: corpus_signature(corpus) for corpus in self.list_corpora()
+                     if corpora is None or corpus["name"] in corpora}
+
+        outdated = [corpusname for corpusname, signature in available.items()
+                    if force or manifest.get(corpusname) != signature]
+        logging.info(f"{len(outdated)} of {len(available)} corpora are new or have changed.")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tables = executor.map(self.__fetch_corpus, outdated)
+            for corpusname, table in zip(outdated, tables):
+                self.__write_partition(corpusname, table)
+                manifest[corpusname] = available[corpusname]
+                # Write the manifest after every corpus, so that an interrupted refresh can be resumed
+                self.__write_manifest(manifest)
+
+        if corpora is None:
+            for corpusname in set(manifest) - set(available):
+                logging.info(f"Corpus '{corpusname}' is no longer available, will remove it.")
+                shutil.rmtree(self.__partition_path(corpusname), ignore_errors=True)
+                del manifest[corpusname]
+            self.__write_manifest(manifest)
+
+        return outdated
+
+    def dataset(self) -> ds.Dataset:
+        """Get the stored metadata of all corpora as a pyarrow dataset"""
+        return ds.dataset(self.directory,
+                          format="parquet",
+                          schema=self.schema,
+                          partitioning=ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor="hive"),
+                          exclude_invalid_files=True,
+                          ignore_prefixes=[".", "_", "manifest"])
+
+    def query_table(self, filter: ds.Expression = None, columns: list = None) -> pa.Table:
+        """Query the metadata of all corpora
+
+        Args:
+            filter (ds.Expression, optional): Filter on the rows, e.g. ds.field("corpus").isin(["ger", "rus"]).
+                Filters on the corpus skip whole partitions, filters on other fields are evaluated
+                using the statistics of the Parquet files.
+            columns (list, optional): Names of the columns to return. Defaults to all columns.
+        """
+        return self.dataset().to_table(filter=filter, columns=columns)
+
+    def query(self, filter: ds.Expression = None, columns: list = None) -> pd.DataFrame:
+        """Query the metadata of all corpora and return a DataFrame
+
+        Args:
+            filter (ds.Expression, optional): Filter on the rows, see query_table.
+            columns (list, optional): Names of the columns to return. Defaults to all columns.
+        """
+        return self.query_table(filter=filter, columns=columns).to_pandas(types_mapper=nullable_pandas_type)
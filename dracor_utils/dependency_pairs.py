@@ -0,0 +1,222 @@
+"""Counts of dependency pairs (e.g. adjective and noun) in annotated texts, grouped by attributes of the characters
+
+get_adj_noun_pairs in the speech_analysis notebook checks the head of every token and collects tuples of lemmata
+per gender that are counted with a Counter afterwards. Here the lemma, part of speech, dependency label and head of
+all tokens of a Doc are read as one integer array; every pattern is a vectorized mask over this array. Matching
+pairs are coded as integers (pattern, dependent lemma, head lemma), counted per text with NumPy and stored as
+a sparse matrix with one row per text and one column per distinct pair, so no tuples are kept in memory.
+
+The counter can run inside the annotation stream (see tap) next to other consumers of the Docs.
+
+Example:
+    >>> counter = DependencyPairCounter()
+    >>> for key, doc in counter.tap(annotator.annotate_corpus("ger")):
+    ...     lemma_counter.add(doc, **key._asdict())
+    >>> counter.most_common("ADJ->NOUN", "FEMALE", by="gender", n=30)
+"""
+
+import logging
+from collections import namedtuple
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .term_matrix import TermMatrix
+
+# A pattern matches tokens (dependents) whose head has the part of speech head_pos. Dependents must have one of
+# the parts of speech dependent_pos and one of the dependency labels deps; None matches any.
+DependencyPattern = namedtuple("DependencyPattern", ["name", "dependent_pos", "head_pos", "deps"])
+
+# Subject and object labels of the Universal Dependencies and of the TIGER scheme of the German models
+SUBJECT_DEPS = ("nsubj", "nsubjpass", "nsubj:pass", "csubj", "sb", "sbp")
+OBJECT_DEPS = ("dobj", "obj", "iobj", "dative", "oa", "oa2", "da", "og")
+
+DEFAULT_PATTERNS = [
+    # The pairs of get_adj_noun_pairs in the speech_analysis notebook
+    DependencyPattern("ADJ->NOUN", ("ADJ",), ("NOUN",), None),
+    DependencyPattern("VERB->subject", None, ("VERB", "AUX"), SUBJECT_DEPS),
+    DependencyPattern("VERB->object", None, ("VERB", "AUX"), OBJECT_DEPS),
+    DependencyPattern("NOUN->NOUN", ("NOUN", "PROPN"), ("NOUN",), None),
+]
+
+
+class DependencyPairCounter:
+    """Counts of integer-coded dependency pairs per annotated text, with the attributes of the text
+    """
+
+    def __init__(self, patterns: list = None):
+        """
+
+        Args:
+            patterns (list, optional): DependencyPatterns to extract. Defaults to DEFAULT_PATTERNS.
+        """
+        self.patterns = list(DEFAULT_PATTERNS if patterns is None else patterns)
+        if len({pattern.name for pattern in self.patterns}) != len(self.patterns):
+            raise ValueError("The names of the patterns must be unique.")
+        # Interned lemmata {lemma hash: lemma id}
+        self.lemmas = []
+        self.__lemma_ids = {}
+        # Distinct pairs {(pattern, dependent id, head id): column}
+        self.__pairs = {}
+        self.__pair_codes = []
+        self.__rows = []
+        self.__data = []
+        self.__row_indices = []
+        self.__column_indices = []
+        self.__matrix = None
+        self.__symbols = None
+
+    def __compile(self, vocab) -> list:
+        """Translate the parts of speech and labels of the patterns into the integer ids of spaCy"""
+        from spacy.parts_of_speech import IDS as POS_IDS
+
+        def ids(names, lookup):
+            return None if names is None else np.array([lookup(name) for name in names], dtype=np.uint64)
+
+        return [(ids(pattern.dependent_pos, POS_IDS.get), ids(pattern.head_pos, POS_IDS.get),
+                 ids(pattern.deps, vocab.strings.add)) for pattern in self.patterns]
+
+    def __lemma_ids_of(self, hashes: np.ndarray, vocab) -> np.ndarray:
+        """Map lemma hashes to interned ids, adding new lemmata"""
+        unique, inverse = np.unique(hashes, return_inverse=True)
+        ids = np.empty(len(unique), dtype=np.int64)
+        for i, lemma_hash in enumerate(unique.tolist()):
+            lemma_id = self.__lemma_ids.get(lemma_hash)
+            if lemma_id is None:
+                lemma_id = self.__lemma_ids[lemma_hash] = len(self.lemmas)
+                self.lemmas.append(vocab.strings[lemma_hash])
+            ids[i] = lemma_id
+        return ids[inverse]
+
+    def extract(self, doc) -> np.ndarray:
+        """Get the pairs of a Doc as rows (pattern number, dependent lemma id, head lemma id)"""
+        from spacy.attrs import DEP, HEAD, LEMMA, POS
+
+        if self.__symbols is None:
+            self.__symbols = self.__compile(doc.vocab)
+        if len(doc) == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+
+        tokens = doc.to_array([LEMMA, POS, DEP, HEAD])
+        lemma, pos, dep = tokens[:, 0], tokens[:, 1], tokens[:, 2]
+        # HEAD holds the offset of the head relative to the token
+        head = np.arange(len(doc)) + tokens[:, 3].view(np.int64)
+        not_root = head != np.arange(len(doc))
+
+        matches = []
+        for number, (dependent_pos, head_pos, deps) in enumerate(self.__symbols):
+            mask = not_root.copy()
+            if dependent_pos is not None:
+                mask &= np.isin(pos, dependent_pos)
+            if head_pos is not None:
+                mask &= np.isin(pos[head], head_pos)
+            if deps is not None:
+                mask &= np.isin(dep, deps)
+            indices = np.flatnonzero(mask)
+            matches.append(np.column_stack([np.full(len(indices), number, dtype=np.uint64),
+                                            lemma[indices], lemma[head[indices]]]))
+
+        matches = np.concatenate(matches)
+        if len(matches) == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+        lemma_ids = self.__lemma_ids_of(matches[:, 1:].ravel(), doc.vocab).reshape(-1, 2)
+        return np.column_stack([matches[:, 0].astype(np.int64), lemma_ids])
+
+    def add(self, doc, **attributes):
+        """Count the pairs of an annotated text
+
+        Args:
+            doc (spacy.tokens.Doc): Text annotated by a pipeline with a parser.
+            **attributes: Attributes of the text, e.g. corpus, play, id and gender of the character.
+        """
+        row = len(self.__rows)
+        self.__rows.append(attributes)
+        pairs = self.extract(doc)
+        if len(pairs) == 0:
+            return
+
+        unique, counts = np.unique(pairs, axis=0, return_counts=True)
+        columns = np.empty(len(unique), dtype=np.int64)
+        for i, pair in enumerate(map(tuple, unique.tolist())):
+            column = self.__pairs.get(pair)
+            if column is None:
+                column = self.__pairs[pair] = len(self.__pair_codes)
+                self.__pair_codes.append(pair)
+            columns[i] = column
+
+        self.__data.append(counts.astype(np.int32))
+        self.__row_indices.append(np.full(len(counts), row, dtype=np.int64))
+        self.__column_indices.append(columns)
+        self.__matrix = None
+
+    def tap(self, docs: Iterable[tuple]) -> Iterator[tuple]:
+        """Count the pairs of a stream of annotated texts and pass the texts on
+
+        Args:
+            docs: Tuples (key, doc) as yielded by CorpusAnnotator; the fields of the key (a namedtuple or
+                a dictionary) become the attributes of the text.
+
+        Yields:
+            tuple: The unchanged tuples (key, doc).
+        """
+        for key, doc in docs:
+            self.add(doc, **(key._asdict() if hasattr(key, "_asdict") else dict(key)))
+            yield key, doc
+        logging.info(f"Counted {len(self.__pair_codes)} distinct pairs in {len(self.__rows)} texts.")
+
+    def count_docs(self, docs: Iterable[tuple]):
+        """Count the pairs of many annotated texts, see tap"""
+        for _ in self.tap(docs):
+            pass
+
+    @property
+    def rows(self) -> pd.DataFrame:
+        """Attributes of the counted texts"""
+        return pd.DataFrame(self.__rows, index=pd.RangeIndex(len(self.__rows)))
+
+    @property
+    def pairs(self) -> pd.DataFrame:
+        """The distinct pairs in the order of the columns, with the columns "pattern", "dependent" and "head" """
+        codes = np.array(self.__pair_codes, dtype=np.int64).reshape(-1, 3)
+        lemmas = np.asarray(self.lemmas, dtype=object)
+        return pd.DataFrame({
+            "pattern": pd.Categorical.from_codes(codes[:, 0], categories=[p.name for p in self.patterns]),
+            "dependent": lemmas[codes[:, 1]],
+            "head": lemmas[codes[:, 2]],
+        })
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        """Counts with one row per text and one column per distinct pair"""
+        if self.__matrix is None:
+            data = np.concatenate(self.__data) if self.__data else np.zeros(0, dtype=np.int32)
+            rows = np.concatenate(self.__row_indices) if self.__data else np.zeros(0, dtype=np.int64)
+            columns = np.concatenate(self.__column_indices) if self.__data else np.zeros(0, dtype=np.int64)
+            self.__matrix = sparse.csr_matrix((data, (rows, columns)),
+                                              shape=(len(self.__rows), len(self.__pair_codes)))
+        return self.__matrix
+
+    def counts(self, pattern: str, by="gender", groups: list = None) -> pd.DataFrame:
+        """Get the frequency of each pair of a pattern per group
+
+        Args:
+            pattern (str): Name of the pattern, e.g. "ADJ->NOUN".
+            by (optional): Column or list of columns of the row table. Defaults to "gender".
+            groups (list, optional): Groups to include, in this order. Defaults to all groups.
+
+        Returns:
+            pd.DataFrame: One row per pair, indexed by (dependent, head), and one column per group.
+        """
+        pairs = self.pairs
+        selected = np.flatnonzero(pairs["pattern"] == pattern)
+        term_matrix = TermMatrix(self.matrix[:, selected], [str(i) for i in selected], self.rows)
+        grouped, group_index = term_matrix.group_matrix(by=by, groups=groups)
+        index = pd.MultiIndex.from_frame(pairs.loc[selected, ["dependent", "head"]])
+        return pd.DataFrame(grouped.T.toarray(), index=index, columns=group_index)
+
+    def most_common(self, pattern: str, group, by="gender", n: int = 30) -> pd.Series:
+        """Get the most frequent pairs of a pattern in a group, as Counter.most_common in the notebook"""
+        counts = self.counts(pattern, by=by, groups=[group])[group]
+        return counts[counts > 0].nlargest(n)
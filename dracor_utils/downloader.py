@@ -0,0 +1,217 @@
+"""Parallel download of per-play data of one or more DraCor corpora
+
+Example:
+    Download the spoken text of all plays of GerDraCor:
+
+    >>> for result in download_corpus("ger", "spoken-text"):
+    ...     if result.ok:
+    ...         texts[result.playname] = result.data
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator
+
+import requests
+
+from .api import DEFAULT_API_BASE_URL, api_get, create_session, list_playnames
+
+
+@dataclass
+class PlayResult:
+    """Result of requesting a single play
+
+    Attributes:
+        corpusname (str): Identifier of the corpus.
+        playname (str): Identifier of the play.
+        method (str): API method that was requested, e.g. "spoken-text".
+        data: Parsed response. None if the request failed.
+        error (str): Description of the error if the request failed, otherwise None.
+    """
+    corpusname: str
+    playname: str
+    method: str
+    data: Any = None
+    error: str = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the play could be downloaded"""
+        return self.error is None
+
+
+class DownloadError(Exception):
+    """Raised if downloading a play failed and errors should not be passed on as results"""
+
+    def __init__(self, result: PlayResult):
+        self.result = result
+        super().__init__(f"Could not download '{result.method}' of play '{result.playname}' "
+                         f"in corpus '{result.corpusname}': {result.error}")
+
+
+def _fetch(session: requests.Session,
+           api_base_url: str,
+           corpusname: str,
+           playname: str,
+           method: str,
+           params: dict,
+           parse_json: bool,
+           timeout: float) -> PlayResult:
+    """Download a single play. Errors are returned as part of the result instead of being raised."""
+    try:
+        data = api_get(session=session,
+                       api_base_url=api_base_url,
+                       corpusname=corpusname,
+                       playname=playname,
+                       method=method,
+                       params=params,
+                       parse_json=parse_json,
+                       timeout=timeout)
+    except (requests.RequestException, ValueError) as e:
+        # ValueError covers responses that claim to be JSON but can't be parsed
+        return PlayResult(corpusname, playname, method, error=f"{type(e).__name__}: {e}")
+    return PlayResult(corpusname, playname, method, data=data)
+
+
+def download_plays(
+        plays: Iterable[tuple],
+        method: str,
+        api_base_url: str = DEFAULT_API_BASE_URL,
+        max_workers: int = 8,
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        params: dict = None,
+        parse_json: bool = None,
+        timeout: float = 60,
+        raise_on_error: bool = False,
+        session: requests.Session = None) -> Iterator[PlayResult]:
+    """Download data of many plays concurrently and yield the results as they arrive
+
+    All requests share a single session, i.e. connections to the server are reused. Failed requests
+    are retried with an exponential backoff (see api.create_session). Plays that still can not be
+    downloaded are yielded as results with the attribute 'error' set and logged as a warning.
+
+    At most twice as many requests as there are workers are in flight at the same time, so
+    'plays' can be a (lazy) generator and memory use stays bounded if the results are consumed
+    one by one.
+
+    Args:
+        plays: Iterable of tuples (corpusname, playname).
+        method (str): API method to request for each play, e.g. "spoken-text", "characters", "tei".
+            Set to None to request the play endpoint itself.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        retries (int, optional): Maximum number of retries of a single request. Defaults to 5.
+        backoff_factor (float, optional): Factor of the exponential backoff in seconds. Defaults to 0.5.
+        params (dict, optional): Query parameters sent with each request.
+        parse_json (bool, optional): Parse the responses as JSON. If not set, a response is parsed
+            if the server declares it as JSON.
+        timeout (float, optional): Timeout of a single request in seconds. Defaults to 60.
+        raise_on_error (bool, optional): Raise a DownloadError on the first failed play instead of
+            yielding it. Defaults to False.
+        session (requests.Session, optional): Session to use instead of creating a new one.
+
+    Yields:
+        PlayResult: Results in the order in which the downloads finished.
+    """
+    if session is None:
+        session = create_session(max_connections=max_workers, retries=retries, backoff_factor=backoff_factor)
+
+    plays = iter(plays)
+    max_pending = 2 * max_workers
+    num_ok = 0
+    num_failed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        exhausted = False
+
+        while True:
+            # Keep the queue of submitted requests filled
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    corpusname, playname = next(plays)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(_fetch, session, api_base_url, corpusname, playname,
+                                            method, params, parse_json, timeout))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result.ok:
+                    num_ok += 1
+                else:
+                    num_failed += 1
+                    logging.warning(f"Failed to download '{result.method}' of play '{result.playname}' "
+                                    f"in corpus '{result.corpusname}': {result.error}")
+                    if raise_on_error:
+                        for future_to_cancel in pending:
+                            future_to_cancel.cancel()
+                        raise DownloadError(result)
+                yield result
+
+    logging.info(f"Downloaded {num_ok} plays, {num_failed} failed.")
+
+
+def download_corpus(
+        corpusname: str,
+        method: str,
+        playnames: Iterable[str] = None,
+        api_base_url: str = DEFAULT_API_BASE_URL,
+        max_workers: int = 8,
+        **kwargs) -> Iterator[PlayResult]:
+    """Download data of every play of a corpus concurrently and yield the results as they arrive
+
+    Args:
+        corpusname (str): Identifier of the corpus, e.g. "ger".
+        method (str): API method to request for each play, e.g. "spoken-text", "characters", "tei".
+        playnames (optional): Names of the plays to download. Defaults to all plays of the corpus.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        **kwargs: Further arguments passed on to download_plays.
+
+    Yields:
+        PlayResult: Results in the order in which the downloads finished.
+    """
+    session = kwargs.pop("session", None)
+    if session is None:
+        session = create_session(max_connections=max_workers,
+                                 retries=kwargs.pop("retries", 5),
+                                 backoff_factor=kwargs.pop("backoff_factor", 0.5))
+
+    if playnames is None:
+        playnames = list_playnames(corpusname, session=session, api_base_url=api_base_url)
+        logging.info(f"Corpus '{corpusname}' includes {len(playnames)} plays.")
+
+    return download_plays(((corpusname, playname) for playname in playnames),
+                          method,
+                          api_base_url=api_base_url,
+                          max_workers=max_workers,
+                          session=session,
+                          **kwargs)
+
+
+def split_results(results: Iterable[PlayResult]) -> tuple:
+    """Collect downloaded data by play and separate failed downloads
+
+    Args:
+        results: PlayResults as yielded by download_plays or download_corpus.
+
+    Returns:
+        tuple: A dictionary {(corpusname, playname): data} of the successful downloads
+            and a list of the failed PlayResults.
+    """
+    data = {}
+    failed = []
+    for result in results:
+        if result.ok:
+            data[(result.corpusname, result.playname)] = result.data
+        else:
+            failed.append(result)
+    return data, failed
@@ -0,0 +1,309 @@
+"""Navigation of the citable units of plays through the DTS API, answered from a local index
+
+The DTS notebook sends a request to /dts/navigation for every question: the acts with down=1, the scenes of an
+act with ref and down=1, the parent of a unit with ref, and the speakers of a scene with another request per scene.
+Here the complete citation tree of a play is requested once with down=-1 and kept as an index of its citable units:
+a lookup from ref to position, the parent and the children of every unit in document order, the units grouped by
+citeType and the speakers of the speeches. Navigation queries are answered from the index with the shape of the
+responses of the API, so walking the structure of a play takes one request. Indexes are kept in memory per
+resource and optionally as JSON files in a folder.
+
+Example:
+    >>> client = DTSClient(cache_dir="data/dts")
+    >>> client.navigation("ger000001", down=1)["member"]
+    >>> client.navigation("ger000001", ref="body/div[2]", down=1)["member"]
+    >>> index = client.index("ger000001")
+    >>> [(scene["identifier"], index.speakers(scene["identifier"])) for scene in index.by_cite_type("scene")]
+"""
+
+import json
+import logging
+import os
+import re
+from urllib.parse import urlencode
+
+import numpy as np
+import requests
+
+from .api import api_get, create_session
+
+# Base URL of the API that implements DTS; the endpoints are not yet available on the production server
+DTS_API_BASE_URL = "https://staging.dracor.org/api/v1/"
+
+# Base of the URIs of the resources (plays)
+DTS_RESOURCE_BASE_URL = "https://staging.dracor.org/id/"
+
+
+def resource_uri(resource: str, resource_base_url: str = DTS_RESOURCE_BASE_URL) -> str:
+    """Get the URI of a resource from the id of a play (e.g. "ger000001"); URIs are returned unchanged"""
+    if resource.startswith("http://") or resource.startswith("https://"):
+        return resource
+    return f"{resource_base_url}{resource}"
+
+
+def members_of(response: dict) -> list:
+    """Get the members of a navigation response as a list
+
+    A single member is sometimes returned as an object instead of a list
+    (see https://github.com/dracor-org/dracor-api/issues/298).
+    """
+    members = response.get("member", [])
+    if isinstance(members, dict):
+        return [members]
+    return list(members)
+
+
+class NavigationIndex:
+    """Index of the citable units of a resource built from a single navigation response with down=-1
+    """
+
+    def __init__(self, response: dict, api_base_url: str = DTS_API_BASE_URL):
+        """
+
+        Args:
+            response (dict): Navigation response of the API for the whole resource (down=-1).
+            api_base_url (str, optional): Base URL of the API, used for the "@id" of the answers.
+        """
+        self.response = response
+        self.api_base_url = api_base_url
+        self.resource = response["resource"]
+        self.resource_id = self.resource["@id"]
+
+        members = members_of(response)
+        position = {unit["identifier"]: i for i, unit in enumerate(members)}
+        parents = np.array([position.get(unit.get("parent"), -1) if unit.get("parent") is not None else -1
+                            for unit in members], dtype=np.int64)
+
+        # Sort the units in document order (depth first, children in the order of the response), so the
+        # descendants of every unit form a contiguous range
+        children = [[] for _ in members]
+        roots = []
+        for i, parent in enumerate(parents.tolist()):
+            (roots if parent < 0 else children[parent]).append(i)
+        order = []
+        stack = list(reversed(roots))
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            stack.extend(reversed(children[i]))
+        if len(order) != len(members):
+            raise ValueError(f"The citation tree of {self.resource_id} has cycles.")
+
+        rank = np.empty(len(members), dtype=np.int64)
+        rank[order] = np.arange(len(members))
+        self.units = [members[i] for i in order]
+        self.refs = [unit["identifier"] for unit in self.units]
+        self.__positions = {ref: i for i, ref in enumerate(self.refs)}
+        self.parents = np.where(parents[order] >= 0, rank[np.maximum(parents[order], 0)], -1)
+        self.children = [[int(rank[child]) for child in children[i]] for i in order]
+        self.roots = [int(rank[root]) for root in roots]
+        self.levels = np.array([unit.get("level", 0) for unit in self.units], dtype=np.int16)
+
+        # End (exclusive) of the range of descendants of every unit
+        self.ends = np.arange(1, len(self.units) + 1, dtype=np.int64)
+        for i in reversed(range(len(self.units))):
+            if self.children[i]:
+                self.ends[i] = self.ends[self.children[i][-1]]
+
+        self.cite_types = {}
+        for i, unit in enumerate(self.units):
+            self.cite_types.setdefault(unit.get("citeType"), []).append(i)
+        self.cite_types = {cite_type: np.array(indices, dtype=np.int64)
+                           for cite_type, indices in self.cite_types.items()}
+        self.__speakers = [tuple(unit.get("extensions", {}).get("speakers", ())) for unit in self.units]
+        logging.info(f"Indexed {len(self.units)} citable units of {self.resource_id}.")
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def __contains__(self, ref: str) -> bool:
+        return ref in self.__positions
+
+    def position(self, ref: str) -> int:
+        """Get the position of a unit in document order
+
+        Raises:
+            KeyError: The resource has no unit with this ref.
+        """
+        try:
+            return self.__positions[ref]
+        except KeyError:
+            raise KeyError(f"{self.resource_id} has no citable unit {ref}.") from None
+
+    def unit(self, ref: str) -> dict:
+        """Get a citable unit by its ref (identifier)"""
+        return self.units[self.position(ref)]
+
+    def parent(self, ref: str) -> dict:
+        """Get the parent of a unit, None for units on the top level"""
+        parent = self.parents[self.position(ref)]
+        return self.units[parent] if parent >= 0 else None
+
+    def children_of(self, ref: str = None) -> list:
+        """Get the children of a unit, or the units on the top level if no ref is given"""
+        indices = self.roots if ref is None else self.children[self.position(ref)]
+        return [self.units[i] for i in indices]
+
+    def descendants(self, ref: str = None, down: int = -1) -> list:
+        """Get the descendants of a unit (or of the resource) in document order
+
+        Args:
+            ref (str, optional): Identifier of the unit. Defaults to the whole resource.
+            down (int, optional): Maximum depth below the unit; -1 includes all descendants. Defaults to -1.
+        """
+        if ref is None:
+            start, end, level = 0, len(self.units), 0
+        else:
+            i = self.position(ref)
+            start, end, level = i + 1, self.ends[i], self.levels[i]
+        if down is None or down < 0:
+            return self.units[start:end]
+        return [self.units[i] for i in range(start, end) if self.levels[i] <= level + down]
+
+    def by_cite_type(self, cite_type: str, ref: str = None) -> list:
+        """Get the units of a citeType (e.g. "act", "scene", "speech") in document order, optionally below a unit"""
+        indices = self.cite_types.get(cite_type, np.zeros(0, dtype=np.int64))
+        if ref is not None:
+            i = self.position(ref)
+            indices = indices[(indices > i) & (indices < self.ends[i])]
+        return [self.units[i] for i in indices.tolist()]
+
+    def speakers(self, ref: str = None) -> list:
+        """Get the distinct speakers of the speeches of a unit (e.g. a scene) in the order of their first speech"""
+        if ref is None:
+            start, end = 0, len(self.units)
+        else:
+            i = self.position(ref)
+            start, end = i, self.ends[i]
+        return list(dict.fromkeys(speaker for i in range(start, end) for speaker in self.__speakers[i]))
+
+    def search(self, pattern: str, cite_type: str = "speech", flags: int = re.IGNORECASE) -> list:
+        """Get the units whose snippet matches a regular expression"""
+        expression = re.compile(pattern, flags)
+        return [self.units[i] for i in self.cite_types.get(cite_type, np.zeros(0, dtype=np.int64)).tolist()
+                if expression.search(self.units[i].get("extensions", {}).get("snippet", ""))]
+
+    def navigation(self, ref: str = None, start: str = None, end: str = None, down: int = None) -> dict:
+        """Answer a navigation query from the index with the shape of the response of the API
+
+        Args:
+            ref (str, optional): Identifier of a unit; the response holds the unit and, with down, its descendants.
+            start (str, optional): Identifier of the first unit of a range (together with end).
+            end (str, optional): Identifier of the last unit of a range; the descendants of the units
+                in the range are included up to the depth down.
+            down (int, optional): Depth of the members below the unit, the range or the resource;
+                -1 includes all levels.
+
+        Raises:
+            ValueError: The combination of the parameters is not valid.
+        """
+        params = {"resource": self.resource_id}
+        response = {key: self.response[key] for key in ("@context", "dtsVersion") if key in self.response}
+        response["@type"] = "Navigation"
+
+        if ref is not None:
+            if start is not None or end is not None:
+                raise ValueError("ref cannot be combined with start and end.")
+            params["ref"] = ref
+            response["ref"] = self.unit(ref)
+            members = self.descendants(ref, down) if down is not None else None
+        elif start is not None or end is not None:
+            if start is None or end is None:
+                raise ValueError("start and end must be given together.")
+            params.update(start=start, end=end)
+            first, last = self.position(start), self.position(end)
+            if last < first:
+                raise ValueError(f"{end} precedes {start}.")
+            level = self.levels[first]
+            response["start"], response["end"] = self.units[first], self.units[last]
+            if down is None:
+                members = [self.units[i] for i in range(first, last + 1) if self.levels[i] == level]
+            else:
+                members = [self.units[i] for i in range(first, self.ends[last])
+                           if down < 0 or self.levels[i] <= level + down]
+        else:
+            if down is None:
+                raise ValueError("down is required without ref, start and end.")
+            members = self.descendants(None, down)
+
+        if down is not None:
+            params["down"] = down
+        response["@id"] = f"{self.api_base_url}dts/navigation?{urlencode(params, safe=':/[]')}"
+        response["resource"] = self.resource
+        if members is not None:
+            response["member"] = members
+        return response
+
+
+class DTSClient:
+    """Client of the DTS navigation endpoint that requests the citation tree of each resource once
+    """
+
+    def __init__(self,
+                 api_base_url: str = DTS_API_BASE_URL,
+                 resource_base_url: str = DTS_RESOURCE_BASE_URL,
+                 session: requests.Session = None,
+                 cache_dir: str = None):
+        """
+
+        Args:
+            api_base_url (str, optional): Base URL of the API. Defaults to the staging server.
+            resource_base_url (str, optional): Base of the URIs of the plays.
+            session (requests.Session, optional): Session used to send the requests.
+            cache_dir (str, optional): Folder of the navigation responses stored as JSON files. Responses
+                are only kept in memory if not set.
+        """
+        self.api_base_url = api_base_url
+        self.resource_base_url = resource_base_url
+        self.session = session if session is not None else create_session()
+        self.cache_dir = cache_dir
+        self.__indexes = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def request(self, resource: str, **params) -> dict:
+        """Send a navigation request to the API, e.g. request("ger000001", ref="body", down=1)"""
+        params = {key: value for key, value in params.items() if value is not None}
+        params["resource"] = resource_uri(resource, self.resource_base_url)
+        return api_get(session=self.session, api_base_url=self.api_base_url, method="dts/navigation",
+                       params=params, parse_json=True)
+
+    def path(self, resource: str) -> str:
+        """Get the path of the cached navigation response of a resource"""
+        name = re.sub(r"[^\w.-]+", "_", resource_uri(resource, self.resource_base_url).split("://", 1)[-1])
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def index(self, resource: str, refresh: bool = False) -> NavigationIndex:
+        """Get the index of a resource, requesting its complete citation tree if it is not cached
+
+        Args:
+            resource (str): Id of the play (e.g. "ger000001") or URI of the resource.
+            refresh (bool, optional): Request the citation tree again. Defaults to False.
+        """
+        uri = resource_uri(resource, self.resource_base_url)
+        if not refresh and uri in self.__indexes:
+            return self.__indexes[uri]
+
+        path = self.path(uri) if self.cache_dir is not None else None
+        if not refresh and path is not None and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                response = json.load(f)
+        else:
+            response = self.request(uri, down=-1)
+            if path is not None:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(response, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+
+        index = self.__indexes[uri] = NavigationIndex(response, api_base_url=self.api_base_url)
+        return index
+
+    def navigation(self, resource: str, ref: str = None, start: str = None, end: str = None,
+                   down: int = None) -> dict:
+        """Answer a navigation query from the index of the resource, see NavigationIndex.navigation"""
+        return self.index(resource).navigation(ref=ref, start=start, end=end, down=down)
+
+    def clear(self):
+        """Remove the indexes from memory; cached files are kept"""
+        self.__indexes.clear()
@@ -0,0 +1,257 @@
+"""Catalog of all resources (plays) of the DTS collection endpoint in one table
+
+The DTS notebook requests /dts/collection by hand for the root, for a corpus and for plays with hard-coded ids, and
+every id that has to be resolved to a play costs another request. The crawler walks the collections from the root
+through every corpus to every play, following the pages of a collection ("view" → "next") if the server splits it.
+Corpora and plays are requested concurrently with a bounded number of workers. Responses are stored with their ETag,
+so a later crawl revalidates them (If-None-Match) and only downloads what changed. The result is a columnar catalog
+with one row per play: the DraCor id (e.g. "ger000001"), corpus and play name, title, creator, the download URL and
+URI templates, the fields of "extensions" (numOfSegments, yearNormalized, ...) and the shape of the citation tree.
+It is saved as a Parquet file; resolving an id to a play is a lookup in the loaded table.
+
+Example:
+    >>> catalog = DTSCatalog("data/dts")
+    >>> catalog.crawl(max_workers=8)
+    >>> catalog.resolve("ger000088")["playname"]
+    'lessing-emilia-galotti'
+    >>> catalog.table.groupby("citationTree").size()
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import pandas as pd
+import requests
+
+from .api import create_session
+from .dts import DTS_API_BASE_URL, DTS_RESOURCE_BASE_URL, members_of, resource_uri
+
+# Corpus and play name in the download URL of a resource, e.g. .../corpora/ger/plays/lessing-emilia-galotti/tei
+DOWNLOAD_URL_PATTERN = re.compile(r"/corpora/(?P<corpus>[^/]+)/plays/(?P<playname>[^/]+)/tei$")
+
+
+def citation_tree_shape(cite_structures: list) -> str:
+    """Get a compact notation of the citeTypes of a citation tree
+
+    Args:
+        cite_structures (list): "citeStructure" of a citation tree.
+
+    Returns:
+        str: e.g. "front(front,dramatis_personae,setting),body(act(scene(speech,stage_direction)))".
+    """
+    return ",".join(f"{structure.get('citeType')}({citation_tree_shape(structure['citeStructure'])})"
+                    if structure.get("citeStructure") else str(structure.get("citeType"))
+                    for structure in cite_structures)
+
+
+def resource_record(resource: dict, corpus_id: str = None) -> dict:
+    """Flatten a Resource object of the collection endpoint to one row of the catalog
+
+    Args:
+        resource (dict): Resource object, as a member of a corpus or requested by its id.
+        corpus_id (str, optional): URI of the collection the resource was listed in.
+    """
+    uri = resource["@id"]
+    match = DOWNLOAD_URL_PATTERN.search(resource.get("download", ""))
+    dublin_core = resource.get("dublinCore", {})
+    record = {
+        "id": uri.rstrip("/").rsplit("/", 1)[-1],
+        "uri": uri,
+        "corpus": match["corpus"] if match else (corpus_id.rstrip("/").rsplit("/", 1)[-1] if corpus_id else None),
+        "playname": match["playname"] if match else None,
+        "title": resource.get("title"),
+        "creator": "; ".join(dublin_core["creator"]) if isinstance(dublin_core.get("creator"), list)
+        else dublin_core.get("creator"),
+        "language": dublin_core.get("language"),
+        "download": resource.get("download"),
+        "document": resource.get("document"),
+        "navigation": resource.get("navigation"),
+    }
+    for key, value in resource.get("extensions", {}).items():
+        if not key.startswith("@"):
+            record[key] = value
+
+    citation_trees = resource.get("citationTrees")
+    if citation_trees:
+        record["maxCiteDepth"] = citation_trees[0].get("maxCiteDepth")
+        record["citationTree"] = citation_tree_shape(citation_trees[0].get("citeStructure", []))
+    return record
+
+
+class DTSCatalog:
+    """Crawler of the DTS collection endpoint and catalog of the resources it lists
+    """
+
+    def __init__(self,
+                 directory: str = "data/dts",
+                 api_base_url: str = DTS_API_BASE_URL,
+                 resource_base_url: str = DTS_RESOURCE_BASE_URL,
+                 session: requests.Session = None):
+        """
+
+        Args:
+            directory (str, optional): Folder of the catalog and of the cached responses. Defaults to "data/dts".
+            api_base_url (str, optional): Base URL of the API. Defaults to the staging server.
+            resource_base_url (str, optional): Base of the URIs of the corpora and plays.
+            session (requests.Session, optional): Session used to send the requests.
+        """
+        self.directory = directory
+        self.api_base_url = api_base_url
+        self.resource_base_url = resource_base_url
+        self.__session = session if session is not None else create_session()
+        self.__table = None
+        self.num_requests = 0
+        self.num_not_modified = 0
+
+    @property
+    def catalog_path(self) -> str:
+        """Path of the catalog"""
+        return os.path.join(self.directory, "catalog.parquet")
+
+    def __response_path(self, url: str) -> str:
+        return os.path.join(self.directory, "responses", f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json")
+
+    def get(self, url: str) -> dict:
+        """Request a URL of the API, revalidating a stored response with its ETag
+
+        Raises:
+            requests.HTTPError: The server returned an error.
+        """
+        path = self.__response_path(url)
+        stored = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+
+        headers = {"If-None-Match": stored["etag"]} if stored is not None and stored.get("etag") else None
+        r = self.__session.get(url, headers=headers, timeout=60)
+        self.num_requests += 1
+        if r.status_code == 304:
+            self.num_not_modified += 1
+            return stored["data"]
+        r.raise_for_status()
+
+        data = r.json()
+        if r.headers.get("ETag"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"url": url, "etag": r.headers["ETag"], "data": data}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return data
+
+    def collection_url(self, collection_id: str = None) -> str:
+        """Get the URL of the collection endpoint for a collection or resource, or for the root collection"""
+        if collection_id is None:
+            return f"{self.api_base_url}dts/collection"
+        return f"{self.api_base_url}dts/collection?id={resource_uri(collection_id, self.resource_base_url)}"
+
+    def collection(self, collection_id: str = None) -> tuple:
+        """Get a collection and all its members, following its pages
+
+        Args:
+            collection_id (str, optional): URI or id of the collection (e.g. "ger"). Defaults to the root.
+
+        Returns:
+            tuple: (collection without the members, list of members)
+        """
+        url = self.collection_url(collection_id)
+        response = self.get(url)
+        members = members_of(response)
+        seen = {url}
+        next_url = response.get("view", {}).get("next")
+        while next_url and next_url not in seen:
+            seen.add(next_url)
+            page = self.get(urljoin(url, next_url))
+            members.extend(members_of(page))
+            next_url = page.get("view", {}).get("next")
+        return {key: value for key, value in response.items() if key != "member"}, members
+
+    def __corpus_records(self, corpus_id: str) -> list:
+        collection, members = self.collection(corpus_id)
+        records = [resource_record(member, corpus_id) for member in members if member.get("@type") == "Resource"]
+        logging.info(f"Listed {len(records)} resources of {collection.get('title', corpus_id)}.")
+        return records
+
+    def __citation_tree(self, uri: str) -> dict:
+        record = resource_record(self.get(self.collection_url(uri)))
+        return {"maxCiteDepth": record.get("maxCiteDepth"), "citationTree": record.get("citationTree")}
+
+    def crawl(self, corpora: list = None, citation_trees: bool = True, max_workers: int = 8) -> pd.DataFrame:
+        """Walk the collections from the root to the plays and save the catalog
+
+        Args:
+            corpora (list, optional): Names of the corpora to include, e.g. ["ger", "tat"]. Defaults to all.
+            citation_trees (bool, optional): Request every play to get its citation tree, which is not part of
+                the members of a corpus. Defaults to True.
+            max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+        Returns:
+            pd.DataFrame: The catalog, one row per resource.
+        """
+        self.num_requests = self.num_not_modified = 0
+        _, members = self.collection()
+        corpus_ids = [member["@id"] for member in members
+                      if corpora is None or member["@id"].rstrip("/").rsplit("/", 1)[-1] in corpora]
+        logging.info(f"Crawling {len(corpus_ids)} collections.")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            records = [record for corpus_records in executor.map(self.__corpus_records, corpus_ids)
+                       for record in corpus_records]
+            if citation_trees:
+                missing = [i for i, record in enumerate(records) if "citationTree" not in record]
+                for i, tree in zip(missing, executor.map(self.__citation_tree,
+                                                         [records[i]["uri"] for i in missing])):
+                    records[i].update(tree)
+
+        table = pd.DataFrame(records).convert_dtypes()
+        logging.info(f"Catalog of {len(table)} resources from {self.num_requests} requests "
+                     f"({self.num_not_modified} not modified).")
+        self.save(table)
+        return self.table
+
+    def save(self, table: pd.DataFrame):
+        """Write the catalog to catalog_path"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.catalog_path}.tmp"
+        table.to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, self.catalog_path)
+        self.__table = table.set_index("id", drop=False)
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """The catalog indexed by id, loaded from catalog_path on first access
+
+        Raises:
+            FileNotFoundError: The catalog has not been crawled yet.
+        """
+        if self.__table is None:
+            if not os.path.exists(self.catalog_path):
+                raise FileNotFoundError(f"No catalog at {self.catalog_path}, crawl it first.")
+            self.__table = pd.read_parquet(self.catalog_path).set_index("id", drop=False)
+        return self.__table
+
+    def resolve(self, play_id: str) -> pd.Series:
+        """Get the catalog entry of a play by its DraCor id (e.g. "ger000001") or URI
+
+        Raises:
+            KeyError: The play is not in the catalog.
+        """
+        play_id = play_id.rstrip("/").rsplit("/", 1)[-1]
+        try:
+            return self.table.loc[play_id]
+        except KeyError:
+            raise KeyError(f"{play_id} is not in the catalog.") from None
+
+    def play_id(self, corpusname: str, playname: str) -> str:
+        """Get the DraCor id of a play from its corpus and name"""
+        table = self.table
+        matches = table.index[(table["corpus"] == corpusname) & (table["playname"] == playname)]
+        if len(matches) == 0:
+            raise KeyError(f"Play '{playname}' of corpus '{corpusname}' is not in the catalog.")
+        return matches[0]
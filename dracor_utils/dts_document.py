@@ -0,0 +1,244 @@
+"""Speeches and stage directions of passages of plays streamed from the DTS document endpoint
+
+The DTS notebook requests /dts/document once per speech and parses every response with etree.fromstring, which
+took minutes for the speeches of one play. A passage can instead be requested as a whole, by the ref of a unit
+(e.g. an act, "body/div[5]") or by a range of units (start and end). Here the response is parsed while it is
+downloaded with lxml's iterparse: every <sp> and <stage> is turned into a small record (speakers, speaker label,
+text) as soon as it is complete and removed from the tree, so a passage of any size is parsed in bounded memory.
+Passages are cached as files by (resource, ref) or (resource, start, end), so repeated analyses don't send requests.
+Many passages (e.g. one act of every play of a corpus) are downloaded concurrently ahead of the parser.
+
+Example:
+    >>> client = DTSDocumentClient(cache_dir="data/dts/documents")
+    >>> for item in client.passage("ger000001", ref="body/div[5]"):
+    ...     if item.type == "speech" and "iphigenie" in item.who:
+    ...         lines.extend(item.text.split("\\n"))
+    >>> items = client.passages([(play_id, "body/div[1]") for play_id in play_ids], max_workers=8)
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterable, Iterator
+
+import requests
+
+from .api import create_session
+from .dts import DTS_API_BASE_URL, DTS_RESOURCE_BASE_URL, resource_uri
+
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+
+# Elements with the lines of a speech (as the xPath "//tei:l/text()|tei:p/text()" in the notebook)
+LINE_TAGS = (f"{{{TEI_NAMESPACE}}}l", f"{{{TEI_NAMESPACE}}}p", f"{{{TEI_NAMESPACE}}}ab")
+SP_TAG = f"{{{TEI_NAMESPACE}}}sp"
+STAGE_TAG = f"{{{TEI_NAMESPACE}}}stage"
+SPEAKER_TAG = f"{{{TEI_NAMESPACE}}}speaker"
+
+# A speech or stage direction of a passage. "who" holds the ids of the speakers (without "#"), "speaker" the label
+# of the speech as printed (e.g. "ARKAS."), "text" the lines of a speech or the text of a stage direction separated
+# by line breaks. "position" counts the records of the passage from 0; "in_speech" marks stage directions in a speech.
+PassageItem = namedtuple("PassageItem", ["resource", "ref", "position", "type", "who", "speaker", "text", "in_speech"])
+
+
+def _text(element, skip: tuple = (STAGE_TAG,)) -> str:
+    """Get the text of an element without the text of nested elements with the tags skip"""
+    parts = [element.text or ""]
+    for child in element:
+        if child.tag not in skip:
+            parts.append(_text(child, skip))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def iter_passage(source: BinaryIO, resource: str = None, ref: str = None) -> Iterator[PassageItem]:
+    """Parse a TEI passage incrementally and yield its speeches and stage directions
+
+    Args:
+        source: File name or binary file object of the response of the document endpoint
+            (or of a complete TEI document).
+        resource (str, optional): URI of the resource, added to the records.
+        ref (str, optional): Reference of the passage, added to the records.
+
+    Yields:
+        PassageItem: Speeches and stage directions in the order in which they end; stage directions inside
+            a speech are yielded before the speech.
+    """
+    from lxml import etree
+
+    position = 0
+    for _, element in etree.iterparse(source, events=("end",), tag=(SP_TAG, STAGE_TAG), huge_tree=True):
+        in_speech = any(ancestor.tag == SP_TAG for ancestor in element.iterancestors())
+        if element.tag == SP_TAG:
+            speaker = element.find(SPEAKER_TAG)
+            lines = [_normalize(_text(line)) for line in element.iter(*LINE_TAGS)]
+            yield PassageItem(resource, ref, position, "speech",
+                              [who.lstrip("#") for who in element.get("who", "").split()],
+                              _normalize(_text(speaker)) if speaker is not None else None,
+                              "\n".join(line for line in lines if line), False)
+        else:
+            yield PassageItem(resource, ref, position, "stage_direction", [], None,
+                              _normalize(_text(element, skip=())), in_speech)
+        position += 1
+
+        # Stage directions in speeches are still needed for the text of the speech and are removed with it.
+        # Elements before the record and before its ancestors (e.g. previous scenes) have been parsed already.
+        if not in_speech:
+            element.clear(keep_tail=True)
+            for node in (element, *element.iterancestors()):
+                parent = node.getparent()
+                while parent is not None and node.getprevious() is not None:
+                    del parent[0]
+
+
+class DTSDocumentClient:
+    """Client of the DTS document endpoint that caches passages as files and parses them incrementally
+    """
+
+    def __init__(self,
+                 api_base_url: str = DTS_API_BASE_URL,
+                 resource_base_url: str = DTS_RESOURCE_BASE_URL,
+                 session: requests.Session = None,
+                 cache_dir: str = None,
+                 timeout: float = 120):
+        """
+
+        Args:
+            api_base_url (str, optional): Base URL of the API. Defaults to the staging server.
+            resource_base_url (str, optional): Base of the URIs of the plays.
+            session (requests.Session, optional): Session used to send the requests.
+            cache_dir (str, optional): Folder of the cached passages. Passages are streamed without
+                being stored if not set.
+            timeout (float, optional): Timeout of a single request in seconds. Defaults to 120.
+        """
+        self.api_base_url = api_base_url
+        self.resource_base_url = resource_base_url
+        self.session = session if session is not None else create_session()
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+
+    @staticmethod
+    def __params(resource: str, ref: str, start: str, end: str) -> dict:
+        if ref is not None and (start is not None or end is not None):
+            raise ValueError("ref cannot be combined with start and end.")
+        if (start is None) != (end is None):
+            raise ValueError("start and end must be given together.")
+        params = {"resource": resource}
+        params.update({key: value for key, value in (("ref", ref), ("start", start), ("end", end))
+                       if value is not None})
+        return params
+
+    def path(self, resource: str, ref: str = None, start: str = None, end: str = None,
+             directory: str = None) -> str:
+        """Get the path of the cached passage of a resource, in the cache folder or in another folder"""
+        params = self.__params(resource_uri(resource, self.resource_base_url), ref, start, end)
+        key = "\t".join(f"{name}={value}" for name, value in sorted(params.items()))
+        return os.path.join(directory or self.cache_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.xml")
+
+    def __request(self, params: dict) -> requests.Response:
+        r = self.session.get(f"{self.api_base_url}dts/document", params=params, stream=True, timeout=self.timeout)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return r
+
+    def fetch(self, resource: str, ref: str = None, start: str = None, end: str = None,
+              directory: str = None) -> str:
+        """Download a passage to the cache (or to another folder) unless it is there already
+
+        Args:
+            resource (str): Id of the play (e.g. "ger000001") or URI of the resource.
+            ref (str, optional): Reference of the passage, e.g. "body/div[5]". Defaults to the whole play.
+            start (str, optional): Reference of the first unit of a range.
+            end (str, optional): Reference of the last unit of a range.
+            directory (str, optional): Folder to store the passage in. Defaults to the cache folder.
+
+        Returns:
+            str: Path of the file.
+        """
+        uri = resource_uri(resource, self.resource_base_url)
+        params = self.__params(uri, ref, start, end)
+        path = self.path(uri, ref, start, end, directory=directory)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self.__request(params) as r, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1 << 16)
+        os.replace(tmp_path, path)
+        return path
+
+    def passage(self, resource: str, ref: str = None, start: str = None, end: str = None) -> Iterator[PassageItem]:
+        """Get the speeches and stage directions of a passage, see iter_passage
+
+        Without a cache folder the response is parsed while it is downloaded.
+
+        Args:
+            resource (str): Id of the play (e.g. "ger000001") or URI of the resource.
+            ref (str, optional): Reference of the passage, e.g. "body/div[5]". Defaults to the whole play.
+            start (str, optional): Reference of the first unit of a range.
+            end (str, optional): Reference of the last unit of a range.
+        """
+        uri = resource_uri(resource, self.resource_base_url)
+        label = ref if start is None else f"{start}..{end}"
+        if self.cache_dir is not None:
+            yield from iter_passage(self.fetch(uri, ref, start, end), uri, label)
+            return
+        with self.__request(self.__params(uri, ref, start, end)) as r:
+            yield from iter_passage(r.raw, uri, label)
+
+    def passages(self, passages: Iterable[tuple], max_workers: int = 4) -> Iterator[PassageItem]:
+        """Get the speeches and stage directions of many passages, downloading them concurrently
+
+        At most twice as many passages as there are workers are downloaded ahead of the parser, so memory and
+        disk use stay bounded if no cache folder is set (downloaded passages are then removed after parsing).
+
+        Args:
+            passages: Tuples (resource, ref) or (resource, ref, start, end).
+            max_workers (int, optional): Maximum number of concurrent requests. Defaults to 4.
+
+        Yields:
+            PassageItem: Records of the passages in the order of the input. Passages that can't be
+                downloaded are logged and skipped.
+        """
+        passages = iter(passages)
+        with tempfile.TemporaryDirectory(prefix="dts-") as tmp_dir, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            directory = self.cache_dir or tmp_dir
+            pending = []
+            exhausted = False
+            num_failed = 0
+            while True:
+                while not exhausted and len(pending) < 2 * max_workers:
+                    try:
+                        resource, ref, start, end = (tuple(next(passages)) + (None, None))[:4]
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(self.fetch, resource, ref, start, end, directory)
+                    pending.append((resource, ref, start, end, future))
+                if not pending:
+                    break
+
+                resource, ref, start, end, future = pending.pop(0)
+                try:
+                    path = future.result()
+                except requests.RequestException as e:
+                    num_failed += 1
+                    logging.warning(f"Could not download passage {ref or f'{start}..{end}'} of {resource}: {e}")
+                    continue
+                yield from iter_passage(path, resource_uri(resource, self.resource_base_url),
+                                        ref if start is None else f"{start}..{end}")
+                if self.cache_dir is None:
+                    os.remove(path)
+
+        if num_failed:
+            logging.info(f"{num_failed} passages could not be downloaded.")
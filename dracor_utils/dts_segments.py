@@ -0,0 +1,173 @@
+"""Segments of plays (as in the response of /corpora/{corpusname}/plays/{playname}) built from DTS navigation data
+
+The end of the DTS notebook rebuilds the segments of one play from the citable units returned with down=-1: it loops
+over the units, and for every scene searches all units again for the parent (for the title "act | scene") and for
+the speeches (for the speakers). Here the segments of a play are computed in one pass over the arrays of a
+NavigationIndex (dts.py): the segments are the acts and scenes that contain no scene, the act of a segment and of
+every speech is found through the parent array, and the speakers are the distinct speakers of the speeches of each
+segment in the order of their first speech. Plays are converted concurrently for whole corpora, and the number of
+segments and acts of every play can be checked against the metadata of the regular API (numOfSegments, numOfActs).
+
+Example:
+    >>> client = DTSClient(cache_dir="data/dts")
+    >>> play_ids = catalog.table.query("corpus == 'ger'")["id"]
+    >>> segments, failed = corpus_segments(play_ids, client=client)
+    >>> converted = [play_id for play_id in play_ids if play_id not in failed]
+    >>> validate_segments(segments, MetadataStore().load("ger"), converted).query("not segmentsMatch")
+    >>> segments_as_api(segments[segments["id"] == "ger000001"])[:2]
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .dts import DTSClient, NavigationIndex
+
+# citeTypes that divide a play into segments
+SEGMENT_CITE_TYPES = ("act", "scene")
+
+# Columns of a segment table
+SEGMENT_COLUMNS = ["number", "type", "act", "title", "speakers", "ref"]
+
+
+def _play_id(play_id: str) -> str:
+    """Get the DraCor id of a play from its id or the URI of its resource"""
+    return play_id.rstrip("/").rsplit("/", 1)[-1]
+
+
+def navigation_segments(index: NavigationIndex) -> pd.DataFrame:
+    """Get the segments of a play from the index of its citable units
+
+    Args:
+        index (NavigationIndex): Index of the complete navigation (down=-1) of the play.
+
+    Returns:
+        pd.DataFrame: One row per segment in document order with the columns "number" (from 1), "type" ("act" or
+            "scene"), "act" (number of the act, missing for scenes outside of acts), "title" (as in the regular API,
+            e.g. "Erster Aufzug | Erster Auftritt"), "speakers" (list) and "ref" (identifier of the unit).
+    """
+    num_units = len(index)
+    cite_types = np.array([unit.get("citeType") for unit in index.units], dtype=object)
+    titles = np.array([unit.get("dublinCore", {}).get("title") for unit in index.units], dtype=object)
+    parents = index.parents
+    is_act = cite_types == "act"
+    is_scene = cite_types == "scene"
+
+    # Segments are acts and scenes without scenes below them
+    contains_scene = np.zeros(num_units, dtype=bool)
+    scene_parents = parents[is_scene]
+    contains_scene[scene_parents[scene_parents >= 0]] = True
+    segments = np.flatnonzero(np.isin(cite_types, SEGMENT_CITE_TYPES) & ~contains_scene)
+    if len(segments) == 0:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS)
+
+    # Number of the act of every unit: propagate the act numbers down the ranges of the acts
+    acts = np.flatnonzero(is_act)
+    act_of = np.full(num_units, -1, dtype=np.int64)
+    for number, act in enumerate(acts.tolist(), start=1):
+        act_of[act:index.ends[act]] = number
+
+    # Segment of every unit; segments don't contain each other, so their ranges don't overlap
+    segment_ends = index.ends[segments]
+    positions = np.arange(num_units)
+    segment_of = np.searchsorted(segments, positions, side="right") - 1
+    inside = (segment_of >= 0) & (positions < segment_ends[np.maximum(segment_of, 0)])
+    segment_of[~inside] = -1
+
+    speeches = np.flatnonzero((cite_types == "speech") & (segment_of >= 0))
+    speaker_rows = [(segment_of[i], speaker) for i in speeches.tolist()
+                    for speaker in index.units[i].get("extensions", {}).get("speakers", [])]
+    speakers = pd.DataFrame(speaker_rows, columns=["segment", "speaker"]).drop_duplicates()
+    speakers = speakers.groupby("segment", sort=False)["speaker"].agg(list).reindex(range(len(segments)))
+
+    # The title of a scene is prefixed with the title of its parent, if the parent has a title
+    segment_parents = parents[segments]
+    parent_titles = np.where(segment_parents >= 0, titles[np.maximum(segment_parents, 0)], None)
+    segment_titles = [f"{parent} | {title}" if parent and is_scene[segment] and title else title
+                      for segment, parent, title in zip(segments.tolist(), parent_titles, titles[segments])]
+
+    return pd.DataFrame({
+        "number": np.arange(1, len(segments) + 1),
+        "type": cite_types[segments],
+        "act": pd.array(np.where(act_of[segments] > 0, act_of[segments], None), dtype="Int64"),
+        "title": segment_titles,
+        "speakers": [value if isinstance(value, list) else [] for value in speakers.tolist()],
+        "ref": np.asarray(index.refs, dtype=object)[segments],
+    }, columns=SEGMENT_COLUMNS)
+
+
+def segments_as_api(segments: pd.DataFrame) -> list:
+    """Convert a segment table of one play to the list of segments returned by the regular API"""
+    return [{"type": row.type, "title": row.title, "speakers": list(row.speakers), "number": int(row.number)}
+            for row in segments.itertuples()]
+
+
+def corpus_segments(play_ids: Iterable[str],
+                    client: DTSClient = None,
+                    max_workers: int = 8) -> tuple:
+    """Get the segments of many plays, requesting the navigation of each play once and concurrently
+
+    Args:
+        play_ids: DraCor ids of the plays (e.g. "ger000001") or URIs of the resources.
+        client (DTSClient, optional): Client used for the requests; its cached navigation is reused.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Returns:
+        tuple: (segments, failed). segments is a table with the column "id" and the columns of
+            navigation_segments; failed is a dictionary {play id: error} of the plays that could not be converted.
+    """
+    client = client if client is not None else DTSClient()
+    play_ids = list(play_ids)
+
+    def convert(play_id):
+        try:
+            return play_id, navigation_segments(client.index(play_id)), None
+        except (requests.RequestException, ValueError, KeyError) as e:
+            return play_id, None, f"{type(e).__name__}: {e}"
+
+    tables = []
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for play_id, table, error in executor.map(convert, play_ids):
+            if error is not None:
+                logging.warning(f"Could not convert the navigation of {play_id}: {error}")
+                failed[play_id] = error
+            else:
+                tables.append(table.assign(id=_play_id(play_id)))
+
+    logging.info(f"Converted the navigation of {len(tables)} of {len(play_ids)} plays.")
+    segments = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=SEGMENT_COLUMNS + ["id"])
+    return segments[["id"] + SEGMENT_COLUMNS], failed
+
+
+def validate_segments(segments: pd.DataFrame, metadata: pd.DataFrame, play_ids: Iterable[str] = None) -> pd.DataFrame:
+    """Compare the number of segments and acts of the converted plays with the metadata of the plays
+
+    Args:
+        segments (pd.DataFrame): Segments of many plays as returned by corpus_segments.
+        metadata (pd.DataFrame): Metadata with the columns "id" and "numOfSegments" and optionally "numOfActs",
+            e.g. from MetadataStore.load or the catalog of DTSCatalog.
+        play_ids (optional): Ids or URIs of all converted plays, as passed to corpus_segments, so plays whose
+            navigation has no segments are compared as well (with 0 segments). Defaults to the plays in segments.
+
+    Returns:
+        pd.DataFrame: One row per converted play with the expected and the converted numbers and the columns
+            "segmentsMatch" and "actsMatch".
+    """
+    converted = segments.groupby("id").agg(dtsNumOfSegments=("number", "size"), dtsNumOfActs=("act", "nunique"))
+    if play_ids is not None:
+        ids = pd.Index([_play_id(play_id) for play_id in play_ids], name="id")
+        converted = converted.reindex(ids.union(converted.index), fill_value=0)
+    expected = [column for column in ("numOfSegments", "numOfActs") if column in metadata]
+    result = converted.join(metadata.drop_duplicates("id").set_index("id")[expected], how="left")
+    result["segmentsMatch"] = result["dtsNumOfSegments"] == result["numOfSegments"]
+    if "numOfActs" in result:
+        # Plays without acts have numOfActs 0
+        result["actsMatch"] = result["dtsNumOfActs"] == result["numOfActs"].fillna(0)
+    mismatches = (~result["segmentsMatch"]).sum()
+    logging.info(f"The number of segments of {mismatches} of {len(result)} plays does not match the metadata.")
+    return result.reset_index()
@@ -0,0 +1,310 @@
+"""Co-occurrence network metrics after every segment of a play
+
+network_metrics.py computes the metrics of the final network of a play. To follow how the network evolves, the
+segments are walked in order and the network is updated with the speakers of each segment instead of being rebuilt
+from the first segment for every prefix (which is quadratic in the number of segments):
+
+* edge weights, degrees and the number of edges are updated for the pairs of speakers of the new segment,
+* components are maintained with a union-find structure (number of components, size of the largest),
+* eigenvector centrality is re-estimated with a few power iterations started from the previous vector,
+* closeness is recomputed only when an edge or a character was added; above a number of present characters it is
+  estimated from the distances to a sample of pivot characters.
+
+Metrics refer to the characters that have spoken up to the segment. Many plays are processed on a pool of processes.
+
+Example:
+    >>> plays = [result.data for result in download_corpus("ger", None) if result.ok]
+    >>> segment_df, character_df = dynamic_metrics_batch(plays, corpusname="ger")
+    >>> segment_df.query("play == 'lessing-emilia-galotti'")[["segment", "numOfEdges", "density"]]
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from .network_metrics import _compact_play
+
+# Metrics of the network after each segment
+SEGMENT_METRICS = ["numOfNodes", "numOfEdges", "density", "numOfComponents", "largestComponent",
+                   "maxDegree", "averageDegree"]
+
+# Metrics of each character after each segment
+CHARACTER_METRICS = ["degree", "weightedDegree", "closeness", "eigenvector"]
+
+
+class DynamicNetwork:
+    """Co-occurrence network of a play that grows segment by segment
+    """
+
+    def __init__(self,
+                 character_ids: list,
+                 exact_closeness_below: int = 200,
+                 num_pivots: int = 32,
+                 power_iterations: int = 30,
+                 tolerance: float = 1e-6,
+                 seed: int = 42):
+        """
+
+        Args:
+            character_ids (list): Identifiers of the characters of the play. Speakers of segments that are not
+                in the list are ignored.
+            exact_closeness_below (int, optional): Compute closeness exactly while fewer characters are present,
+                otherwise estimate it from pivots. Defaults to 200.
+            num_pivots (int, optional): Number of pivots of the closeness estimate. Defaults to 32.
+            power_iterations (int, optional): Maximum number of power iterations per segment. Defaults to 30.
+            tolerance (float, optional): Change of the eigenvector below which the iteration stops.
+            seed (int, optional): Seed of the sampling of pivots. Defaults to 42.
+        """
+        n = len(character_ids)
+        self.character_ids = list(character_ids)
+        self.__index = {character_id: i for i, character_id in enumerate(self.character_ids)}
+        self.exact_closeness_below = exact_closeness_below
+        self.num_pivots = num_pivots
+        self.power_iterations = power_iterations
+        self.tolerance = tolerance
+        self.__rng = np.random.default_rng(seed)
+
+        self.weights = np.zeros((n, n), dtype=np.int32)
+        self.degree = np.zeros(n, dtype=np.int32)
+        self.weighted_degree = np.zeros(n, dtype=np.int64)
+        self.present = np.zeros(n, dtype=bool)
+        self.num_edges = 0
+        self.num_segments = 0
+        # Union-find of the components
+        self.__parent = np.arange(n)
+        self.__size = np.ones(n, dtype=np.int64)
+        self.num_components = 0
+        self.largest_component = 0
+        self.eigenvector = np.zeros(n)
+        self.closeness = np.zeros(n)
+
+    def __find(self, i: int) -> int:
+        parent = self.__parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def __union(self, i: int, j: int):
+        root_i, root_j = self.__find(i), self.__find(j)
+        if root_i == root_j:
+            return
+        if self.__size[root_i] < self.__size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.__parent[root_j] = root_i
+        self.__size[root_i] += self.__size[root_j]
+        self.num_components -= 1
+        self.largest_component = max(self.largest_component, int(self.__size[root_i]))
+
+    def add_segment(self, speakers: Iterable[str]) -> bool:
+        """Add the co-occurrences of the speakers of the next segment
+
+        Segments without speakers of the cast (e.g. scenes with only stage directions) only count as segments.
+
+        Returns:
+            bool: True if the structure of the network changed (new character or new edge).
+
+        Example:
+            >>> network = DynamicNetwork(["a", "b"])
+            >>> network.add_segment(["a", "b"]), network.add_segment([]), network.add_segment(["x"])
+            (True, False, False)
+            >>> network.segment_metrics()["numOfEdges"], network.num_segments
+            (1, 3)
+        """
+        self.num_segments += 1
+        members = np.unique(np.fromiter((self.__index[speaker] for speaker in speakers if speaker in self.__index),
+                                        dtype=np.int64))
+        new_nodes = members[~self.present[members]]
+        self.present[new_nodes] = True
+        self.num_components += len(new_nodes)
+        if len(new_nodes):
+            self.largest_component = max(self.largest_component, 1)
+        if len(members) < 2:
+            return len(new_nodes) > 0
+
+        rows, cols = np.triu_indices(len(members), k=1)
+        sources, targets = members[rows], members[cols]
+        new_edges = self.weights[sources, targets] == 0
+        self.weights[sources, targets] += 1
+        self.weights[targets, sources] += 1
+        np.add.at(self.weighted_degree, members, len(members) - 1)
+        np.add.at(self.degree, sources[new_edges], 1)
+        np.add.at(self.degree, targets[new_edges], 1)
+        self.num_edges += int(new_edges.sum())
+        for source, target in zip(sources[new_edges].tolist(), targets[new_edges].tolist()):
+            self.__union(source, target)
+        return len(new_nodes) > 0 or bool(new_edges.any())
+
+    def __update_eigenvector(self):
+        """Continue the power iteration of the eigenvector centrality from the previous vector"""
+        present = np.flatnonzero(self.present)
+        if len(present) == 0:
+            return
+        adjacency = (self.weights[np.ix_(present, present)] > 0).astype(float)
+        vector = self.eigenvector[present]
+        vector = np.where(vector > 0, vector, 1 / np.sqrt(len(present)))
+        vector /= np.linalg.norm(vector)
+        for _ in range(self.power_iterations):
+            # Shifted by the identity, so the iteration also converges for bipartite networks
+            updated = adjacency @ vector + vector
+            updated /= np.linalg.norm(updated)
+            converged = np.abs(updated - vector).max() < self.tolerance
+            vector = updated
+            if converged:
+                break
+        self.eigenvector[:] = 0
+        self.eigenvector[present] = vector
+
+    def __update_closeness(self):
+        """Compute (or estimate) the closeness of the present characters within their components"""
+        present = np.flatnonzero(self.present)
+        n = len(present)
+        self.closeness[:] = 0
+        if n <= 1:
+            return
+        adjacency = sparse.csr_matrix(self.weights[np.ix_(present, present)] > 0)
+        roots = np.array([self.__find(i) for i in present.tolist()])
+        component_size = self.__size[roots]
+
+        if n < self.exact_closeness_below:
+            distances = csgraph.shortest_path(adjacency, unweighted=True, directed=False)
+            reachable = np.isfinite(distances) & (distances > 0)
+            total = np.where(reachable, distances, 0).sum(axis=1)
+        else:
+            # Estimate the sum of distances within the component from the pivots of the same component
+            pivots = self.__rng.choice(n, size=min(self.num_pivots, n), replace=False)
+            distances = csgraph.shortest_path(adjacency, unweighted=True, directed=False, indices=pivots)
+            same = np.isfinite(distances) & (distances > 0)
+            num_pivots = same.sum(axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                total = np.where(num_pivots > 0, np.where(same, distances, 0).sum(axis=0) / num_pivots, 0) \
+                    * (component_size - 1)
+
+        reachable_count = component_size - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            closeness = np.where(total > 0, reachable_count / total * reachable_count / (n - 1), 0.0)
+        self.closeness[present] = closeness
+
+    def segment_metrics(self) -> dict:
+        """Get the metrics of the network after the last segment"""
+        n = int(self.present.sum())
+        return {
+            "numOfNodes": n,
+            "numOfEdges": self.num_edges,
+            "density": 2 * self.num_edges / (n * (n - 1)) if n > 1 else 0.0,
+            "numOfComponents": self.num_components,
+            "largestComponent": self.largest_component,
+            "maxDegree": int(self.degree.max()) if n else 0,
+            "averageDegree": 2 * self.num_edges / n if n else 0.0,
+        }
+
+    def walk(self, segment_speakers: Iterable[list], character_metrics: bool = True) -> tuple:
+        """Add the segments one after the other and get the metrics after each of them
+
+        Args:
+            segment_speakers: For each segment the list of the identifiers of its speakers.
+            character_metrics (bool, optional): Also get the metrics of the characters, see CHARACTER_METRICS.
+                Defaults to True.
+
+        Returns:
+            tuple: (segment table, character table). The segment table has the column "segment" (from 1) and the
+                columns in SEGMENT_METRICS; the character table (None if not requested) has the columns "segment",
+                "id" and the columns in CHARACTER_METRICS for the characters present after each segment.
+        """
+        segment_rows = []
+        character_frames = []
+        for speakers in segment_speakers:
+            changed = self.add_segment(speakers)
+            segment_rows.append({"segment": self.num_segments, **self.segment_metrics()})
+            if not character_metrics:
+                continue
+            # Weights change with every segment, the structure only with new characters or edges
+            self.__update_eigenvector()
+            if changed:
+                self.__update_closeness()
+            present = np.flatnonzero(self.present)
+            character_frames.append(pd.DataFrame({
+                "segment": self.num_segments,
+                "id": np.asarray(self.character_ids, dtype=object)[present],
+                "degree": self.degree[present],
+                "weightedDegree": self.weighted_degree[present],
+                "closeness": self.closeness[present],
+                "eigenvector": self.eigenvector[present],
+            }))
+
+        segments = pd.DataFrame(segment_rows, columns=["segment"] + SEGMENT_METRICS)
+        if not character_metrics:
+            return segments, None
+        characters = (pd.concat(character_frames, ignore_index=True) if character_frames
+                      else pd.DataFrame(columns=["segment", "id"] + CHARACTER_METRICS))
+        return segments, characters
+
+
+def _play_dynamic_metrics(args: tuple) -> tuple:
+    """Walk the segments of a play in a worker process
+
+    Returns:
+        tuple: (corpusname, playname, segment table, character table, error); the tables are None and error is
+            a message if the play failed.
+    """
+    corpusname, playname, character_ids, segment_speakers, options = args
+    character_metrics = options.pop("character_metrics", True)
+    try:
+        segments, characters = DynamicNetwork(character_ids, **options).walk(segment_speakers,
+                                                                             character_metrics=character_metrics)
+    except (ValueError, IndexError, KeyError, TypeError) as e:
+        return corpusname, playname, None, None, f"{type(e).__name__}: {e}"
+    segments.insert(0, "play", playname)
+    segments.insert(0, "corpus", corpusname)
+    if characters is not None:
+        characters.insert(0, "play", playname)
+        characters.insert(0, "corpus", corpusname)
+    return corpusname, playname, segments, characters, None
+
+
+def dynamic_metrics_batch(plays: Iterable[dict],
+                          corpusname: str = None,
+                          processes: int = None,
+                          chunksize: int = 8,
+                          character_metrics: bool = True,
+                          **options) -> tuple:
+    """Compute the metrics after every segment for many plays on a pool of processes
+
+    Args:
+        plays: Plays as returned by /corpora/{corpusname}/plays/{playname}, i.e. dictionaries with
+            the fields "name", "characters" and "segments".
+        corpusname (str, optional): Name of the corpus, used if a play does not include the field "corpus".
+        processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Number of plays sent to a worker at once. Defaults to 8.
+        character_metrics (bool, optional): Also compute the metrics of the characters. Defaults to True.
+        **options: Further arguments of DynamicNetwork, e.g. num_pivots.
+
+    Returns:
+        tuple: (segment table, character table) of all plays with the columns "corpus" and "play" added;
+            the character table is None if not requested. Plays that fail are logged and left out.
+    """
+    tasks = (_compact_play(play, corpusname) + (dict(options, character_metrics=character_metrics),)
+             for play in plays)
+    results = []
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for corpus, playname, segments, characters, error in executor.map(_play_dynamic_metrics, tasks,
+                                                                          chunksize=chunksize):
+            if error is not None:
+                num_failed += 1
+                logging.warning(f"Could not compute the metrics of play '{playname}' of corpus '{corpus}': {error}")
+            else:
+                results.append((segments, characters))
+    logging.info(f"Computed the metrics along the segments of {len(results)} plays, {num_failed} failed.")
+    if not results:
+        return pd.DataFrame(columns=["corpus", "play", "segment"] + SEGMENT_METRICS), None
+    segments = pd.concat([segments for segments, _ in results], ignore_index=True)
+    characters = pd.concat([characters for _, characters in results], ignore_index=True) if character_metrics else None
+    return segments, characters
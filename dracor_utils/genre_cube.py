@@ -0,0 +1,226 @@
+"""Aggregation of play metadata by genre and time period
+
+Replaces the per-row assignment of time periods (get_time_period_fit in the Genre Analysis notebook) with a
+vectorized lookup and computes all statistics of all metrics for all combinations of genre and time period at once.
+Computed cubes are cached by interval size. New plays update the cached cubes; only the cells (time period, genre)
+that received new plays are recomputed.
+
+Example:
+    >>> cube = GenreCube(metadata_df, metrics=["size", "density"])
+    >>> stats = cube.cube(interval_size=50, threshold=5)
+    >>> stats["size"]["median"].unstack().plot()
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Name of the column holding the time period
+TIME_PERIOD_KEY = "timePeriod"
+
+# Name of the column holding the number of plays in a cell of the cube
+PLAYS_KEY = "plays"
+
+
+def round_down_to_ten(x: int) -> int:
+    """Round a year down to the beginning of its decade"""
+    return x - x % 10
+
+
+def get_period_edges(earliest: int, latest: int, interval_size: int, start: int = None) -> np.ndarray:
+    """Get the boundaries of consecutive time periods of the same length
+
+    The first period starts at the decade of the earliest year (or at 'start'). Periods include their start
+    and exclude their end, the last period is the first one that includes the latest year.
+
+    Args:
+        earliest (int): Earliest year.
+        latest (int): Latest year.
+        interval_size (int): Length of a time period in years.
+        start (int, optional): Start of the first period. Defaults to the decade of the earliest year.
+
+    Returns:
+        np.ndarray: Boundaries [start, start + interval_size, ...]; period i is [edges[i], edges[i + 1]).
+    """
+    if interval_size <= 0:
+        raise ValueError("The size of the time intervals must be a positive number.")
+    if start is None:
+        start = round_down_to_ten(int(earliest))
+    num_periods = max(1, (int(latest) - start) // interval_size + 1)
+    return start + interval_size * np.arange(num_periods + 1)
+
+
+def get_period_labels(edges: np.ndarray) -> list:
+    """Get labels of the time periods in the form "start-end" as used in the Genre Analysis notebook"""
+    return [f"{edges[i]}-{edges[i + 1]}" for i in range(len(edges) - 1)]
+
+
+def assign_periods(years, edges: np.ndarray) -> np.ndarray:
+    """Get the number of the time period of each year
+
+    Args:
+        years: Years, missing years are NaN.
+        edges (np.ndarray): Boundaries of the time periods as returned by get_period_edges.
+
+    Returns:
+        np.ndarray: Number of the time period of each year, -1 if the year is missing or outside of all periods.
+    """
+    years = np.asarray(years, dtype=float)
+    codes = np.searchsorted(edges, years, side="right") - 1
+    codes[np.isnan(years) | (codes < 0) | (codes >= len(edges) - 1)] = -1
+    return codes
+
+
+def prepare_genres(metadata_df: pd.DataFrame,
+                   genre_key: str = "normalizedGenre",
+                   other_val: str = "Other",
+                   special_genre: str = "libretto") -> pd.DataFrame:
+    """Fill missing genres and set the genre of plays belonging to a special genre, as done in the notebook
+
+    Args:
+        metadata_df (pd.DataFrame): Metadata of the plays.
+        genre_key (str, optional): Column holding the genre. Defaults to "normalizedGenre".
+        other_val (str, optional): Genre of plays without genre information. Defaults to "Other".
+        special_genre (str, optional): Boolean column; plays where it is True get its name as genre.
+            Set to None to skip. Defaults to "libretto".
+    """
+    metadata_df = metadata_df.copy()
+    metadata_df[genre_key] = metadata_df[genre_key].astype(object).fillna(other_val)
+    if special_genre is not None and special_genre in metadata_df.columns:
+        metadata_df.loc[metadata_df[special_genre].fillna(False).astype(bool), genre_key] = special_genre
+    return metadata_df
+
+
+class GenreCube:
+    """Statistics of metadata metrics by time period and genre for any interval size
+    """
+
+    def __init__(self,
+                 metadata_df: pd.DataFrame,
+                 metrics: list,
+                 genre_key: str = "normalizedGenre",
+                 year_key: str = "yearNormalized",
+                 quantiles: tuple = (0.25, 0.75)):
+        """
+
+        Args:
+            metadata_df (pd.DataFrame): Metadata of the plays of one or more corpora.
+            metrics (list): Numeric columns to aggregate, e.g. ["size", "density"].
+            genre_key (str, optional): Column holding the genre. Defaults to "normalizedGenre".
+            year_key (str, optional): Column holding the year. Defaults to "yearNormalized".
+            quantiles (tuple, optional): Quantiles to compute in addition to the median. Defaults to (0.25, 0.75).
+        """
+        self.metrics = list(metrics)
+        self.genre_key = genre_key
+        self.year_key = year_key
+        self.quantiles = tuple(quantiles)
+        self.__data = self.__select(metadata_df)
+        # Computed cubes {(interval_size, start): (edges, cube)}
+        self.__cache = {}
+
+    def __select(self, metadata_df: pd.DataFrame) -> pd.DataFrame:
+        """Keep only the columns needed for the aggregation, with plain dtypes"""
+        data = pd.DataFrame({
+            self.genre_key: metadata_df[self.genre_key].astype(object).to_numpy(),
+            self.year_key: pd.to_numeric(metadata_df[self.year_key], errors="coerce").astype(float).to_numpy(),
+        })
+        for metric in self.metrics:
+            data[metric] = pd.to_numeric(metadata_df[metric], errors="coerce").astype(float).to_numpy()
+        return data
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """Genre, year and metrics of all plays that have been added"""
+        return self.__data
+
+    def __aggregate(self, data: pd.DataFrame, codes: np.ndarray, edges: np.ndarray) -> pd.DataFrame:
+        """Compute the statistics of the plays with a valid time period"""
+        labels = get_period_labels(edges)
+        valid = codes >= 0
+        data = data.loc[valid, [self.genre_key] + self.metrics].copy()
+        data[TIME_PERIOD_KEY] = pd.Categorical.from_codes(codes[valid], categories=labels, ordered=True)
+
+        grouped = data.groupby([TIME_PERIOD_KEY, self.genre_key], observed=True, sort=True)
+        stats = {
+            "count": grouped[self.metrics].count(),
+            "mean": grouped[self.metrics].mean(),
+            "median": grouped[self.metrics].median(),
+        }
+        for q in self.quantiles:
+            stats[f"q{round(q * 100)}"] = grouped[self.metrics].quantile(q)
+
+        cube = pd.concat(stats, axis=1).swaplevel(axis=1)
+        cube = cube.reindex(columns=pd.MultiIndex.from_product([self.metrics, list(stats)]))
+        cube[(PLAYS_KEY, "count")] = grouped.size()
+        return cube
+
+    def __compute(self, interval_size: int, start: int) -> tuple:
+        years = self.__data[self.year_key]
+        edges = get_period_edges(years.min(), years.max(), interval_size, start=start)
+        codes = assign_periods(years, edges)
+        return edges, self.__aggregate(self.__data, codes, edges)
+
+    def cube(self,
+             interval_size: int,
+             threshold: int = 0,
+             start: int = None,
+             exclude_genres: tuple = ()) -> pd.DataFrame:
+        """Get the statistics of the metrics for each combination of time period and genre
+
+        Args:
+            interval_size (int): Length of a time period in years.
+            threshold (int, optional): Minimum number of plays of a cell (time period, genre). Cells with fewer
+                plays are excluded. Defaults to 0.
+            start (int, optional): Start of the first period. Defaults to the decade of the earliest year.
+            exclude_genres (tuple, optional): Genres to exclude, e.g. ("Other",).
+
+        Returns:
+            pd.DataFrame: Rows indexed by (timePeriod, genre), columns by (metric, statistic) with the statistics
+                "count", "mean", "median" and the quantiles, e.g. "q25". The column ("plays", "count") holds
+                the number of plays of a cell.
+        """
+        key = (interval_size, start)
+        if key not in self.__cache:
+            logging.debug(f"Computing cube for interval size {interval_size}.")
+            self.__cache[key] = self.__compute(interval_size, start)
+        cube = self.__cache[key][1]
+
+        mask = cube[(PLAYS_KEY, "count")] >= threshold
+        if exclude_genres:
+            mask &= ~cube.index.get_level_values(self.genre_key).isin(exclude_genres)
+        return cube[mask]
+
+    def add(self, metadata_df: pd.DataFrame):
+        """Add plays and update the computed cubes
+
+        Only the cells (time period, genre) that receive new plays are recomputed. Cubes whose time periods
+        don't cover the years of the new plays are dropped and computed again when requested.
+
+        Args:
+            metadata_df (pd.DataFrame): Metadata of the new plays.
+        """
+        new_data = self.__select(metadata_df)
+        self.__data = pd.concat([self.__data, new_data], ignore_index=True)
+
+        for key, (edges, cube) in list(self.__cache.items()):
+            interval_size, start = key
+            years = self.__data[self.year_key]
+            if (start is None and round_down_to_ten(int(years.min())) != edges[0]) or years.max() >= edges[-1]:
+                del self.__cache[key]
+                continue
+
+            new_codes = assign_periods(new_data[self.year_key], edges)
+            touched = pd.DataFrame({"code": new_codes, "genre": new_data[self.genre_key]})
+            touched = touched[touched["code"] >= 0].drop_duplicates()
+            if touched.empty:
+                continue
+
+            # Recompute the touched cells from all plays in these cells
+            codes = assign_periods(years, edges)
+            in_touched = pd.MultiIndex.from_arrays([codes, self.__data[self.genre_key]]).isin(
+                pd.MultiIndex.from_frame(touched))
+            updated = self.__aggregate(self.__data[in_touched], codes[in_touched], edges)
+
+            cube = pd.concat([cube.drop(index=updated.index, errors="ignore"), updated])
+            self.__cache[key] = (edges, cube.sort_index())
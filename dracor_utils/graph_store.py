@@ -0,0 +1,305 @@
+"""Compact binary store of the relation and co-occurrence networks of a corpus
+
+The gender-visualization notebooks store two GraphML files per play and parse them again with networkx whenever
+another play is selected. This module parses the GraphML once when the data is fetched and stores the networks
+of all plays of a corpus in a single compressed NumPy archive:
+
+* a node table per play (identifier, label, gender, number of spoken words),
+* the relations as typed edges (source, target, relation, directed),
+* the co-occurrence network as weighted edges (source, target, weight),
+
+concatenated over all plays with offsets per play. Loading the networks of a play is a slice of these arrays.
+
+Example:
+    >>> fetch_graph_store("ger", "data/ger_graphs.npz")
+    >>> store = GraphStore("data/ger_graphs.npz")
+    >>> relations_graph = store.relations_graph("ger000088")
+"""
+
+import logging
+import os
+from collections import namedtuple
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from .api import DEFAULT_API_BASE_URL, GENDERS, api_get, create_session, gender_code
+from .downloader import download_plays
+
+GRAPHML_NAMESPACE = "{http://graphml.graphdrawing.org/xmlns}"
+
+# Codes of the relation types used in DraCor
+RELATIONS = ["parent_of", "lover_of", "related_with", "associated_with", "siblings", "spouses", "friends"]
+
+# Node and edge attributes in the GraphML exported by DraCor
+LABEL_ATTRIBUTE = "label"
+GENDER_ATTRIBUTE = "Gender"
+SPOKEN_WORDS_ATTRIBUTE = "Number of spoken words"
+RELATION_ATTRIBUTE = "Relation"
+WEIGHT_ATTRIBUTE = "Weight"
+
+PlayGraphs = namedtuple("PlayGraphs", ["nodes", "relations", "cooccurrence"])
+
+_GRAPHML_TYPES = {"int": int, "long": int, "float": float, "double": float,
+                  "boolean": lambda value: value.lower() == "true", "string": str}
+
+
+def parse_graphml(graphml: str) -> tuple:
+    """Parse nodes and edges of a GraphML document
+
+    Args:
+        graphml (str): GraphML document.
+
+    Returns:
+        tuple: List of nodes and list of edges as dictionaries of their attributes. Nodes include the field "id",
+            edges the fields "source", "target" and "directed".
+    """
+    root = ET.fromstring(graphml.encode("utf-8"))
+    keys = {}
+    for key in root.iter(f"{GRAPHML_NAMESPACE}key"):
+        keys[key.get("id")] = (key.get("attr.name", key.get("id")),
+                               _GRAPHML_TYPES.get(key.get("attr.type", "string"), str))
+
+    def attributes(element) -> dict:
+        values = {}
+        for data in element.iter(f"{GRAPHML_NAMESPACE}data"):
+            name, convert = keys.get(data.get("key"), (data.get("key"), str))
+            values[name] = convert(data.text or "")
+        return values
+
+    graph = root.find(f"{GRAPHML_NAMESPACE}graph")
+    default_directed = graph.get("edgedefault") == "directed"
+
+    nodes = [{"id": node.get("id"), **attributes(node)} for node in graph.iter(f"{GRAPHML_NAMESPACE}node")]
+    edges = []
+    for edge in graph.iter(f"{GRAPHML_NAMESPACE}edge"):
+        directed = edge.get("directed")
+        edges.append({"source": edge.get("source"),
+                      "target": edge.get("target"),
+                      "directed": default_directed if directed is None else directed == "true",
+                      **attributes(edge)})
+    return nodes, edges
+
+
+def _code(value, codes: list) -> int:
+    """Get the code of a categorical value, -1 if unknown"""
+    try:
+        return codes.index(value)
+    except ValueError:
+        return -1
+
+
+def write_graph_store(path: str, plays) -> int:
+    """Convert the GraphML of many plays and write them to a single compressed archive
+
+    Args:
+        path (str): Path of the archive (.npz).
+        plays: Iterable of tuples (play_id, relations_graphml, cooccurrence_graphml); relations_graphml is None
+            if there is no relation network for the play.
+
+    Returns:
+        int: Number of stored plays.
+    """
+    play_ids = []
+    has_relations = []
+    node_offsets = [0]
+    relation_offsets = [0]
+    cooccurrence_offsets = [0]
+    node_ids, labels, genders, spoken_words, in_relations = [], [], [], [], []
+    relation_sources, relation_targets, relation_types, relation_directed = [], [], [], []
+    cooccurrence_sources, cooccurrence_targets, cooccurrence_weights = [], [], []
+
+    for play_id, relations_graphml, cooccurrence_graphml in plays:
+        cooccurrence_nodes, cooccurrence_edges = parse_graphml(cooccurrence_graphml)
+        relation_nodes, relation_edges = parse_graphml(relations_graphml) if relations_graphml else ([], [])
+
+        # The nodes of both networks are stored in a single table, indexed per play
+        index = {}
+        relation_node_ids = {node["id"] for node in relation_nodes}
+        for node in cooccurrence_nodes + relation_nodes:
+            if node["id"] in index:
+                continue
+            index[node["id"]] = len(index)
+            node_ids.append(node["id"])
+            labels.append(node.get(LABEL_ATTRIBUTE, node["id"]))
+            genders.append(gender_code(node.get(GENDER_ATTRIBUTE)))
+            spoken_words.append(node.get(SPOKEN_WORDS_ATTRIBUTE, 0))
+            in_relations.append(node["id"] in relation_node_ids)
+
+        for edge in relation_edges:
+            relation_sources.append(index[edge["source"]])
+            relation_targets.append(index[edge["target"]])
+            relation_types.append(_code(edge.get(RELATION_ATTRIBUTE), RELATIONS))
+            relation_directed.append(edge["directed"])
+
+        for edge in cooccurrence_edges:
+            cooccurrence_sources.append(index[edge["source"]])
+            cooccurrence_targets.append(index[edge["target"]])
+            cooccurrence_weights.append(edge.get(WEIGHT_ATTRIBUTE, 1))
+
+        play_ids.append(play_id)
+        has_relations.append(relations_graphml is not None)
+        node_offsets.append(len(node_ids))
+        relation_offsets.append(len(relation_sources))
+        cooccurrence_offsets.append(len(cooccurrence_sources))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez_compressed(
+        path,
+        play_ids=np.array(play_ids, dtype=str),
+        has_relations=np.array(has_relations, dtype=bool),
+        node_offsets=np.array(node_offsets, dtype=np.int64),
+        relation_offsets=np.array(relation_offsets, dtype=np.int64),
+        cooccurrence_offsets=np.array(cooccurrence_offsets, dtype=np.int64),
+        node_ids=np.array(node_ids, dtype=str),
+        labels=np.array(labels, dtype=str),
+        genders=np.array(genders, dtype=np.int8),
+        spoken_words=np.array(spoken_words, dtype=np.int32),
+        in_relations=np.array(in_relations, dtype=bool),
+        relation_sources=np.array(relation_sources, dtype=np.int32),
+        relation_targets=np.array(relation_targets, dtype=np.int32),
+        relation_types=np.array(relation_types, dtype=np.int8),
+        relation_directed=np.array(relation_directed, dtype=bool),
+        cooccurrence_sources=np.array(cooccurrence_sources, dtype=np.int32),
+        cooccurrence_targets=np.array(cooccurrence_targets, dtype=np.int32),
+        cooccurrence_weights=np.array(cooccurrence_weights, dtype=np.int32),
+    )
+    logging.info(f"Stored the networks of {len(play_ids)} plays in {path}.")
+    return len(play_ids)
+
+
+def fetch_graph_store(corpusname: str,
+                      path: str,
+                      api_base_url: str = DEFAULT_API_BASE_URL,
+                      max_workers: int = 8) -> int:
+    """Download the relation and co-occurrence networks of all plays of a corpus and store them
+
+    Replaces the loop in gender-visualization/fetch_data.ipynb. Plays without a co-occurrence network are
+    skipped, plays without a relation network are stored with an empty relation network.
+
+    Args:
+        corpusname (str): Identifier of the corpus, e.g. "ger".
+        path (str): Path of the archive (.npz).
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Returns:
+        int: Number of stored plays.
+    """
+    session = create_session(max_connections=max_workers)
+    corpus = api_get(session=session, api_base_url=api_base_url, corpusname=corpusname, parse_json=True)
+    play_ids = {play["name"]: play["id"] for play in corpus["plays"]}
+    plays = [(corpusname, playname) for playname in play_ids]
+
+    graphml = {}
+    for method in ("networkdata/graphml", "relations/graphml"):
+        graphml[method] = {result.playname: result.data
+                           for result in download_plays(plays, method, api_base_url=api_base_url,
+                                                        max_workers=max_workers, parse_json=False, session=session)
+                           if result.ok}
+
+    return write_graph_store(path, (
+        (play_ids[playname], graphml["relations/graphml"].get(playname), cooccurrence_graphml)
+        for playname, cooccurrence_graphml in sorted(graphml["networkdata/graphml"].items())
+    ))
+
+
+class GraphStore:
+    """Read access to the networks of a corpus stored with write_graph_store
+    """
+
+    def __init__(self, path: str):
+        """
+
+        Args:
+            path (str): Path of the archive (.npz).
+        """
+        with np.load(path) as archive:
+            self.__arrays = {name: archive[name] for name in archive.files}
+        self.__index = {play_id: i for i, play_id in enumerate(self.__arrays["play_ids"].tolist())}
+
+    @property
+    def play_ids(self) -> list:
+        """Identifiers of the stored plays"""
+        return self.__arrays["play_ids"].tolist()
+
+    @property
+    def play_ids_with_relations(self) -> list:
+        """Identifiers of the stored plays that have a relation network"""
+        return self.__arrays["play_ids"][self.__arrays["has_relations"]].tolist()
+
+    def __slice(self, play_id: str, offsets: str) -> slice:
+        i = self.__index[play_id]
+        return slice(self.__arrays[offsets][i], self.__arrays[offsets][i + 1])
+
+    def play(self, play_id: str) -> PlayGraphs:
+        """Get the node table and the edge tables of a play
+
+        Args:
+            play_id (str): Identifier of the play, e.g. "ger000088".
+
+        Returns:
+            PlayGraphs: DataFrames "nodes" (indexed by node number; id, label, gender, spokenWords, inRelations),
+                "relations" (source, target, relation, directed) and "cooccurrence" (source, target, weight).
+                Sources and targets refer to the node numbers.
+        """
+        a = self.__arrays
+        nodes_slice = self.__slice(play_id, "node_offsets")
+        relations_slice = self.__slice(play_id, "relation_offsets")
+        cooccurrence_slice = self.__slice(play_id, "cooccurrence_offsets")
+        genders = np.array(GENDERS + [None], dtype=object)
+        relations = np.array(RELATIONS + [None], dtype=object)
+
+        nodes = pd.DataFrame({
+            "id": a["node_ids"][nodes_slice],
+            "label": a["labels"][nodes_slice],
+            "gender": genders[a["genders"][nodes_slice]],
+            "spokenWords": a["spoken_words"][nodes_slice],
+            "inRelations": a["in_relations"][nodes_slice],
+        })
+        relation_edges = pd.DataFrame({
+            "source": a["relation_sources"][relations_slice],
+            "target": a["relation_targets"][relations_slice],
+            "relation": relations[a["relation_types"][relations_slice]],
+            "directed": a["relation_directed"][relations_slice],
+        })
+        cooccurrence_edges = pd.DataFrame({
+            "source": a["cooccurrence_sources"][cooccurrence_slice],
+            "target": a["cooccurrence_targets"][cooccurrence_slice],
+            "weight": a["cooccurrence_weights"][cooccurrence_slice],
+        })
+        return PlayGraphs(nodes, relation_edges, cooccurrence_edges)
+
+    def __graph(self, nodes: pd.DataFrame, ids: np.ndarray, edges: pd.DataFrame, edge_attribute: str, edge_key: str):
+        """Build a networkx graph; 'ids' maps the node numbers of the edges to node identifiers"""
+        import networkx as nx
+
+        graph = nx.Graph()
+        for row in nodes.itertuples():
+            graph.add_node(row.id, **{LABEL_ATTRIBUTE: row.label,
+                                      GENDER_ATTRIBUTE: row.gender,
+                                      SPOKEN_WORDS_ATTRIBUTE: int(row.spokenWords)})
+        for source, target, value in zip(edges["source"], edges["target"], edges[edge_key]):
+            graph.add_edge(ids[source], ids[target], **{edge_attribute: value})
+        return graph
+
+    def relations_graph(self, play_id: str):
+        """Get the relation network of a play as an undirected networkx graph with the node and edge attributes
+        of the GraphML exported by DraCor (as used in relationship_network.ipynb)
+
+        Args:
+            play_id (str): Identifier of the play.
+        """
+        graphs = self.play(play_id)
+        nodes = graphs.nodes[graphs.nodes["inRelations"]]
+        return self.__graph(nodes, graphs.nodes["id"].to_numpy(), graphs.relations, RELATION_ATTRIBUTE, "relation")
+
+    def cooccurrence_graph(self, play_id: str):
+        """Get the co-occurrence network of a play as a networkx graph
+
+        Args:
+            play_id (str): Identifier of the play.
+        """
+        graphs = self.play(play_id)
+        return self.__graph(graphs.nodes, graphs.nodes["id"].to_numpy(), graphs.cooccurrence, WEIGHT_ATTRIBUTE, "weight")
@@ -0,0 +1,428 @@
+"""Persistent inverted index of the words spoken by the characters of whole corpora
+
+The api-tutorial notebook tokenizes the spoken text of one play, keeps a Counter per character and looks up a few
+words (rose, blom, barn, ...) per gender by scanning these Counters. Here the spoken text of all plays of one or more
+corpora (/corpora/{corpusname}/plays/{playname}/spoken-text-by-character) is tokenized once and stored as an inverted
+index: for every word the postings (play, character, gender, position of the token in the text of the character)
+are a contiguous range of arrays sorted by word. The token codes of the texts are kept as well, so concordance lines
+are cut from the arrays without the text. Counts by gender, play, corpus or any other column of the character table
+are a bincount of the characters of the postings.
+
+The index is stored in a folder: each call of add_plays writes a new segment (a NumPy archive with the postings and
+tokens of the added plays), the vocabulary and the character table are only appended to, and a manifest written last
+lists the complete segments. Queries read all segments; compact merges them into one.
+
+Example:
+    >>> index = KeywordIndex("data/keywords")
+    >>> fetch_keyword_index(["swe", "ger"], index=index)
+    >>> index.counts(["rose", "blom", "barn"], by="gender")
+    >>> index.concordance("blom", width=6, by="gender", limit=5)
+"""
+
+import json
+import logging
+import os
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .api import DEFAULT_API_BASE_URL, GENDERS, create_session, gender_code, list_playnames
+from .downloader import download_corpus
+from .term_matrix import get_tokenizer
+
+# Columns of the character table
+ROW_KEYS = ["corpus", "play", "id", "label", "gender", "numOfTokens"]
+
+# Arrays of a segment: postings sorted by word, and the token codes of the texts of the characters of the segment
+SEGMENT_ARRAYS = ["words", "word_offsets", "play", "character", "gender", "position", "tokens", "token_offsets"]
+
+
+class KeywordIndex:
+    """Inverted index of the spoken text of characters, optionally stored in a folder
+    """
+
+    def __init__(self,
+                 directory: str = None,
+                 tokenizer: str = "regex",
+                 lowercase: bool = False,
+                 max_segments: int = 16,
+                 **tokenizer_options):
+        """
+
+        Args:
+            directory (str, optional): Folder of the index. An existing index in the folder is loaded, and added
+                plays are stored in it. Defaults to an index in memory only.
+            tokenizer (str, optional): "regex" or "nltk", see get_tokenizer in term_matrix.py. Defaults to "regex".
+            lowercase (bool, optional): Index and look up words in lower case. Defaults to False, as in the
+                notebook. The setting of an existing index is kept.
+            max_segments (int, optional): Merge all segments once there are more. Defaults to 16.
+            **tokenizer_options: Further arguments of get_tokenizer, e.g. token_pattern or language.
+        """
+        self.directory = directory
+        self.max_segments = max_segments
+        self.lowercase = lowercase
+        self.vocabulary = []
+        self.plays = []
+        self.segments = []
+        self.__tokenize = get_tokenizer(tokenizer, **tokenizer_options)
+        self.__word_codes = {}
+        self.__play_codes = {}
+        self.__rows = []
+        self.__rows_df = None
+        self.__group_codes = {}
+        self.__segment_files = []
+        if directory is not None and os.path.exists(self.manifest_path):
+            self.__load()
+
+    @property
+    def manifest_path(self) -> str:
+        """Path of the file listing the complete segments of the index"""
+        return os.path.join(self.directory, "manifest.json")
+
+    def __load(self):
+        with open(self.manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.lowercase = manifest["lowercase"]
+        # Words and characters appended after the last complete segment are ignored
+        with open(os.path.join(self.directory, "vocabulary.txt"), encoding="utf-8") as f:
+            self.vocabulary = f.read().split("\n")[:manifest["numOfWords"]]
+        self.__word_codes = {word: i for i, word in enumerate(self.vocabulary)}
+        self.plays = [tuple(play) for play in manifest["plays"]]
+        self.__play_codes = {play: i for i, play in enumerate(self.plays)}
+        rows = pd.read_parquet(os.path.join(self.directory, "rows.parquet")).head(manifest["numOfRows"])
+        self.__rows = rows.to_dict("records")
+        self.__segment_files = list(manifest["segments"])
+        for name in self.__segment_files:
+            with np.load(os.path.join(self.directory, name)) as archive:
+                self.segments.append({key: archive[key] for key in SEGMENT_ARRAYS + ["row_start"]})
+
+    def __len__(self) -> int:
+        return len(self.plays)
+
+    def __contains__(self, play: tuple) -> bool:
+        return tuple(play) in self.__play_codes
+
+    @property
+    def rows(self) -> pd.DataFrame:
+        """Table of the indexed characters with the columns in ROW_KEYS
+
+        Columns added to this table (e.g. a time period) can be grouped by; add them after all plays are indexed.
+        """
+        if self.__rows_df is None or len(self.__rows_df) != len(self.__rows):
+            self.__rows_df = pd.DataFrame(self.__rows, columns=ROW_KEYS, index=pd.RangeIndex(len(self.__rows)))
+            self.__group_codes = {}
+        return self.__rows_df
+
+    def __segment(self, plays: Iterable[tuple]) -> dict:
+        """Tokenize plays and sort their postings by word"""
+        row_start = len(self.__rows)
+        token_arrays = []
+        lengths = []
+        play_codes = []
+        genders = []
+        for corpusname, playname, characters in plays:
+            if (corpusname, playname) in self.__play_codes:
+                logging.info(f"Play '{playname}' of corpus '{corpusname}' is already indexed.")
+                continue
+            play_code = self.__play_codes[(corpusname, playname)] = len(self.plays)
+            self.plays.append((corpusname, playname))
+            tokens = []
+            for character in characters:
+                character_tokens = self.__tokenize(character.get("text", []))
+                tokens.extend(character_tokens)
+                lengths.append(len(character_tokens))
+                play_codes.append(play_code)
+                genders.append(gender_code(character.get("gender")))
+                self.__rows.append({"corpus": corpusname, "play": playname, "id": character.get("id"),
+                                    "label": character.get("label"), "gender": character.get("gender"),
+                                    "numOfTokens": len(character_tokens)})
+            if not tokens:
+                continue
+            token_series = pd.Series(tokens, dtype=object)
+            if self.lowercase:
+                token_series = token_series.str.lower()
+            local_codes, local_words = pd.factorize(token_series)
+            global_codes = np.array([self.__word_codes.setdefault(word, len(self.__word_codes))
+                                     for word in local_words], dtype=np.int32)
+            token_arrays.append(global_codes[local_codes])
+        self.vocabulary.extend(list(self.__word_codes)[len(self.vocabulary):])
+
+        tokens = np.concatenate(token_arrays) if token_arrays else np.zeros(0, dtype=np.int32)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        token_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=token_offsets[1:])
+        local_rows = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(len(tokens)) - token_offsets[local_rows]
+
+        # Postings sorted by word, then by character and position
+        order = np.lexsort((positions, local_rows, tokens))
+        words, word_starts = np.unique(tokens[order], return_index=True)
+        return {
+            "words": words.astype(np.int32),
+            "word_offsets": np.append(word_starts, len(order)).astype(np.int64),
+            "play": np.asarray(play_codes, dtype=np.int32)[local_rows[order]],
+            "character": (local_rows[order] + row_start).astype(np.int32),
+            "gender": np.asarray(genders, dtype=np.int8)[local_rows[order]],
+            "position": positions[order].astype(np.int32),
+            "tokens": tokens,
+            "token_offsets": token_offsets,
+            "row_start": np.int64(row_start),
+        }
+
+    def __write(self, segment: dict = None):
+        """Store a new segment (if given), the vocabulary, the characters and then the manifest"""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if segment is not None:
+            name = f"segment-{int(segment['row_start']):09d}-{len(self.__rows):09d}.npz"
+            tmp_path = os.path.join(self.directory, f"{name}.tmp.npz")
+            np.savez(tmp_path, **segment)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+            self.__segment_files.append(name)
+        for name, write in (("vocabulary.txt", self.__write_vocabulary),
+                            ("rows.parquet", lambda path: self.rows.to_parquet(path, index=False))):
+            tmp_path = os.path.join(self.directory, f"{name}.tmp")
+            write(tmp_path)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        manifest = {"lowercase": self.lowercase, "numOfWords": len(self.vocabulary), "numOfRows": len(self.__rows),
+                    "plays": self.plays, "segments": self.__segment_files}
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def __write_vocabulary(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.vocabulary))
+
+    def add_plays(self, plays: Iterable[tuple]) -> int:
+        """Index plays that are not indexed yet, as one new segment
+
+        Args:
+            plays: Tuples (corpusname, playname, characters) with the data returned by
+                /corpora/{corpusname}/plays/{playname}/spoken-text-by-character as characters.
+
+        Returns:
+            int: Number of added plays.
+        """
+        num_plays = len(self.plays)
+        segment = self.__segment(plays)
+        if len(self.plays) == num_plays:
+            return 0
+        self.segments.append(segment)
+        self.__rows_df = None
+        if len(self.segments) > self.max_segments:
+            self.compact()
+        else:
+            self.__write(segment)
+        logging.info(f"Indexed {len(self.plays) - num_plays} plays ({len(segment['tokens'])} tokens).")
+        return len(self.plays) - num_plays
+
+    def add_play(self, corpusname: str, playname: str, characters: list) -> bool:
+        """Index a single play, see add_plays
+
+        Returns:
+            bool: True if the play was added, False if it was indexed already.
+        """
+        return self.add_plays([(corpusname, playname, characters)]) > 0
+
+    def add_model(self, model) -> int:
+        """Index the plays of a CorpusModel (corpus_model.py), see add_plays"""
+        return self.add_plays((play.corpus, play.name,
+                               [{"id": character.id, "label": character.label, "gender": character.gender,
+                                 "text": [character.text]} for character in play.characters])
+                              for play in model)
+
+    def compact(self):
+        """Merge all segments into one and remove the files of the merged segments"""
+        if len(self.segments) > 1:
+            segments = self.segments
+            tokens = np.concatenate([segment["tokens"] for segment in segments])
+            # Segments hold consecutive ranges of characters, so the token offsets are shifted and concatenated
+            shifts = np.cumsum([0] + [len(segment["tokens"]) for segment in segments[:-1]])
+            token_offsets = np.concatenate([segments[0]["token_offsets"][:1]] + [
+                segment["token_offsets"][1:] + shift for segment, shift in zip(segments, shifts)])
+            words = np.concatenate([np.repeat(segment["words"], np.diff(segment["word_offsets"]))
+                                    for segment in segments])
+            columns = {key: np.concatenate([segment[key] for segment in segments])
+                       for key in ("play", "character", "gender", "position")}
+            order = np.lexsort((columns["position"], columns["character"], words))
+            unique_words, word_starts = np.unique(words[order], return_index=True)
+            self.segments = [{
+                "words": unique_words.astype(np.int32),
+                "word_offsets": np.append(word_starts, len(order)).astype(np.int64),
+                **{key: values[order] for key, values in columns.items()},
+                "tokens": tokens,
+                "token_offsets": token_offsets,
+                "row_start": segments[0]["row_start"],
+            }]
+        if self.directory is None:
+            return
+        old_files = self.__segment_files
+        self.__segment_files = []
+        self.__write(self.segments[0] if self.segments else None)
+        for name in old_files:
+            if name not in self.__segment_files:
+                os.remove(os.path.join(self.directory, name))
+
+    def __lookup(self, word: str) -> Iterable[tuple]:
+        """Yield (segment, start, end) of the postings of a word"""
+        code = self.__word_codes.get(word.lower() if self.lowercase else word)
+        if code is None:
+            return
+        for segment in self.segments:
+            i = np.searchsorted(segment["words"], code)
+            if i < len(segment["words"]) and segment["words"][i] == code:
+                yield segment, segment["word_offsets"][i], segment["word_offsets"][i + 1]
+
+    def characters_of(self, word: str) -> np.ndarray:
+        """Get the character (row of the character table) of every occurrence of a word"""
+        parts = [segment["character"][start:end] for segment, start, end in self.__lookup(word)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+
+    def postings(self, word: str) -> pd.DataFrame:
+        """Get all occurrences of a word
+
+        Returns:
+            pd.DataFrame: Columns "corpus", "play", "id", "gender" and "position" (number of the token in the
+                spoken text of the character).
+        """
+        parts = list(self.__lookup(word))
+        plays = np.concatenate([segment["play"][start:end] for segment, start, end in parts] + [np.zeros(0, int)])
+        characters = self.characters_of(word)
+        genders = np.concatenate([segment["gender"][start:end] for segment, start, end in parts]
+                                 + [np.zeros(0, np.int8)])
+        positions = np.concatenate([segment["position"][start:end] for segment, start, end in parts]
+                                   + [np.zeros(0, np.int32)])
+        play_table = np.asarray(self.plays + [(None, None)], dtype=object).reshape(-1, 2)
+        return pd.DataFrame({
+            "corpus": play_table[plays, 0],
+            "play": play_table[plays, 1],
+            "id": self.rows["id"].to_numpy()[characters],
+            "gender": np.asarray(GENDERS + [None], dtype=object)[genders],
+            "position": positions,
+        })
+
+    def __groups(self, by) -> tuple:
+        """Get the group of every character and the index of the groups"""
+        keys = (by,) if isinstance(by, str) else tuple(by)
+        rows = self.rows
+        if keys not in self.__group_codes:
+            if len(keys) == 1:
+                codes, values = pd.factorize(rows[keys[0]])
+                group_index = pd.Index(values, name=keys[0])
+            else:
+                codes, group_index = pd.MultiIndex.from_frame(rows[list(keys)]).factorize()
+                group_index = group_index.set_names(list(keys))
+            self.__group_codes[keys] = (codes, group_index)
+        return self.__group_codes[keys]
+
+    def counts(self, words: list, by="gender", groups: list = None) -> pd.DataFrame:
+        """Get the frequencies of words by group, e.g. the table words_by_gender of the api-tutorial notebook
+
+        Args:
+            words (list): Words to look up.
+            by (optional): Column or list of columns of the character table, e.g. "gender", "play" or
+                ["corpus", "gender"]. Defaults to "gender".
+            groups (list, optional): Groups to keep, in this order. Defaults to ["MALE", "FEMALE", "UNKNOWN"]
+                for gender and all groups otherwise.
+
+        Returns:
+            pd.DataFrame: One row per group and one column per word.
+        """
+        if groups is None and by == "gender":
+            groups = GENDERS
+        codes, group_index = self.__groups(by)
+        counts = np.zeros((len(group_index), len(words)), dtype=np.int64)
+        for j, word in enumerate(words):
+            group_codes = codes[self.characters_of(word)]
+            counts[:, j] = np.bincount(group_codes[group_codes >= 0], minlength=len(group_index))
+        table = pd.DataFrame(counts, index=group_index, columns=words)
+        if groups is not None:
+            table = table.reindex(groups, fill_value=0)
+        return table
+
+    def num_tokens_by(self, by="gender") -> pd.Series:
+        """Get the number of tokens per group, e.g. to turn counts into relative frequencies"""
+        keys = [by] if isinstance(by, str) else list(by)
+        return self.rows.groupby(keys, dropna=False)["numOfTokens"].sum()
+
+    def concordance(self, word: str, width: int = 5, by=None, limit: int = None) -> pd.DataFrame:
+        """Get the occurrences of a word with the tokens before and after it in the text of the character
+
+        Args:
+            word (str): Word to look up.
+            width (int, optional): Number of tokens on each side. Defaults to 5.
+            by (optional): Column or list of columns of the character table to group the lines by.
+            limit (int, optional): Maximum number of lines (per group if by is given).
+
+        Returns:
+            pd.DataFrame: The columns of the character table (without numOfTokens), "position", "left", "keyword"
+                and "right"; tokens are joined by spaces (and in lower case if the index is).
+        """
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        frames = []
+        for segment, start, end in self.__lookup(word):
+            local_rows = segment["character"][start:end] - segment["row_start"]
+            positions = segment["position"][start:end]
+            row_starts = segment["token_offsets"][local_rows]
+            row_ends = segment["token_offsets"][local_rows + 1]
+            token_positions = row_starts + positions
+            tokens = segment["tokens"]
+            lines = []
+            for first, position, last in zip(row_starts.tolist(), token_positions.tolist(), row_ends.tolist()):
+                lines.append((" ".join(vocabulary[tokens[max(first, position - width):position]]),
+                              vocabulary[tokens[position]],
+                              " ".join(vocabulary[tokens[position + 1:min(last, position + 1 + width)]])))
+            frame = self.rows.iloc[segment["character"][start:end]].drop(columns="numOfTokens").reset_index(drop=True)
+            frame["position"] = positions
+            frames.append(pd.concat([frame, pd.DataFrame(lines, columns=["left", "keyword", "right"])], axis=1))
+
+        columns = [key for key in self.rows.columns if key != "numOfTokens"] + ["position", "left", "keyword", "right"]
+        lines = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        if by is None:
+            return lines.head(limit) if limit is not None else lines
+        keys = [by] if isinstance(by, str) else list(by)
+        lines = lines.sort_values(keys, kind="stable", ignore_index=True)
+        return lines.groupby(keys, dropna=False).head(limit).reset_index(drop=True) if limit is not None else lines
+
+
+def fetch_keyword_index(corpora: list,
+                        index: KeywordIndex = None,
+                        api_base_url: str = DEFAULT_API_BASE_URL,
+                        max_workers: int = 8,
+                        plays_per_segment: int = 200) -> KeywordIndex:
+    """Download and index the spoken text of the plays of corpora that are not indexed yet
+
+    Args:
+        corpora (list): Names of the corpora, e.g. ["swe", "ger"].
+        index (KeywordIndex, optional): Index to add the plays to. Defaults to a new index in memory.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        plays_per_segment (int, optional): Number of plays indexed as one segment. Defaults to 200.
+    """
+    index = index if index is not None else KeywordIndex()
+    session = create_session(max_connections=max_workers)
+    for corpusname in corpora:
+        try:
+            playnames = [playname for playname in list_playnames(corpusname, session=session,
+                                                                 api_base_url=api_base_url)
+                         if (corpusname, playname) not in index]
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Could not list the plays of corpus '{corpusname}': {e}")
+            continue
+        results = download_corpus(corpusname, "spoken-text-by-character", playnames=playnames,
+                                  api_base_url=api_base_url, max_workers=max_workers, parse_json=True)
+        batch = []
+        for result in results:
+            if result.ok:
+                batch.append((result.corpusname, result.playname, result.data))
+            if len(batch) == plays_per_segment:
+                index.add_plays(batch)
+                batch = []
+        if batch:
+            index.add_plays(batch)
+    return index
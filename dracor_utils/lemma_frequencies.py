@@ -0,0 +1,175 @@
+"""Lemma frequencies of annotated texts grouped by any attribute of the characters
+
+calculate_lemma_frq_by_sex and calculate_num_words_by_sex in the speech_analysis notebook iterate over every token
+and fill nested dictionaries per gender. Here the lemma and part of speech of all tokens of a Doc are read as one
+integer array (Doc.to_array), counted with NumPy and stored as a sparse matrix with one row per character and one
+column per pair (lemma, part of speech). Counts by gender, play, corpus or any other column of the row table
+(e.g. a time period merged from the metadata) are sparse matrix products; relative frequencies and differences
+between groups are vectorized operations on the resulting table.
+
+Example:
+    >>> counter = LemmaCounter()
+    >>> for key, doc in annotator.annotate_corpus("ger"):
+    ...     counter.add(doc, **key._asdict())
+    >>> rel_df = counter.relative_frequencies(by="gender")
+    >>> counter.difference("MALE", "FEMALE").nlargest(10)
+"""
+
+import logging
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .term_matrix import TermMatrix
+
+# Parts of speech counted in the speech_analysis notebook
+DEFAULT_POS_TAGS = ["NOUN", "VERB", "ADJ", "ADV"]
+
+
+class LemmaCounter:
+    """Counts of (lemma, part of speech) per annotated text, with the attributes of the text
+    """
+
+    def __init__(self):
+        # Columns: lemma strings and part of speech names, looked up by (lemma hash, pos id)
+        self.lemmas = []
+        self.pos = []
+        self.__columns = {}
+        self.__rows = []
+        self.__rows_df = None
+        self.__num_words = []
+        self.__data = []
+        self.__row_indices = []
+        self.__column_indices = []
+        self.__matrix = None
+
+    def add(self, doc, **attributes):
+        """Count the lemmata of an annotated text
+
+        Args:
+            doc (spacy.tokens.Doc): Annotated text, e.g. the speech of a character.
+            **attributes: Attributes of the text, e.g. corpus, play, id and gender of the character.
+        """
+        from spacy.attrs import LEMMA, POS
+        from spacy.parts_of_speech import NAMES as POS_NAMES
+
+        row = len(self.__rows)
+        self.__rows.append(attributes)
+        self.__num_words.append(len(doc))
+        if len(doc) == 0:
+            return
+
+        tokens = doc.to_array([LEMMA, POS])
+        pairs, counts = np.unique(tokens, axis=0, return_counts=True)
+        columns = np.empty(len(pairs), dtype=np.int64)
+        for i, (lemma, pos) in enumerate(pairs.tolist()):
+            column = self.__columns.get((lemma, pos))
+            if column is None:
+                column = self.__columns[(lemma, pos)] = len(self.lemmas)
+                self.lemmas.append(doc.vocab.strings[lemma])
+                self.pos.append(POS_NAMES.get(pos, ""))
+            columns[i] = column
+
+        self.__data.append(counts.astype(np.int32))
+        self.__row_indices.append(np.full(len(counts), row, dtype=np.int64))
+        self.__column_indices.append(columns)
+        self.__matrix = None
+
+    def add_docs(self, docs: Iterable[tuple]):
+        """Count the lemmata of many annotated texts
+
+        Args:
+            docs: Tuples (key, doc) as yielded by CorpusAnnotator; the fields of the key (a namedtuple or
+                a dictionary) become the attributes of the text.
+        """
+        for key, doc in docs:
+            self.add(doc, **(key._asdict() if hasattr(key, "_asdict") else dict(key)))
+        logging.info(f"Counted {len(self.lemmas)} pairs of lemma and part of speech in {len(self.__rows)} texts.")
+
+    @property
+    def rows(self) -> pd.DataFrame:
+        """Attributes of the counted texts
+
+        Columns added to this table (e.g. a time period) can be grouped by; add them after all texts are counted.
+        """
+        if self.__rows_df is None or len(self.__rows_df) != len(self.__rows):
+            self.__rows_df = pd.DataFrame(self.__rows, index=pd.RangeIndex(len(self.__rows)))
+        return self.__rows_df
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        """Counts with one row per text and one column per pair (lemma, part of speech)"""
+        if self.__matrix is None:
+            data = np.concatenate(self.__data) if self.__data else np.zeros(0, dtype=np.int32)
+            rows = np.concatenate(self.__row_indices) if self.__data else np.zeros(0, dtype=np.int64)
+            columns = np.concatenate(self.__column_indices) if self.__data else np.zeros(0, dtype=np.int64)
+            self.__matrix = sparse.csr_matrix((data, (rows, columns)),
+                                              shape=(len(self.__num_words), len(self.lemmas)))
+        return self.__matrix
+
+    @property
+    def num_words(self) -> np.ndarray:
+        """Number of tokens of each text (including punctuation, as len(doc) in the notebook)"""
+        return np.asarray(self.__num_words)
+
+    def term_matrix(self, pos_tags: list = DEFAULT_POS_TAGS) -> TermMatrix:
+        """Get the counts of the lemmata with the given parts of speech, summed over the parts of speech
+
+        Args:
+            pos_tags (list, optional): Parts of speech to count; None counts all tokens.
+                Defaults to ["NOUN", "VERB", "ADJ", "ADV"].
+
+        Returns:
+            TermMatrix: One row per text, one column per lemma; rows hold the attributes of the texts.
+        """
+        pos = np.asarray(self.pos, dtype=object)
+        selected = np.flatnonzero(np.isin(pos, pos_tags)) if pos_tags is not None else np.arange(len(pos))
+        codes, lemmas = pd.factorize(np.asarray(self.lemmas, dtype=object)[selected])
+        # Sum the columns of the same lemma with different parts of speech
+        merge = sparse.csr_matrix((np.ones(len(selected), dtype=np.int32), (selected, codes)),
+                                  shape=(len(self.lemmas), len(lemmas)))
+        return TermMatrix((self.matrix @ merge).tocsr(), list(lemmas), self.rows)
+
+    def num_words_by(self, by="gender") -> pd.Series:
+        """Get the number of tokens per group, as calculate_num_words_by_sex in the notebook"""
+        keys = [by] if isinstance(by, str) else list(by)
+        return pd.Series(self.num_words, index=self.rows.index).groupby(
+            [self.rows[key] for key in keys], dropna=False).sum().rename("numOfWords")
+
+    def frequencies(self, by="gender", pos_tags: list = DEFAULT_POS_TAGS, groups: list = None) -> pd.DataFrame:
+        """Get the frequency of each lemma per group, as calculate_lemma_frq_by_sex in the notebook
+
+        Args:
+            by (optional): Column or list of columns of the row table. Defaults to "gender".
+            pos_tags (list, optional): Parts of speech to count. Defaults to ["NOUN", "VERB", "ADJ", "ADV"].
+            groups (list, optional): Groups to include, in this order. Defaults to all groups.
+
+        Returns:
+            pd.DataFrame: One row per lemma and one column per group. The table is dense; for many groups
+                (e.g. by play) use term_matrix(pos_tags).group_matrix(by) instead.
+        """
+        term_matrix = self.term_matrix(pos_tags)
+        grouped, group_index = term_matrix.group_matrix(by=by, groups=groups)
+        return pd.DataFrame(grouped.T.toarray(), index=pd.Index(term_matrix.vocabulary, name="lemma"),
+                            columns=group_index)
+
+    def relative_frequencies(self, by="gender", pos_tags: list = DEFAULT_POS_TAGS,
+                             groups: list = None) -> pd.DataFrame:
+        """Get the frequency of each lemma per group divided by the number of tokens of the group"""
+        frequencies = self.frequencies(by=by, pos_tags=pos_tags, groups=groups)
+        num_words = self.num_words_by(by).reindex(frequencies.columns)
+        return frequencies.div(num_words.to_numpy(dtype=float), axis=1)
+
+    def difference(self, group, other_group, by="gender", pos_tags: list = DEFAULT_POS_TAGS) -> pd.Series:
+        """Get the difference of the relative frequencies of two groups, e.g. MALE_FEMALE in the notebook"""
+        relative = self.relative_frequencies(by=by, pos_tags=pos_tags, groups=[group, other_group])
+        return (relative[group] - relative[other_group]).rename(f"{group}_{other_group}")
+
+    def exclusive(self, group, by="gender", pos_tags: list = DEFAULT_POS_TAGS) -> pd.DataFrame:
+        """Get the relative frequencies of the lemmata used only by one group (as men_only / women_only)"""
+        frequencies = self.frequencies(by=by, pos_tags=pos_tags)
+        others = frequencies.columns[frequencies.columns != group]
+        mask = (frequencies[group] > 0) & (frequencies[others] == 0).all(axis=1)
+        return self.relative_frequencies(by=by, pos_tags=pos_tags)[mask]
@@ -0,0 +1,255 @@
+"""Local store of corpus metadata as typed, compressed Arrow files
+
+The metadata of a corpus (endpoint /corpora/{corpusname}/metadata) is downloaded once, converted to a fixed
+schema and written to an Arrow IPC (Feather) file. Later sessions memory-map the file instead of sending a request
+and parsing the CSV again.
+
+Example:
+    >>> store = MetadataStore()
+    >>> metadata_df = store.load("ger", columns=["name", "yearNormalized", "size"])
+    >>> store.lookup("ger", name="lessing-emilia-galotti")["numOfSpeakers"]
+"""
+
+import io
+import logging
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import requests
+
+from .api import DEFAULT_API_BASE_URL, api_get, create_session
+
+# Fixed types of the metadata fields. Columns returned by the API that are not listed here
+# are kept with the type inferred from the CSV.
+METADATA_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("name", pa.string()),
+    ("title", pa.string()),
+    ("subtitle", pa.string()),
+    ("firstAuthor", pa.string()),
+    ("numOfCoAuthors", pa.int16()),
+    ("normalizedGenre", pa.dictionary(pa.int8(), pa.string())),
+    ("libretto", pa.bool_()),
+    ("yearNormalized", pa.int16()),
+    ("yearWritten", pa.string()),
+    ("yearPrinted", pa.string()),
+    ("yearPremiered", pa.string()),
+    ("size", pa.int32()),
+    ("numOfSpeakers", pa.int32()),
+    ("numOfSpeakersFemale", pa.int32()),
+    ("numOfSpeakersMale", pa.int32()),
+    ("numOfSpeakersUnknown", pa.int32()),
+    ("numPersonGroups", pa.int32()),
+    ("numOfSegments", pa.int32()),
+    ("numOfActs", pa.int32()),
+    ("numOfP", pa.int32()),
+    ("numOfL", pa.int32()),
+    ("numConnectedComponents", pa.int32()),
+    ("maxDegree", pa.int32()),
+    ("maxDegreeIds", pa.string()),
+    ("diameter", pa.int32()),
+    ("averageDegree", pa.float64()),
+    ("density", pa.float64()),
+    ("averagePathLength", pa.float64()),
+    ("averageClustering", pa.float64()),
+    ("wordCountText", pa.int32()),
+    ("wordCountSp", pa.int32()),
+    ("wordCountStage", pa.int32()),
+    ("wikipediaLinkCount", pa.int32()),
+    ("wikidataId", pa.string()),
+    ("digitalSource", pa.string()),
+    ("originalSourcePublisher", pa.string()),
+    ("originalSourcePubPlace", pa.string()),
+    ("originalSourceYear", pa.string()),
+    ("originalSourceNumberOfPages", pa.string()),
+])
+
+
+def parse_metadata_csv(csv_data: bytes) -> pa.Table:
+    """Parse the metadata CSV returned by the API into a table with the fixed schema
+
+    Fields of METADATA_SCHEMA are read with their fixed type and missing fields are added as null columns,
+    so that tables of different corpora share the same schema.
+
+    Args:
+        csv_data (bytes): CSV as returned by /corpora/{corpusname}/metadata.
+    """
+    # Dictionary types can't be read directly, read them as string and cast afterwards
+    column_types = {field.name: (pa.string() if pa.types.is_dictionary(field.type) else field.type)
+                    for field in METADATA_SCHEMA}
+    table = pa_csv.read_csv(io.BytesIO(csv_data),
+                            convert_options=pa_csv.ConvertOptions(column_types=column_types,
+                                                                  strings_can_be_null=True))
+
+    columns = []
+    fields = []
+    for field in METADATA_SCHEMA:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            logging.debug(f"Metadata field '{field.name}' is missing, will add an empty column.")
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+        fields.append(field)
+
+    # Keep the additional columns the API returns with their inferred types
+    for name in table.column_names:
+        if name not in METADATA_SCHEMA.names:
+            columns.append(table.column(name))
+            fields.append(table.schema.field(name))
+
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+
+class MetadataStore:
+    """Store of corpus metadata in typed, compressed Arrow files that are memory-mapped on load
+    """
+
+    def __init__(self,
+                 directory: str = "data/metadata",
+                 api_base_url: str = DEFAULT_API_BASE_URL,
+                 compression: str = "zstd",
+                 session: requests.Session = None):
+        """
+
+        Args:
+            directory (str, optional): Folder the Arrow files are stored in. Defaults to "data/metadata".
+            api_base_url (str, optional): Base URL of the DraCor API.
+            compression (str, optional): Compression of the Arrow files: "zstd", "lz4" or "uncompressed".
+                Uncompressed files are read without copying the data. Defaults to "zstd".
+            session (requests.Session, optional): Session used to send requests to the API.
+        """
+        self.directory = directory
+        self.api_base_url = api_base_url
+        self.compression = compression
+        self.__session = session if session is not None else create_session()
+        # Lookup indexes {corpusname: {"name": {...}, "id": {...}}}, built when first needed
+        self.__indexes = {}
+
+    def path(self, corpusname: str) -> str:
+        """Path of the Arrow file of a corpus
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+        """
+        return os.path.join(self.directory, f"{corpusname}.arrow")
+
+    def exists(self, corpusname: str) -> bool:
+        """Check if the metadata of a corpus is in the store
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+        """
+        return os.path.exists(self.path(corpusname))
+
+    def fetch(self, corpusname: str, refresh: bool = False) -> str:
+        """Download the metadata of a corpus and store it, unless it is stored already
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+            refresh (bool, optional): Download the metadata even if it is in the store. Defaults to False.
+
+        Returns:
+            str: Path of the Arrow file.
+        """
+        path = self.path(corpusname)
+        if os.path.exists(path) and not refresh:
+            logging.debug(f"Metadata of corpus '{corpusname}' is in the store.")
+            return path
+
+        logging.info(f"Downloading metadata of corpus '{corpusname}'.")
+        csv_text = api_get(session=self.__session,
+                           api_base_url=self.api_base_url,
+                           corpusname=corpusname,
+                           method="metadata",
+                           headers={"accept": "text/csv"},
+                           parse_json=False)
+        table = parse_metadata_csv(csv_text.encode("utf-8"))
+        self.write(corpusname, table)
+        return path
+
+    def write(self, corpusname: str, table: pa.Table):
+        """Write a metadata table of a corpus to the store
+
+        The file is written to a temporary path first and then moved, so that a failed write
+        does not leave a broken file behind.
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+            table (pa.Table): Metadata as returned by parse_metadata_csv.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(corpusname)
+        tmp_path = path + ".tmp"
+        feather.write_feather(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+        self.__indexes.pop(corpusname, None)
+        logging.debug(f"Wrote metadata of {table.num_rows} plays to {path}.")
+
+    def load_table(self, corpusname: str, columns: list = None) -> pa.Table:
+        """Load the metadata of a corpus as an Arrow table. The metadata is downloaded if it is not stored yet.
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+            columns (list, optional): Names of the columns to load. Defaults to all columns.
+        """
+        path = self.fetch(corpusname)
+        return feather.read_table(path, columns=columns, memory_map=True)
+
+    def load(self, corpusname: str, columns: list = None) -> pd.DataFrame:
+        """Load the metadata of a corpus as a DataFrame. The metadata is downloaded if it is not stored yet.
+
+        Integer columns that contain missing values are returned as nullable pandas types instead of floats.
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+            columns (list, optional): Names of the columns to load. Defaults to all columns.
+        """
+        return self.load_table(corpusname, columns=columns).to_pandas(types_mapper=nullable_pandas_type)
+
+    def __index(self, corpusname: str) -> dict:
+        """Get the row numbers of the plays by name and id"""
+        if corpusname not in self.__indexes:
+            table = self.load_table(corpusname, columns=["name", "id"])
+            self.__indexes[corpusname] = {
+                key: {value: row for row, value in enumerate(table.column(key).to_pylist())}
+                for key in ("name", "id")
+            }
+        return self.__indexes[corpusname]
+
+    def lookup(self, corpusname: str, name: str = None, id: str = None, columns: list = None) -> dict:
+        """Get the metadata of a single play by its name or id
+
+        Args:
+            corpusname (str): Identifier of the corpus.
+            name (str, optional): Name of the play, e.g. "lessing-emilia-galotti".
+            id (str, optional): DraCor ID of the play, e.g. "ger000088".
+            columns (list, optional): Names of the fields to return. Defaults to all fields.
+
+        Raises:
+            KeyError: There is no play with this name or id in the corpus.
+        """
+        if name is not None:
+            row = self.__index(corpusname)["name"][name]
+        elif id is not None:
+            row = self.__index(corpusname)["id"][id]
+        else:
+            raise ValueError("Either name or id of the play must be supplied.")
+
+        return self.load_table(corpusname, columns=columns).slice(row, 1).to_pylist()[0]
+
+
+_NULLABLE_PANDAS_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
+
+
+def nullable_pandas_type(arrow_type: pa.DataType):
+    """Map Arrow integer and boolean types to the nullable pandas types"""
+    return _NULLABLE_PANDAS_TYPES.get(arrow_type)
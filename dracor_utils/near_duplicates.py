@@ -0,0 +1,336 @@
+"""Near-duplicate plays across corpora with MinHash signatures and locality-sensitive hashing
+
+The same play is sometimes included in more than one corpus or in several versions. Comparing the texts of all pairs
+of plays is not feasible for tens of thousands of plays, so every spoken text (from /corpora/{corpusname}/plays/
+{playname}/spoken-text as get_data in the stylometric-text-classification notebook, or the speeches of a TEI document
+or DTS passage read with iter_passage) is reduced to its set of word shingles (sequences of shingle_size words) and
+to a MinHash signature of this set: the share of equal values of two signatures estimates the Jaccard similarity of
+the shingle sets. The signatures are split into bands; plays that agree in all values of at least one band are
+candidates (locality-sensitive hashing), and only the candidates are compared. Signatures and the table of plays are
+stored in a folder, so new plays are added without computing the signatures of the indexed plays again.
+
+Example:
+    >>> index = MinHashIndex("data/minhash")
+    >>> fetch_minhash_index(["ger", "rus", "fre"], index=index)
+    >>> index.candidate_pairs(min_similarity=0.8, across_corpora=True)
+    >>> index.add("ger", "goethe-faust-tei", spoken_text(iter_passage("faust.xml")))
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .api import DEFAULT_API_BASE_URL, create_session, list_playnames
+from .downloader import download_plays
+
+# Words of the shingles, as in the default token pattern of scikit-learn without the minimum length
+TOKEN_PATTERN = r"(?u)\b\w+\b"
+
+# Columns of the table of plays
+ROW_KEYS = ["corpus", "play", "numOfShingles"]
+
+
+def spoken_text(items: Iterable) -> str:
+    """Join the speeches of PassageItems (dts_document.py), e.g. of a TEI document read with iter_passage"""
+    return "\n".join(item.text for item in items if item.type == "speech" and item.text)
+
+
+def lsh_threshold(bands: int, rows: int) -> float:
+    """Get the similarity at which a pair becomes a candidate with probability of about one half"""
+    return (1 / bands) ** (1 / rows)
+
+
+class MinHashIndex:
+    """MinHash signatures of spoken texts with an LSH index, optionally stored in a folder
+    """
+
+    def __init__(self,
+                 directory: str = None,
+                 num_perm: int = 128,
+                 bands: int = 32,
+                 shingle_size: int = 5,
+                 lowercase: bool = True,
+                 seed: int = 1):
+        """
+
+        Args:
+            directory (str, optional): Folder of the index. An existing index in the folder is loaded with its
+                parameters. Defaults to an index in memory only.
+            num_perm (int, optional): Number of hash functions (length of a signature). Defaults to 128.
+            bands (int, optional): Number of bands of the LSH index; must divide num_perm. Defaults to 32, i.e.
+                bands of 4 values, which makes pairs with a similarity above about 0.42 likely candidates.
+            shingle_size (int, optional): Number of words of a shingle. Defaults to 5.
+            lowercase (bool, optional): Compare the texts in lower case. Defaults to True.
+            seed (int, optional): Seed of the hash functions. Defaults to 1.
+
+        Raises:
+            ValueError: bands does not divide num_perm.
+        """
+        self.directory = directory
+        params = {"num_perm": num_perm, "bands": bands, "shingle_size": shingle_size, "lowercase": lowercase,
+                  "seed": seed}
+        if directory is not None and os.path.exists(self.params_path):
+            with open(self.params_path, encoding="utf-8") as f:
+                params = json.load(f)
+        if params["num_perm"] % params["bands"]:
+            raise ValueError(f"The number of bands ({params['bands']}) must divide num_perm ({params['num_perm']}).")
+        self.params = params
+        self.rows_per_band = params["num_perm"] // params["bands"]
+
+        rng = np.random.default_rng(params["seed"])
+        # Hash functions (a * x + b) mod 2 ** 64 with odd a, the upper 32 bits are the hash value
+        self.__a = rng.integers(0, 2 ** 63, size=params["num_perm"], dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.__b = rng.integers(0, 2 ** 63, size=params["num_perm"], dtype=np.uint64)
+        self.__shingle_weights = rng.integers(0, 2 ** 63, size=params["shingle_size"],
+                                              dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.__band_weights = rng.integers(0, 2 ** 63, size=self.rows_per_band, dtype=np.uint64) * np.uint64(2) \
+            + np.uint64(1)
+        self.__find_tokens = re.compile(TOKEN_PATTERN).findall
+        self.__token_hashes = {}
+
+        self.__rows = []
+        self.__keys = {}
+        self.__signatures = [np.zeros((0, params["num_perm"]), dtype=np.uint32)]
+        self.__band_keys = None
+        if directory is not None and os.path.exists(self.signatures_path):
+            self.__load()
+
+    @property
+    def params_path(self) -> str:
+        return os.path.join(self.directory, "params.json")
+
+    @property
+    def signatures_path(self) -> str:
+        return os.path.join(self.directory, "signatures.npy")
+
+    @property
+    def rows_path(self) -> str:
+        return os.path.join(self.directory, "plays.parquet")
+
+    def __load(self):
+        signatures = np.load(self.signatures_path)
+        rows = pd.read_parquet(self.rows_path)
+        # The files are replaced one after the other, keep the plays that are in both
+        num_rows = min(len(signatures), len(rows))
+        self.__signatures = [signatures[:num_rows]]
+        self.__rows = rows.head(num_rows).to_dict("records")
+        self.__keys = {(row["corpus"], row["play"]): i for i, row in enumerate(self.__rows)}
+
+    def save(self):
+        """Write the parameters, the signatures and the table of plays to the folder"""
+        os.makedirs(self.directory, exist_ok=True)
+        for path, write in ((self.params_path, self.__write_params),
+                            (self.signatures_path, lambda f: np.save(f, self.signatures)),
+                            (self.rows_path, lambda f: self.rows.to_parquet(f, index=False))):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        logging.info(f"Stored the signatures of {len(self)} plays in {self.directory}.")
+
+    def __write_params(self, f):
+        f.write(json.dumps(self.params).encode("utf-8"))
+
+    def __len__(self) -> int:
+        return len(self.__rows)
+
+    def __contains__(self, key: tuple) -> bool:
+        return tuple(key) in self.__keys
+
+    @property
+    def rows(self) -> pd.DataFrame:
+        """Table of the indexed plays in the order of the signatures"""
+        return pd.DataFrame(self.__rows, columns=ROW_KEYS)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        """Signatures of the indexed plays, one row per play"""
+        if len(self.__signatures) > 1:
+            self.__signatures = [np.concatenate(self.__signatures)]
+        return self.__signatures[0]
+
+    def shingles(self, text: str) -> np.ndarray:
+        """Get the distinct 64-bit hashes of the word shingles of a text
+
+        Texts shorter than a shingle are a single shingle, empty texts have none.
+        """
+        tokens = self.__find_tokens(text.lower() if self.params["lowercase"] else text)
+        if not tokens:
+            return np.zeros(0, dtype=np.uint64)
+        codes, words = pd.factorize(pd.Series(tokens, dtype=object))
+        # Stable hashes of the words, so signatures stay comparable across sessions
+        word_hashes = np.array([self.__token_hashes.get(word) or self.__token_hashes.setdefault(
+            word, int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little"))
+            for word in words], dtype=np.uint64)
+        token_hashes = word_hashes[codes]
+        size = min(self.params["shingle_size"], len(token_hashes))
+        num_shingles = len(token_hashes) - size + 1
+        shingles = np.zeros(num_shingles, dtype=np.uint64)
+        for i in range(size):
+            shingles += token_hashes[i:i + num_shingles] * self.__shingle_weights[i]
+        return np.unique(shingles)
+
+    def signature(self, shingles: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+        """Get the MinHash signature of a set of shingle hashes; empty sets get the maximum value everywhere"""
+        signature = np.full(self.params["num_perm"], np.iinfo(np.uint32).max, dtype=np.uint64)
+        for start in range(0, len(shingles), chunk_size):
+            chunk = shingles[start:start + chunk_size]
+            hashes = (self.__a[:, None] * chunk[None, :] + self.__b[:, None]) >> np.uint64(32)
+            np.minimum(signature, hashes.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+    def add(self, corpusname: str, playname: str, text: str) -> bool:
+        """Add the signature of the spoken text of a play
+
+        Returns:
+            bool: True if the play was added, False if it is indexed already.
+        """
+        if (corpusname, playname) in self.__keys:
+            return False
+        shingles = self.shingles(text)
+        self.__keys[(corpusname, playname)] = len(self.__rows)
+        self.__rows.append({"corpus": corpusname, "play": playname, "numOfShingles": len(shingles)})
+        self.__signatures.append(self.signature(shingles)[None, :])
+        self.__band_keys = None
+        return True
+
+    def add_texts(self, texts: Iterable[tuple]) -> int:
+        """Add the signatures of many plays, see add
+
+        Args:
+            texts: Tuples (corpusname, playname, text).
+
+        Returns:
+            int: Number of added plays.
+        """
+        num_added = sum(self.add(corpusname, playname, text) for corpusname, playname, text in texts)
+        logging.info(f"Added {num_added} plays, {len(self)} plays are indexed.")
+        return num_added
+
+    @property
+    def band_keys(self) -> np.ndarray:
+        """Hash of every band of every signature, one row per play and one column per band"""
+        if self.__band_keys is None:
+            bands = self.signatures.astype(np.uint64).reshape(len(self), self.params["bands"], self.rows_per_band)
+            self.__band_keys = (bands * self.__band_weights).sum(axis=2, dtype=np.uint64)
+        return self.__band_keys
+
+    def similarity(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """Estimate the Jaccard similarity of the shingle sets of the plays i and j (rows of the table)"""
+        signatures = self.signatures
+        return (signatures[i] == signatures[j]).mean(axis=1)
+
+    def candidate_pairs(self,
+                        min_similarity: float = 0.5,
+                        across_corpora: bool = False,
+                        max_bucket_size: int = 1000) -> pd.DataFrame:
+        """Find pairs of plays whose signatures agree in at least one band and estimate their similarity
+
+        Args:
+            min_similarity (float, optional): Minimum estimated Jaccard similarity of a reported pair.
+                Defaults to 0.5. Pairs below lsh_threshold of the index are likely missed.
+            across_corpora (bool, optional): Only report pairs of plays of different corpora. Defaults to False.
+            max_bucket_size (int, optional): Skip buckets with more plays (e.g. many very short texts), as they
+                would produce a quadratic number of pairs. Defaults to 1000.
+
+        Returns:
+            pd.DataFrame: Columns "corpus1", "play1", "corpus2", "play2", "similarity" (estimated Jaccard
+                similarity) and "numOfBands" (number of equal bands), most similar pairs first.
+        """
+        band_keys = self.band_keys
+        # Plays without shingles all have the same signature
+        has_shingles = np.array([row["numOfShingles"] > 0 for row in self.__rows], dtype=bool)
+        pair_parts = [np.zeros(0, dtype=np.int64)]
+        num_skipped = 0
+        for band in range(self.params["bands"]):
+            rows = np.flatnonzero(has_shingles)
+            order = rows[np.argsort(band_keys[rows, band], kind="stable")]
+            keys = band_keys[order, band]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            sizes = np.diff(np.r_[starts, len(keys)])
+            for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+                if size > max_bucket_size:
+                    num_skipped += 1
+                    continue
+                members = np.sort(order[start:start + size])
+                first, second = np.triu_indices(size, k=1)
+                pair_parts.append(members[first] * len(self) + members[second])
+        if num_skipped:
+            logging.warning(f"Skipped {num_skipped} buckets with more than {max_bucket_size} plays.")
+
+        pairs = np.unique(np.concatenate(pair_parts))
+        first, second = pairs // max(len(self), 1), pairs % max(len(self), 1)
+        rows = self.rows
+        corpora = rows["corpus"].to_numpy(dtype=object)
+        if across_corpora:
+            different = corpora[first] != corpora[second]
+            first, second = first[different], second[different]
+        similarity = self.similarity(first, second)
+        selected = similarity >= min_similarity
+        first, second, similarity = first[selected], second[selected], similarity[selected]
+        playnames = rows["play"].to_numpy(dtype=object)
+        result = pd.DataFrame({
+            "corpus1": corpora[first],
+            "play1": playnames[first],
+            "corpus2": corpora[second],
+            "play2": playnames[second],
+            "similarity": similarity,
+            "numOfBands": (band_keys[first] == band_keys[second]).sum(axis=1),
+        })
+        logging.info(f"Found {len(result)} pairs of plays with a similarity of at least {min_similarity} "
+                     f"among {len(pairs)} candidates.")
+        return result.sort_values("similarity", ascending=False, ignore_index=True)
+
+    def query(self, text: str, min_similarity: float = 0.5) -> pd.DataFrame:
+        """Find the indexed plays that are similar to a text without adding it
+
+        Returns:
+            pd.DataFrame: The columns of the table of plays and "similarity", most similar plays first.
+        """
+        signature = self.signature(self.shingles(text)).astype(np.uint64)
+        keys = (signature.reshape(self.params["bands"], self.rows_per_band) * self.__band_weights).sum(
+            axis=1, dtype=np.uint64)
+        candidates = np.flatnonzero((self.band_keys == keys).any(axis=1))
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        result = self.rows.iloc[candidates].assign(similarity=similarity)
+        return result[result["similarity"] >= min_similarity].sort_values("similarity", ascending=False,
+                                                                           ignore_index=True)
+
+
+def fetch_minhash_index(corpora: list,
+                        index: MinHashIndex = None,
+                        api_base_url: str = DEFAULT_API_BASE_URL,
+                        max_workers: int = 8) -> MinHashIndex:
+    """Download the spoken text of the plays that are not indexed yet and add their signatures
+
+    The index is saved after every corpus if it has a folder.
+
+    Args:
+        corpora (list): Names of the corpora, e.g. ["ger", "rus"].
+        index (MinHashIndex, optional): Index to add the plays to. Defaults to a new index in memory.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+    """
+    index = index if index is not None else MinHashIndex()
+    session = create_session(max_connections=max_workers)
+    for corpusname in corpora:
+        try:
+            plays = [(corpusname, playname) for playname in list_playnames(corpusname, session=session,
+                                                                         api_base_url=api_base_url)
+                     if (corpusname, playname) not in index]
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Could not list the plays of corpus '{corpusname}': {e}")
+            continue
+        results = download_plays(plays, "spoken-text", api_base_url=api_base_url, max_workers=max_workers,
+                                 parse_json=False, session=session)
+        index.add_texts((result.corpusname, result.playname, result.data) for result in results if result.ok)
+        if index.directory is not None:
+            index.save()
+    return index
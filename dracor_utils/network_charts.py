@@ -0,0 +1,337 @@
+"""Precomputed layouts and cached charts of the relation networks of the gender visualization
+
+relationship_network.ipynb and dracor_visualization.ipynb rebuild the network of a play on every selection:
+node sizes and speech percentages, the circular layout and all layers of the Altair chart. This module computes
+the node positions, sizes and percentages of all plays of a GraphStore in a single pass and keeps the charts
+that have been built, with their Vega-Lite specifications, in a cache with LRU eviction, keyed by play and render
+options. Serializing a chart is the expensive step, so display renders the cached specification directly with
+the active Altair renderer instead of serializing the chart again.
+
+Example:
+    >>> layouts = NetworkLayouts.from_graph_store(GraphStore("data/ger_graphs.npz"))
+    >>> charts = NetworkChartCache(layouts, maxsize=64)
+    >>> charts.display("ger000088", title="Emilia Galotti")
+"""
+
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .api import GENDERS
+from .graph_store import GraphStore, RELATIONS
+
+# Columns of the node and edge tables of NetworkLayouts
+NODE_COLUMNS = ["play_id", "id", "Name", "Gender", "Spoken words", "Size", "Speech Percentage", "x", "y"]
+EDGE_COLUMNS = ["play_id", "edge", "source", "target", "Relation", "x", "y"]
+
+# Display names of genders and relations, as defined in the notebooks
+GENDER_NAMES = {"MALE": "Male", "FEMALE": "Female", "UNKNOWN": "Unknown"}
+RELATION_NAMES = {
+    "parent_of": "Parent-child",
+    "lover_of": "Lovers",
+    "related_with": "Related",
+    "associated_with": "Associated",
+    "siblings": "Siblings",
+    "spouses": "Spouses",
+    "friends": "Friends",
+}
+
+
+def circular_layout(num_nodes: int, scale: float = 1) -> np.ndarray:
+    """Positions of nodes on a circle, as computed by networkx.circular_layout
+
+    Args:
+        num_nodes (int): Number of nodes.
+        scale (float, optional): Radius of the circle. Defaults to 1.
+
+    Returns:
+        np.ndarray: Array of shape (num_nodes, 2).
+    """
+    if num_nodes == 0:
+        return np.zeros((0, 2))
+    if num_nodes == 1:
+        return np.zeros((1, 2))
+    theta = np.linspace(0, 1, num_nodes + 1)[:-1] * 2 * np.pi
+    positions = np.column_stack([np.cos(theta), np.sin(theta)])
+    positions -= positions.mean(axis=0)
+    limit = np.abs(positions).max()
+    if limit > 0:
+        positions *= scale / limit
+    return positions
+
+
+def chunked_title(title: str, max_length: int = 70) -> list:
+    """Split a title into lines of at most max_length characters"""
+    chunks = []
+    current_chunk = ""
+    for word in title.split():
+        if len(current_chunk) + len(word) <= max_length:
+            current_chunk += f"{word} "
+        else:
+            chunks.append(current_chunk.strip())
+            current_chunk = f"{word} "
+    chunks.append(current_chunk.strip())
+    return chunks
+
+
+class NetworkLayouts:
+    """Node positions, sizes and speech percentages of the relation networks of many plays
+    """
+
+    def __init__(self, nodes: pd.DataFrame, edges: pd.DataFrame):
+        """
+
+        Args:
+            nodes (pd.DataFrame): Node table with the columns "play_id", "id", "Name", "Gender", "Spoken words",
+                "Size", "Speech Percentage", "x" and "y".
+            edges (pd.DataFrame): Edge table with the columns "play_id", "edge", "source", "target", "Relation",
+                "x" and "y"; every edge has two rows, one per end.
+        """
+        self.nodes = nodes
+        self.edges = edges
+        self.__nodes_by_play = {play_id: frame.drop(columns="play_id").reset_index(drop=True)
+                                for play_id, frame in nodes.groupby("play_id", sort=False)}
+        self.__edges_by_play = {play_id: frame.drop(columns="play_id").reset_index(drop=True)
+                                for play_id, frame in edges.groupby("play_id", sort=False)}
+
+    @classmethod
+    def from_graph_store(cls, store: GraphStore, play_ids: list = None, scale: float = 1):
+        """Compute the layouts of the relation networks of all plays in a GraphStore
+
+        Sizes and percentages are computed as by set_character_name_and_size in the notebooks: the size of a node
+        is proportional to the spoken words of the character, the percentage is relative to all spoken words
+        in the play.
+
+        Args:
+            store (GraphStore): Store of the networks.
+            play_ids (list, optional): Plays to include. Defaults to all plays with a relation network.
+            scale (float, optional): Radius of the circular layout. Defaults to 1.
+        """
+        if play_ids is None:
+            play_ids = store.play_ids_with_relations
+
+        node_frames = []
+        edge_frames = []
+        for play_id in play_ids:
+            graphs = store.play(play_id)
+            all_nodes = graphs.nodes
+            max_words = all_nodes["spokenWords"].max()
+            sum_words = all_nodes["spokenWords"].sum()
+
+            relation_nodes = all_nodes[all_nodes["inRelations"]]
+            positions = circular_layout(len(relation_nodes), scale=scale)
+            words = relation_nodes["spokenWords"].to_numpy()
+            nodes = pd.DataFrame({
+                "play_id": play_id,
+                "id": relation_nodes["id"].to_numpy(),
+                "Name": relation_nodes["label"].to_numpy(),
+                "Gender": relation_nodes["gender"].to_numpy(),
+                "Spoken words": words,
+                "Size": words / max_words * 200 + 25 if max_words > 0 else np.full(len(words), 25.0),
+                "Speech Percentage": np.round(words / sum_words * 100, 2) if sum_words > 0 else np.zeros(len(words)),
+                "x": positions[:, 0],
+                "y": positions[:, 1],
+            })
+            node_frames.append(nodes)
+
+            # Map node numbers of the play to rows of the relation network
+            row_of_node = pd.Series(np.arange(len(relation_nodes)), index=relation_nodes.index)
+            relations = graphs.relations
+            source_rows = row_of_node[relations["source"]].to_numpy()
+            target_rows = row_of_node[relations["target"]].to_numpy()
+            num_edges = len(relations)
+            ends = np.concatenate([source_rows, target_rows])
+            edge_frames.append(pd.DataFrame({
+                "play_id": play_id,
+                "edge": np.tile(np.arange(num_edges), 2),
+                "source": np.tile(nodes["id"].to_numpy()[source_rows], 2),
+                "target": np.tile(nodes["id"].to_numpy()[target_rows], 2),
+                "Relation": np.tile(relations["relation"].to_numpy(), 2),
+                "x": positions[ends, 0] if num_edges else np.zeros(0),
+                "y": positions[ends, 1] if num_edges else np.zeros(0),
+            }))
+
+        logging.info(f"Computed layouts of {len(node_frames)} plays.")
+        if not node_frames:
+            return cls(pd.DataFrame(columns=NODE_COLUMNS), pd.DataFrame(columns=EDGE_COLUMNS))
+        return cls(pd.concat(node_frames, ignore_index=True), pd.concat(edge_frames, ignore_index=True))
+
+    @classmethod
+    def load(cls, path_prefix: str):
+        """Load layouts saved with save
+
+        Args:
+            path_prefix (str): Prefix of the files, e.g. "data/ger_layouts".
+        """
+        return cls(pd.read_parquet(f"{path_prefix}_nodes.parquet"), pd.read_parquet(f"{path_prefix}_edges.parquet"))
+
+    def save(self, path_prefix: str):
+        """Save the layouts to two Parquet files "{path_prefix}_nodes.parquet" and "{path_prefix}_edges.parquet"
+
+        Args:
+            path_prefix (str): Prefix of the files, e.g. "data/ger_layouts".
+        """
+        self.nodes.to_parquet(f"{path_prefix}_nodes.parquet", index=False)
+        self.edges.to_parquet(f"{path_prefix}_edges.parquet", index=False)
+
+    def play(self, play_id: str) -> tuple:
+        """Get the node and edge table of a play
+
+        Args:
+            play_id (str): Identifier of the play.
+        """
+        empty_edges = self.edges.iloc[0:0].drop(columns="play_id")
+        return self.__nodes_by_play[play_id], self.__edges_by_play.get(play_id, empty_edges)
+
+
+def build_network_chart(nodes: pd.DataFrame,
+                        edges: pd.DataFrame,
+                        width: int = 400,
+                        height: int = 400,
+                        edge_width: int = 4,
+                        title: str = None):
+    """Build the relation network chart with the gender and relation filters of the notebooks
+
+    Args:
+        nodes (pd.DataFrame): Node table of a play as returned by NetworkLayouts.play.
+        edges (pd.DataFrame): Edge table of a play as returned by NetworkLayouts.play.
+        width (int, optional): Width of the network in pixels. Defaults to 400.
+        height (int, optional): Height of the network in pixels. Defaults to 400.
+        edge_width (int, optional): Width of the edges in pixels. Defaults to 4.
+        title (str, optional): Title of the chart.
+    """
+    import altair as alt
+
+    relation = pd.DataFrame({"Relation": RELATIONS})
+    relation["Relation_Display"] = relation["Relation"].map(RELATION_NAMES)
+    relation_selection = alt.selection_point(fields=["Relation"], toggle="true")
+    relation_color = alt.condition(relation_selection, alt.Color("Relation:N", legend=None), alt.value("lightgray"))
+    relation_filter = alt.Chart(
+        relation,
+        title=alt.TitleParams("Filter relation", anchor="start")
+    ).mark_rect(cursor="pointer").encode(
+        y=alt.Y("Relation_Display", title=""),
+        color=relation_color
+    ).add_params(relation_selection)
+
+    gender = pd.DataFrame({"Gender": GENDERS})
+    gender["Gender_Display"] = gender["Gender"].map(GENDER_NAMES)
+    gender_selection = alt.selection_point(fields=["Gender"], toggle="true")
+    gender_color = alt.condition(gender_selection, alt.Color("Gender:N", legend=None), alt.value("lightgray"))
+    gender_shape = alt.Shape("Gender:N", legend=None)
+    gender_filter = alt.Chart(
+        gender,
+        title=alt.TitleParams("Filter gender", anchor="start")
+    ).mark_point(size=300, cursor="pointer", filled=True, opacity=1).encode(
+        y=alt.Y("Gender_Display", title=""),
+        color=gender_color,
+        shape=gender_shape
+    ).add_params(gender_selection)
+
+    edge_layer = alt.Chart(edges).mark_line(strokeWidth=edge_width).encode(
+        x=alt.X("x", axis=None),
+        y=alt.Y("y", axis=None),
+        detail="edge",
+        color=relation_color
+    ).transform_filter(relation_selection)
+
+    node_layer = alt.Chart(nodes).mark_point(opacity=1).encode(
+        x=alt.X("x", axis=None),
+        y=alt.Y("y", axis=None),
+        size=alt.Size("Size", legend=None),
+        tooltip=["Name", "Spoken words", "Speech Percentage"],
+        color=gender_color,
+        fill=gender_color,
+        shape=gender_shape
+    )
+
+    network_chart = (edge_layer + node_layer).properties(width=width, height=height)
+    chart = (gender_filter & relation_filter) | network_chart
+    chart = chart.configure_view(strokeWidth=0).configure_axis(domainOpacity=0)
+    if title is not None:
+        chart = chart.properties(title=alt.TitleParams(chunked_title(title), anchor="middle", fontSize=20))
+    return chart
+
+
+class NetworkChartCache:
+    """Charts of the relation networks and their Vega-Lite specifications, cached by play and render options with
+    LRU eviction
+    """
+
+    def __init__(self, layouts: NetworkLayouts, maxsize: int = 64):
+        """
+
+        Args:
+            layouts (NetworkLayouts): Precomputed layouts of the plays.
+            maxsize (int, optional): Maximum number of cached charts. Defaults to 64.
+        """
+        self.layouts = layouts
+        self.maxsize = maxsize
+        self.__cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __get(self, play_id: str, options: dict) -> tuple:
+        """Get (chart, specification) of a play from the cache, build and serialize the chart on a miss"""
+        key = (play_id, tuple(sorted(options.items())))
+        if key in self.__cache:
+            self.hits += 1
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+
+        self.misses += 1
+        nodes, edges = self.layouts.play(play_id)
+        chart = build_network_chart(nodes, edges, **options)
+        entry = self.__cache[key] = (chart, chart.to_dict())
+        if len(self.__cache) > self.maxsize:
+            self.__cache.popitem(last=False)
+        return entry
+
+    def chart(self, play_id: str, **options):
+        """Get the Altair chart of a play, build it if it is not in the cache
+
+        Displaying the chart object serializes it again; use display for cached charts.
+
+        Args:
+            play_id (str): Identifier of the play.
+            **options: Render options of build_network_chart, e.g. width, height or title.
+        """
+        return self.__get(play_id, options)[0]
+
+    def spec(self, play_id: str, **options) -> dict:
+        """Get the Vega-Lite specification of the chart of a play, build it if it is not in the cache
+
+        Args:
+            play_id (str): Identifier of the play.
+            **options: Render options of build_network_chart, e.g. width, height or title.
+
+        Returns:
+            dict: The cached specification; copy it before changing it.
+        """
+        return self.__get(play_id, options)[1]
+
+    def display(self, play_id: str, **options):
+        """Show the chart of a play in a notebook from its cached specification
+
+        The specification is passed to the active Altair renderer (alt.renderers), as Altair does when it
+        displays a chart, but without serializing and validating the chart again.
+
+        Args:
+            play_id (str): Identifier of the play.
+            **options: Render options of build_network_chart, e.g. width, height or title.
+        """
+        import altair as alt
+        from IPython.display import display
+
+        bundle = alt.renderers.get()(self.spec(play_id, **options))
+        if isinstance(bundle, tuple):
+            bundle, metadata = bundle
+            display(bundle, metadata=metadata, raw=True)
+        else:
+            display(bundle, raw=True)
+
+    def clear(self):
+        """Remove all charts from the cache"""
+        self.__cache.clear()
@@ -0,0 +1,255 @@
+"""Local computation of co-occurrence network metrics for whole corpora
+
+The co-occurrence network of a play is built from the speakers of its segments (field "segments" of
+/corpora/{corpusname}/plays/{playname}) as a sparse adjacency matrix: two characters are connected if they speak
+in the same segment, the weight of the edge is the number of segments they share. The metrics provided by the
+DraCor API (degree, weighted degree, closeness, betweenness, eigenvector) are computed with matrix operations, for
+many plays at once on a pool of processes. Betweenness can be approximated from a sample of source nodes for plays
+with very large casts.
+
+Example:
+    >>> plays = [result.data for result in download_corpus("ger", None) if result.ok]
+    >>> metrics_df = compute_metrics_batch(plays, corpusname="ger")
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse import linalg as sparse_linalg
+
+# Names of the computed metrics, as used by the DraCor API
+METRICS = ["degree", "weightedDegree", "closeness", "betweenness", "eigenvector"]
+
+
+def build_adjacency(character_ids: list, segment_speakers: list, window: int = 1) -> sparse.csr_matrix:
+    """Build the weighted adjacency matrix of the co-occurrence network
+
+    Args:
+        character_ids (list): Identifiers of the characters; defines the order of rows and columns.
+        segment_speakers (list): For each segment the list of the identifiers of its speakers.
+        window (int, optional): Number of consecutive segments in which characters count as co-occurring.
+            Defaults to 1, i.e. characters co-occur if they speak in the same segment (DraCor's definition).
+
+    Returns:
+        sparse.csr_matrix: Symmetric matrix; entry (i, j) is the number of segments (windows) shared by
+            the characters i and j. The diagonal is empty.
+    """
+    index = {character_id: i for i, character_id in enumerate(character_ids)}
+    rows = []
+    cols = []
+    for segment_number, speakers in enumerate(segment_speakers):
+        for speaker in set(speakers):
+            if speaker in index:
+                rows.append(index[speaker])
+                cols.append(segment_number)
+
+    # Incidence matrix characters x segments
+    incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                  shape=(len(character_ids), len(segment_speakers)))
+    num_segments = len(segment_speakers)
+    if window > 1 and num_segments > 1:
+        # A character is present in a window if it speaks in any of its segments; windows longer than the
+        # play are cut to the play
+        offsets = list(range(min(window, num_segments)))
+        band = sparse.diags([np.ones(num_segments - k) for k in offsets],
+                            offsets=offsets, shape=(num_segments, num_segments))
+        incidence = (incidence @ band).sign()
+
+    adjacency = (incidence @ incidence.T).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    return adjacency
+
+
+def betweenness_centrality(adjacency: sparse.csr_matrix, sources: np.ndarray = None) -> np.ndarray:
+    """Compute the (normalized) betweenness centrality of an unweighted, undirected network
+
+    Brandes' algorithm, run for all source nodes at once: the breadth-first searches and the accumulation
+    of dependencies are matrix products, one per distance level.
+
+    Args:
+        adjacency (sparse.csr_matrix): Symmetric adjacency matrix; weights are ignored.
+        sources (np.ndarray, optional): Source nodes to start from. If only a sample of the nodes is given,
+            the result is an estimate that is scaled up accordingly. Defaults to all nodes.
+
+    Returns:
+        np.ndarray: Betweenness of each node, normalized as by networkx.betweenness_centrality.
+    """
+    n = adjacency.shape[0]
+    if n <= 2:
+        return np.zeros(n)
+    if sources is None:
+        sources = np.arange(n)
+    k = len(sources)
+
+    graph = adjacency.sign().astype(float).tocsr()
+    sigma = np.zeros((k, n))
+    sigma[np.arange(k), sources] = 1
+    dist = np.full((k, n), -1)
+    dist[np.arange(k), sources] = 0
+
+    # Forward: count the shortest paths level by level
+    frontier = sigma.copy()
+    level = 0
+    while True:
+        paths = (graph @ frontier.T).T
+        new = (paths > 0) & (dist < 0)
+        if not new.any():
+            break
+        level += 1
+        dist[new] = level
+        frontier = np.where(new, paths, 0)
+        sigma += frontier
+
+    # Backward: accumulate the dependencies from the deepest level
+    delta = np.zeros((k, n))
+    safe_sigma = np.where(sigma > 0, sigma, 1)
+    for d in range(level, 0, -1):
+        coefficient = np.where(dist == d, (1 + delta) / safe_sigma, 0)
+        contribution = (graph @ coefficient.T).T
+        delta += np.where(dist == d - 1, sigma * contribution, 0)
+    delta[np.arange(k), sources] = 0
+
+    betweenness = delta.sum(axis=0) / ((n - 1) * (n - 2))
+    return betweenness * (n / k)
+
+
+def closeness_centrality(adjacency: sparse.csr_matrix) -> np.ndarray:
+    """Compute the closeness centrality of an unweighted, undirected network
+
+    Distances are only taken into account within the component of a node; the result is scaled by the size of
+    the component (Wasserman and Faust), as networkx.closeness_centrality does by default.
+    """
+    n = adjacency.shape[0]
+    if n <= 1:
+        return np.zeros(n)
+    distances = csgraph.shortest_path(adjacency, method="D", unweighted=True, directed=False)
+    reachable = np.isfinite(distances) & (distances > 0)
+    num_reachable = reachable.sum(axis=1)
+    total = np.where(reachable, distances, 0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        closeness = np.where(total > 0, num_reachable / total * num_reachable / (n - 1), 0.0)
+    return closeness
+
+
+def eigenvector_centrality(adjacency: sparse.csr_matrix, weighted: bool = False) -> np.ndarray:
+    """Compute the eigenvector centrality, normalized to unit length as by networkx.eigenvector_centrality
+
+    Args:
+        adjacency (sparse.csr_matrix): Symmetric adjacency matrix.
+        weighted (bool, optional): Use the edge weights. Defaults to False.
+    """
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    matrix = adjacency if weighted else adjacency.sign()
+    if matrix.nnz == 0:
+        return np.full(n, 1 / np.sqrt(n))
+    if n <= 500:
+        _, vectors = np.linalg.eigh(matrix.toarray())
+        vector = vectors[:, -1]
+    else:
+        _, vectors = sparse_linalg.eigsh(matrix.astype(float), k=1, which="LA")
+        vector = vectors[:, 0]
+    vector = np.abs(vector)
+    return vector / np.linalg.norm(vector)
+
+
+def compute_metrics(character_ids: list,
+                    segment_speakers: list,
+                    window: int = 1,
+                    approximate_above: int = 500,
+                    num_pivots: int = 100,
+                    seed: int = 42) -> pd.DataFrame:
+    """Compute the network metrics of the characters of a single play
+
+    Args:
+        character_ids (list): Identifiers of the characters.
+        segment_speakers (list): For each segment the list of the identifiers of its speakers.
+        window (int, optional): Number of consecutive segments in which characters count as co-occurring.
+            Defaults to 1.
+        approximate_above (int, optional): Estimate the betweenness from a sample of source nodes if the play
+            has more characters. Defaults to 500.
+        num_pivots (int, optional): Number of sampled source nodes. Defaults to 100.
+        seed (int, optional): Seed of the sampling of source nodes. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: One row per character indexed by its identifier with the columns in METRICS.
+    """
+    adjacency = build_adjacency(character_ids, segment_speakers, window=window)
+    n = adjacency.shape[0]
+
+    sources = None
+    if n > approximate_above and num_pivots < n:
+        sources = np.random.default_rng(seed).choice(n, size=num_pivots, replace=False)
+
+    return pd.DataFrame({
+        "degree": np.diff(adjacency.indptr),
+        "weightedDegree": np.asarray(adjacency.sum(axis=1)).ravel(),
+        "closeness": closeness_centrality(adjacency),
+        "betweenness": betweenness_centrality(adjacency, sources=sources),
+        "eigenvector": eigenvector_centrality(adjacency),
+    }, index=pd.Index(character_ids, name="id"))
+
+
+def _play_metrics(args: tuple) -> tuple:
+    """Compute the metrics of a play in a worker process
+
+    Returns:
+        tuple: (corpusname, playname, metrics, error); metrics is None and error a message if the play failed.
+    """
+    corpusname, playname, character_ids, segment_speakers, options = args
+    try:
+        metrics = compute_metrics(character_ids, segment_speakers, **options).reset_index()
+    except (ValueError, IndexError, KeyError, TypeError) as e:
+        return corpusname, playname, None, f"{type(e).__name__}: {e}"
+    metrics.insert(0, "play", playname)
+    metrics.insert(0, "corpus", corpusname)
+    return corpusname, playname, metrics, None
+
+
+def _compact_play(play: dict, corpusname: str) -> tuple:
+    """Reduce a play as returned by the API to the data needed to build the network"""
+    character_ids = [character["id"] for character in play["characters"]]
+    segment_speakers = [segment.get("speakers", []) for segment in play["segments"]]
+    return play.get("corpus", corpusname), play["name"], character_ids, segment_speakers
+
+
+def compute_metrics_batch(plays: Iterable[dict],
+                          corpusname: str = None,
+                          processes: int = None,
+                          chunksize: int = 8,
+                          **options) -> pd.DataFrame:
+    """Compute the network metrics of many plays on a pool of processes
+
+    Args:
+        plays: Plays as returned by /corpora/{corpusname}/plays/{playname}, i.e. dictionaries with
+            the fields "name", "characters" and "segments".
+        corpusname (str, optional): Name of the corpus, used if a play does not include the field "corpus".
+        processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Number of plays sent to a worker at once. Defaults to 8.
+        **options: Further arguments of compute_metrics, e.g. window or approximate_above.
+
+    Returns:
+        pd.DataFrame: Long-format table with the columns "corpus", "play", "id" and the columns in METRICS.
+            Plays whose metrics can't be computed are logged and left out.
+    """
+    tasks = (_compact_play(play, corpusname) + (options,) for play in plays)
+    frames = []
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for corpus, playname, metrics, error in executor.map(_play_metrics, tasks, chunksize=chunksize):
+            if error is not None:
+                num_failed += 1
+                logging.warning(f"Could not compute the metrics of play '{playname}' of corpus '{corpus}': {error}")
+            else:
+                frames.append(metrics)
+    logging.info(f"Computed network metrics of {len(frames)} plays, {num_failed} failed.")
+    if not frames:
+        return pd.DataFrame(columns=["corpus", "play", "id"] + METRICS)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,154 @@
+"""Ranking of characters as in the paper "To Catch a Protagonist" for all plays of one or more corpora
+
+The notebook catch-a-protagonist-in-dracor ranks the characters of a single play by eight metrics and combines
+the ranks. The functions in this module compute the same ranks for a long-format table holding the characters of
+many plays with grouped ranks, i.e. in a single pass over the table.
+
+Example:
+    >>> characters_df = fetch_characters(["ger", "shake"])
+    >>> ranked_df = rank_characters(characters_df)
+    >>> protagonists_df = get_protagonists(ranked_df)
+"""
+
+import logging
+
+import pandas as pd
+
+from .api import DEFAULT_API_BASE_URL
+from .downloader import download_corpus
+
+# Metrics based on the co-occurrence network
+GRAPH_METRICS = ["degree", "closeness", "betweenness", "weightedDegree", "eigenvector"]
+
+# Metrics based on the text of the characters
+CONTENT_METRICS = ["numOfScenes", "numOfSpeechActs", "numOfWords"]
+
+# Columns identifying a play in the long-format table
+PLAY_KEYS = ["corpus", "play"]
+
+
+def fetch_characters(corpora: list,
+                     api_base_url: str = DEFAULT_API_BASE_URL,
+                     max_workers: int = 8) -> pd.DataFrame:
+    """Download the characters of all plays of the corpora into a single long-format table
+
+    Args:
+        corpora (list): Names of the corpora, e.g. ["ger"].
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Returns:
+        pd.DataFrame: One row per character with the columns "corpus", "play" and the fields returned
+            by /corpora/{corpusname}/plays/{playname}/characters. Without any characters the table is empty
+            but has the columns needed by rank_characters.
+    """
+    frames = []
+    for corpusname in corpora:
+        for result in download_corpus(corpusname, "characters", api_base_url=api_base_url,
+                                      max_workers=max_workers, parse_json=True):
+            if not result.ok or not result.data:
+                continue
+            frame = pd.DataFrame(result.data)
+            frame.insert(0, "play", result.playname)
+            frame.insert(0, "corpus", result.corpusname)
+            frames.append(frame)
+
+    logging.info(f"Retrieved the characters of {len(frames)} plays.")
+    if not frames:
+        return pd.DataFrame(columns=PLAY_KEYS + ["id"] + GRAPH_METRICS + CONTENT_METRICS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def rank_characters(characters_df: pd.DataFrame,
+                    graph_metrics: list = None,
+                    content_metrics: list = None,
+                    play_keys: list = None) -> pd.DataFrame:
+    """Rank the characters of every play by each metric and combine the ranks
+
+    Computes the same columns as the notebook catch-a-protagonist-in-dracor, but ranks within each play:
+
+    * "{metric}_rank": rank by each metric, the highest value gets rank 1 (ties get the minimum rank)
+    * "centrality_rank_avg", "centrality_rank_std": average and (scaled) standard deviation of these ranks
+      and their ranks "centrality_rank_avg_rank", "centrality_rank_std_rank"
+    * "avg_graph_rank", "avg_content_rank": ranks of the average rank by graph and by content metrics
+    * "overall_avg", "overall_avg_rank": average of both and its rank
+
+    Args:
+        characters_df (pd.DataFrame): Long-format table of characters, e.g. as returned by fetch_characters.
+        graph_metrics (list, optional): Network metrics to rank by. Defaults to GRAPH_METRICS.
+        content_metrics (list, optional): Text-based metrics to rank by. Defaults to CONTENT_METRICS.
+        play_keys (list, optional): Columns identifying a play. Defaults to ["corpus", "play"].
+    """
+    graph_metrics = GRAPH_METRICS if graph_metrics is None else graph_metrics
+    content_metrics = CONTENT_METRICS if content_metrics is None else content_metrics
+    play_keys = PLAY_KEYS if play_keys is None else play_keys
+    metrics = graph_metrics + content_metrics
+
+    df = characters_df.copy()
+    by_play = df.groupby(play_keys, sort=False)
+
+    metric_ranks = by_play[metrics].rank(method="min", ascending=False)
+    metric_ranks.columns = [f"{metric}_rank" for metric in metrics]
+    df[metric_ranks.columns] = metric_ranks
+
+    df["centrality_rank_avg"] = metric_ranks.mean(axis=1)
+    df["centrality_rank_std"] = metric_ranks.std(axis=1) / len(metrics)
+
+    # Combined values are ranked within each play, the lowest value gets rank 1
+    combined = pd.DataFrame({
+        "centrality_rank_avg_rank": df["centrality_rank_avg"],
+        "centrality_rank_std_rank": df["centrality_rank_std"],
+        "avg_graph_rank": metric_ranks[[f"{metric}_rank" for metric in graph_metrics]].mean(axis=1),
+        "avg_content_rank": metric_ranks[[f"{metric}_rank" for metric in content_metrics]].mean(axis=1),
+    })
+    combined[play_keys] = df[play_keys]
+    combined = combined.groupby(play_keys, sort=False).rank(method="min")
+    df[combined.columns] = combined
+
+    df["overall_avg"] = df[["avg_graph_rank", "avg_content_rank"]].mean(axis=1)
+    df["overall_avg_rank"] = df.groupby(play_keys, sort=False)["overall_avg"].rank(method="min")
+    return df
+
+
+def get_protagonists(ranked_df: pd.DataFrame,
+                     rank_column: str = "overall_avg_rank",
+                     play_keys: list = None,
+                     character_key: str = "id") -> pd.DataFrame:
+    """Get the characters ranked first in each play
+
+    Args:
+        ranked_df (pd.DataFrame): Table as returned by rank_characters.
+        rank_column (str, optional): Rank that decides on the protagonist. Defaults to "overall_avg_rank".
+        play_keys (list, optional): Columns identifying a play. Defaults to ["corpus", "play"].
+        character_key (str, optional): Column identifying a character. Defaults to "id".
+
+    Returns:
+        pd.DataFrame: One row per play with the list of characters ranked first ("protagonists"),
+            their number ("numOfProtagonists") and whether the first rank is shared ("tie").
+    """
+    play_keys = PLAY_KEYS if play_keys is None else play_keys
+    winners = ranked_df[ranked_df[rank_column] == 1]
+    protagonists = winners.groupby(play_keys, sort=True)[character_key].agg(list).rename("protagonists").to_frame()
+    protagonists["numOfProtagonists"] = protagonists["protagonists"].str.len()
+    protagonists["tie"] = protagonists["numOfProtagonists"] > 1
+    return protagonists.reset_index()
+
+
+def write_ranking(ranked_df: pd.DataFrame,
+                  path: str,
+                  rank_column: str = "overall_avg_rank",
+                  play_keys: list = None):
+    """Write the ranked characters to a Parquet file and mark the protagonists of each play
+
+    Args:
+        ranked_df (pd.DataFrame): Table as returned by rank_characters.
+        path (str): Path of the Parquet file.
+        rank_column (str, optional): Rank that decides on the protagonist. Defaults to "overall_avg_rank".
+        play_keys (list, optional): Columns identifying a play. Defaults to ["corpus", "play"].
+    """
+    play_keys = PLAY_KEYS if play_keys is None else play_keys
+    ranked_df = ranked_df.copy()
+    ranked_df["isProtagonist"] = ranked_df[rank_column] == 1
+    ranked_df["isTie"] = ranked_df["isProtagonist"] & (
+        ranked_df.groupby(play_keys, sort=False)["isProtagonist"].transform("sum") > 1)
+    ranked_df.to_parquet(path, index=False)
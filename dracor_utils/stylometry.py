@@ -0,0 +1,317 @@
+"""Cached feature matrices and parallel evaluation of the classification of plays by author
+
+texteval in the stylometric-text-classification notebook vectorizes the whole corpus for every repetition of every
+configuration and trains one MultinomialNB at a time: comparing ten configurations with five repetitions each
+tokenizes the corpus fifty times. Here the corpus is tokenized once per analyzer (words, words with the pattern
+r"\\b\\w+\\b", character n-grams in word boundaries) with the widest n-gram range of the requested configurations.
+All configurations are derived from this count matrix by selecting columns (n-gram order, document frequency) and,
+for TF-IDF, by reweighting. The matrices are cached on disk as uncompressed CSR arrays that are read as memory maps;
+the splits of all configurations and repetitions are evaluated on a pool of processes.
+
+Example:
+    >>> texts, target = fetch_texts_by_author("ger")
+    >>> features = FeatureCache(texts, directory="data/features/ger")
+    >>> scores = evaluate_configs(features, target, NOTEBOOK_CONFIGS, repetitions=5)
+    >>> scores.groupby("config")["accuracy"].agg(["mean", "std"])
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .api import DEFAULT_API_BASE_URL, api_get
+from .downloader import download_corpus
+
+# Default token pattern of scikit-learn's CountVectorizer
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+# Options of a configuration and their defaults (as in CountVectorizer), "tfidf" selects TfidfVectorizer
+CONFIG_DEFAULTS = {
+    "analyzer": "word",
+    "token_pattern": DEFAULT_TOKEN_PATTERN,
+    "lowercase": True,
+    "ngram_range": (1, 1),
+    "min_df": 1,
+    "max_df": 1.0,
+    "tfidf": False,
+}
+
+# The configurations compared in the stylometric-text-classification notebook
+NOTEBOOK_CONFIGS = {
+    "count": {},
+    "count_min_df": {"min_df": 0.3},
+    "count_max_df": {"max_df": 0.3},
+    "bigrams_min_df": {"ngram_range": (1, 2), "token_pattern": r"\b\w+\b", "min_df": 0.3},
+    "bigrams_max_df": {"ngram_range": (1, 2), "token_pattern": r"\b\w+\b", "max_df": 0.3},
+    "tfidf_min_df": {"tfidf": True, "min_df": 0.3},
+    "char_wb": {"analyzer": "char_wb"},
+    "char_wb_min_df": {"analyzer": "char_wb", "min_df": 0.3},
+    "char_wb_max_df": {"analyzer": "char_wb", "max_df": 0.3},
+    "char_wb_bigrams_min_df": {"analyzer": "char_wb", "ngram_range": (1, 2), "min_df": 0.3},
+    "char_wb_bigrams_max_df": {"analyzer": "char_wb", "ngram_range": (1, 2), "max_df": 0.3},
+}
+
+
+def fetch_texts_by_author(corpusname: str,
+                          api_base_url: str = DEFAULT_API_BASE_URL,
+                          max_workers: int = 8) -> tuple:
+    """Download the spoken text of all plays of a corpus that have a single author, as get_data in the notebook
+
+    Args:
+        corpusname (str): Name of the corpus, e.g. "ger".
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Returns:
+        tuple: The texts and the full names of their authors, ordered as in the corpus listing.
+    """
+    corpus = api_get(api_base_url=api_base_url, corpusname=corpusname, parse_json=True)
+    authors = {play["name"]: play["authors"][0]["fullname"]
+               for play in corpus["plays"] if len(play.get("authors", [])) == 1}
+    texts = {result.playname: result.data
+             for result in download_corpus(corpusname, "spoken-text", playnames=list(authors),
+                                           api_base_url=api_base_url, max_workers=max_workers, parse_json=False)
+             if result.ok}
+    playnames = [playname for playname in authors if playname in texts]
+    return [texts[playname] for playname in playnames], [authors[playname] for playname in playnames]
+
+
+def normalize_config(config: dict) -> dict:
+    """Complete a configuration with the default options
+
+    Raises:
+        ValueError: The configuration includes unsupported options.
+    """
+    unknown = set(config) - set(CONFIG_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unsupported options: {', '.join(sorted(unknown))}.")
+    config = {**CONFIG_DEFAULTS, **config}
+    config["ngram_range"] = tuple(config["ngram_range"])
+    if config["analyzer"] != "word":
+        # The token pattern is only used by the word analyzer
+        config["token_pattern"] = None
+    return config
+
+
+def make_grid(base: dict = None, **options) -> dict:
+    """Build configurations for all combinations of option values
+
+    Args:
+        base (dict, optional): Options shared by all configurations.
+        **options: Lists of values of options, e.g. min_df=[1, 0.1, 0.3], analyzer=["word", "char_wb"].
+
+    Returns:
+        dict: Configurations by name, e.g. {"min_df=0.3,analyzer=word": {...}}.
+    """
+    base = {} if base is None else base
+    names = list(options)
+    grid = {}
+    for values in itertools.product(*(options[name] for name in names)):
+        label = ",".join(f"{name}={value}" for name, value in zip(names, values))
+        grid[label] = {**base, **dict(zip(names, values))}
+    return grid
+
+
+def _key(values: dict) -> str:
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _ngram_orders(features: np.ndarray, analyzer: str) -> np.ndarray:
+    """Get the order of each n-gram; the tokens of the word analyzer are joined with spaces"""
+    features = pd.Series(features, dtype=object)
+    if analyzer == "word":
+        return features.str.count(" ").to_numpy() + 1
+    return features.str.len().to_numpy()
+
+
+def _document_count(value, num_documents: int) -> float:
+    """Translate min_df / max_df to a number of documents as CountVectorizer does"""
+    return value if isinstance(value, (int, np.integer)) else value * num_documents
+
+
+def save_matrix(path: str, matrix: sparse.csr_matrix, **arrays):
+    """Save a CSR matrix (and further arrays) as uncompressed .npy files in a folder that is replaced atomically"""
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    matrix = matrix.tocsr()
+    for name, array in {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr, **arrays}.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, "shape.json"), "w", encoding="utf-8") as f:
+        json.dump(list(matrix.shape), f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_matrix(path: str, mmap_mode: str = "r") -> sparse.csr_matrix:
+    """Load a CSR matrix saved with save_matrix, its arrays are memory-mapped by default"""
+    with open(os.path.join(path, "shape.json"), encoding="utf-8") as f:
+        shape = tuple(json.load(f))
+    data, indices, indptr = (np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                             for name in ("data", "indices", "indptr"))
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+class FeatureCache:
+    """Feature matrices of a fixed list of texts for any number of vectorizer configurations
+    """
+
+    def __init__(self, texts: list, directory: str = "data/features"):
+        """
+
+        Args:
+            texts (list): Texts of the documents, e.g. the spoken text of the plays.
+            directory (str, optional): Folder of the cached matrices. Defaults to "data/features".
+        """
+        self.texts = texts
+        self.num_documents = len(texts)
+        fingerprint = hashlib.sha1()
+        for text in texts:
+            fingerprint.update(hashlib.sha1(text.encode("utf-8")).digest())
+        # Matrices of other texts never share a folder
+        self.directory = os.path.join(directory, fingerprint.hexdigest()[:16])
+
+    @staticmethod
+    def __base_prefix(config: dict) -> str:
+        """Prefix of the folders of the count matrices of an analyzer, followed by the highest n-gram order"""
+        analysis = {key: config[key] for key in ("analyzer", "token_pattern", "lowercase")}
+        return f"counts-{_key(analysis)}-"
+
+    def path(self, config: dict) -> str:
+        """Get the folder of the cached matrix of a configuration"""
+        return os.path.join(self.directory, f"features-{_key(normalize_config(config))}")
+
+    def __base_matrix(self, config: dict) -> tuple:
+        """Get the count matrix of the analyzer of a configuration with n-grams up to its highest order
+
+        A count matrix of the same analyzer with n-grams of a higher order is reused.
+        """
+        prefix = self.__base_prefix(config)
+        max_order = config["ngram_range"][1]
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if name.startswith(prefix) and not name.endswith(".tmp") and int(name[len(prefix):]) >= max_order:
+                    path = os.path.join(self.directory, name)
+                    return load_matrix(path), np.load(os.path.join(path, "orders.npy"))
+
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        logging.info(f"Tokenizing {self.num_documents} documents with analyzer '{config['analyzer']}'.")
+        options = {"analyzer": config["analyzer"], "lowercase": config["lowercase"], "ngram_range": (1, max_order)}
+        if config["token_pattern"] is not None:
+            options["token_pattern"] = config["token_pattern"]
+        vectorizer = CountVectorizer(**options)
+        counts = vectorizer.fit_transform(self.texts).tocsr()
+        orders = _ngram_orders(vectorizer.get_feature_names_out(), config["analyzer"])
+        path = os.path.join(self.directory, f"{prefix}{max_order}")
+        save_matrix(path, counts, orders=orders)
+        return load_matrix(path), orders
+
+    def prepare(self, configs):
+        """Build the count matrices needed for a set of configurations, one per analyzer
+
+        Args:
+            configs: Configurations, a dictionary by name or a list.
+        """
+        configs = [normalize_config(config) for config in (configs.values() if isinstance(configs, dict) else configs)]
+        widest = {}
+        for config in configs:
+            analysis = (config["analyzer"], config["token_pattern"], config["lowercase"])
+            if analysis not in widest or config["ngram_range"][1] > widest[analysis]["ngram_range"][1]:
+                widest[analysis] = config
+        for config in widest.values():
+            self.__base_matrix(config)
+
+    def matrix(self, config: dict) -> sparse.csr_matrix:
+        """Get the (memory-mapped) feature matrix of a configuration, as fit_transform of the vectorizer would return
+
+        Args:
+            config (dict): Options of CountVectorizer ("analyzer", "token_pattern", "lowercase", "ngram_range",
+                "min_df", "max_df") and "tfidf" to weight the counts as TfidfVectorizer does.
+        """
+        path = self.path(config)
+        if os.path.isdir(path):
+            return load_matrix(path)
+
+        config = normalize_config(config)
+        counts, orders = self.__base_matrix(config)
+        min_order, max_order = config["ngram_range"]
+        document_frequencies = np.diff(counts.tocsc().indptr)
+        keep = ((orders >= min_order) & (orders <= max_order)
+                & (document_frequencies >= _document_count(config["min_df"], self.num_documents))
+                & (document_frequencies <= _document_count(config["max_df"], self.num_documents)))
+        features = counts[:, np.flatnonzero(keep)]
+        if config["tfidf"]:
+            from sklearn.feature_extraction.text import TfidfTransformer
+            features = TfidfTransformer().fit_transform(features)
+
+        save_matrix(path, features.tocsr())
+        logging.debug(f"Cached {features.shape[1]} features in {path}.")
+        return load_matrix(path)
+
+
+def _evaluate_split(args: tuple) -> float:
+    """Train and score MultinomialNB on one split in a worker process"""
+    from sklearn.naive_bayes import MultinomialNB
+
+    path, labels, train_indices, test_indices = args
+    features = load_matrix(path)
+    classifier = MultinomialNB()
+    classifier.fit(features[train_indices], labels[train_indices])
+    return classifier.score(features[test_indices], labels[test_indices])
+
+
+def evaluate_configs(features: FeatureCache,
+                     labels: list,
+                     configs: dict,
+                     repetitions: int = 5,
+                     test_size: float = 0.25,
+                     seed: int = 0,
+                     processes: int = None) -> pd.DataFrame:
+    """Evaluate MultinomialNB on random splits for each configuration, as texteval in the notebook
+
+    Repetition i uses the same split for all configurations, so the scores of the configurations can be
+    compared pairwise.
+
+    Args:
+        features (FeatureCache): Feature matrices of the texts.
+        labels (list): Label (author) of each text.
+        configs (dict): Configurations by name, e.g. NOTEBOOK_CONFIGS or the result of make_grid.
+        repetitions (int, optional): Number of random splits per configuration. Defaults to 5.
+        test_size (float, optional): Share of the texts used for testing. Defaults to 0.25, as train_test_split.
+        seed (int, optional): Seed of the first split. Defaults to 0.
+        processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        pd.DataFrame: One row per configuration and repetition with the columns "config", "repetition",
+            "numOfFeatures" and "accuracy".
+    """
+    from sklearn.model_selection import train_test_split
+
+    labels = np.asarray(labels)
+    features.prepare(configs)
+    paths = {name: features.path(config) for name, config in configs.items()}
+    num_features = {name: features.matrix(config).shape[1] for name, config in configs.items()}
+    splits = [train_test_split(np.arange(len(labels)), test_size=test_size, random_state=seed + repetition)
+              for repetition in range(repetitions)]
+
+    tasks = [(name, repetition) for name in configs for repetition in range(repetitions)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        scores = list(executor.map(_evaluate_split,
+                                   [(paths[name], labels, *splits[repetition]) for name, repetition in tasks]))
+
+    logging.info(f"Evaluated {len(configs)} configurations with {repetitions} repetitions each.")
+    return pd.DataFrame({
+        "config": [name for name, _ in tasks],
+        "repetition": [repetition for _, repetition in tasks],
+        "numOfFeatures": [num_features[name] for name, _ in tasks],
+        "accuracy": scores,
+    })
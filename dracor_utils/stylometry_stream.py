@@ -0,0 +1,200 @@
+"""Out-of-core classification of plays by author over any number of corpora
+
+get_data in the stylometric-text-classification notebook keeps the spoken text of all plays in memory before
+vectorizing. Here the texts arrive from a generator while they are being downloaded, are hashed into a fixed
+number of features (HashingVectorizer, no vocabulary) in small batches and are passed to a classifier that
+learns incrementally (partial_fit). Only one batch of texts is held in memory at a time.
+
+Each batch is scored before the classifier learns from it (progressive validation), which gives an estimate
+of the accuracy without keeping any text. Optionally a share of the plays, selected by a hash of the play name,
+is held out instead; only the hashed feature vectors of a bounded sample of them are kept to score the final model.
+The state of the default classifier grows with the number of authors, not with the number of texts.
+
+Example:
+    >>> plays_df = list_single_author_plays(["ger", "rus", "fre"])
+    >>> model = StreamingClassifier(classes=plays_df["author"].unique())
+    >>> model.fit_stream(stream_texts(plays_df))
+    >>> model.progress.tail()
+"""
+
+import hashlib
+import logging
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .api import DEFAULT_API_BASE_URL, api_get, create_session
+from .downloader import download_plays
+
+
+# Number of hashed features of the default vectorizer. MultinomialNB keeps two float64 arrays of
+# classes x features values (feature_count_, feature_log_prob_), i.e. 4 MB per author with 2 ** 18 features.
+DEFAULT_NUM_FEATURES = 2 ** 18
+
+
+def list_single_author_plays(corpora: list, api_base_url: str = DEFAULT_API_BASE_URL) -> pd.DataFrame:
+    """List the plays of the corpora that have a single author
+
+    Only the corpus listings are downloaded, so the set of authors (the classes) is known before any text.
+
+    Args:
+        corpora (list): Names of the corpora, e.g. ["ger", "rus"].
+        api_base_url (str, optional): Base URL of the DraCor API.
+
+    Returns:
+        pd.DataFrame: One row per play with the columns "corpus", "play" and "author" (full name).
+    """
+    session = create_session()
+    rows = []
+    for corpusname in corpora:
+        corpus = api_get(session=session, api_base_url=api_base_url, corpusname=corpusname, parse_json=True)
+        rows.extend((corpusname, play["name"], play["authors"][0]["fullname"])
+                    for play in corpus["plays"] if len(play.get("authors", [])) == 1)
+    return pd.DataFrame(rows, columns=["corpus", "play", "author"])
+
+
+def stream_texts(plays_df: pd.DataFrame,
+                 api_base_url: str = DEFAULT_API_BASE_URL,
+                 max_workers: int = 8) -> Iterator[tuple]:
+    """Download the spoken text of plays concurrently and yield them as they arrive
+
+    At most 2 * max_workers texts are downloaded ahead of the consumer.
+
+    Args:
+        plays_df (pd.DataFrame): Plays with the columns "corpus", "play" and "author",
+            e.g. as returned by list_single_author_plays.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+
+    Yields:
+        tuple: (corpusname, playname, author, text)
+    """
+    authors = {(row.corpus, row.play): row.author for row in plays_df.itertuples(index=False)}
+    for result in download_plays(authors, "spoken-text", api_base_url=api_base_url,
+                                 max_workers=max_workers, parse_json=False):
+        if result.ok:
+            yield result.corpusname, result.playname, authors[(result.corpusname, result.playname)], result.data
+
+
+def is_held_out(corpusname: str, playname: str, test_fraction: float, seed: int = 0) -> bool:
+    """Decide by a hash of the play whether it belongs to the test set; the decision is stable across runs"""
+    digest = hashlib.sha1(f"{seed}/{corpusname}/{playname}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64 < test_fraction
+
+
+class StreamingClassifier:
+    """Classifier of texts trained batch by batch on hashed features
+    """
+
+    def __init__(self,
+                 classes: Iterable[str],
+                 vectorizer=None,
+                 classifier=None,
+                 batch_size: int = 32,
+                 test_fraction: float = 0.0,
+                 max_test_plays: int = 1000,
+                 seed: int = 0):
+        """
+
+        The memory of the model does not depend on the number of texts: with the defaults it is bounded by
+        2 * 8 * DEFAULT_NUM_FEATURES bytes (4 MB) per class, plus the hashed vectors of at most max_test_plays
+        held-out plays.
+
+        Args:
+            classes: All labels (authors) that can occur in the stream.
+            vectorizer (optional): Stateless vectorizer. Defaults to a HashingVectorizer with DEFAULT_NUM_FEATURES
+                (2 ** 18) non-negative count features, which MultinomialNB requires.
+            classifier (optional): Classifier with partial_fit. Defaults to MultinomialNB().
+            batch_size (int, optional): Number of texts vectorized and learned at once. Defaults to 32.
+            test_fraction (float, optional): Share of the plays held out for testing the final model.
+                Defaults to 0, i.e. only progressive validation.
+            max_test_plays (int, optional): Maximum number of held-out plays whose vectors are kept; beyond it a
+                uniform sample of the held-out plays is kept (reservoir sampling). Defaults to 1000.
+            seed (int, optional): Seed of the selection of held-out plays. Defaults to 0.
+        """
+        if vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            vectorizer = HashingVectorizer(n_features=DEFAULT_NUM_FEATURES, alternate_sign=False, norm=None)
+        if classifier is None:
+            from sklearn.naive_bayes import MultinomialNB
+            classifier = MultinomialNB()
+
+        self.classes = np.asarray(sorted(set(classes)))
+        self.vectorizer = vectorizer
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.test_fraction = test_fraction
+        self.max_test_plays = max_test_plays
+        self.seed = seed
+        self.num_trained = 0
+        self.num_held_out = 0
+        self.__rng = np.random.default_rng(seed)
+        self.__fitted = False
+        self.__batches = []
+        self.__test_features = []
+        self.__test_labels = []
+
+    @property
+    def progress(self) -> pd.DataFrame:
+        """Progressive validation: number of trained texts and accuracy on each batch before learning from it"""
+        return pd.DataFrame(self.__batches, columns=["numTrained", "batchSize", "accuracy"])
+
+    def __learn(self, texts: list, labels: list):
+        features = self.vectorizer.transform(texts)
+        labels = np.asarray(labels)
+        accuracy = float(np.mean(self.classifier.predict(features) == labels)) if self.__fitted else np.nan
+        self.classifier.partial_fit(features, labels, classes=self.classes)
+        self.__fitted = True
+        self.num_trained += len(labels)
+        self.__batches.append((self.num_trained, len(labels), accuracy))
+        logging.debug(f"Trained on {self.num_trained} texts, accuracy on the last batch: {accuracy:.3f}.")
+
+    def __hold_out(self, text: str, label: str):
+        """Keep the vector of a held-out play, or replace a kept one once max_test_plays are kept"""
+        self.num_held_out += 1
+        if len(self.__test_labels) < self.max_test_plays:
+            self.__test_features.append(self.vectorizer.transform([text]))
+            self.__test_labels.append(label)
+            return
+        i = self.__rng.integers(self.num_held_out)
+        if i < self.max_test_plays:
+            self.__test_features[i] = self.vectorizer.transform([text])
+            self.__test_labels[i] = label
+
+    def fit_stream(self, documents: Iterable[tuple]):
+        """Train the classifier on a stream of documents
+
+        Args:
+            documents: Tuples (corpusname, playname, label, text), e.g. as yielded by stream_texts.
+        """
+        texts = []
+        labels = []
+        for corpusname, playname, label, text in documents:
+            if self.test_fraction > 0 and is_held_out(corpusname, playname, self.test_fraction, self.seed):
+                self.__hold_out(text, label)
+                continue
+            texts.append(text)
+            labels.append(label)
+            if len(texts) >= self.batch_size:
+                self.__learn(texts, labels)
+                texts, labels = [], []
+        if texts:
+            self.__learn(texts, labels)
+
+        logging.info(f"Trained on {self.num_trained} texts, held out {self.num_held_out} "
+                     f"(keeping {len(self.__test_labels)}).")
+        return self
+
+    def predict(self, texts: list) -> np.ndarray:
+        """Predict the labels of texts"""
+        return self.classifier.predict(self.vectorizer.transform(texts))
+
+    def score(self, texts: list = None, labels: list = None) -> float:
+        """Get the accuracy on texts, or on the held-out plays if no texts are given"""
+        if texts is None:
+            if not self.__test_labels:
+                raise ValueError("No plays have been held out, set test_fraction or pass texts.")
+            return self.classifier.score(sparse.vstack(self.__test_features), np.asarray(self.__test_labels))
+        return self.classifier.score(self.vectorizer.transform(texts), np.asarray(labels))
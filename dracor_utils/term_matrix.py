@@ -0,0 +1,263 @@
+"""Sparse character x vocabulary count matrices built from the spoken text of the characters
+
+The api-tutorial notebook tokenizes every speech with nltk.word_tokenize, keeps a Counter per character and looks
+up words in dictionaries for each gender. This module builds a single sparse count matrix with one row per
+character and one column per word of the vocabulary for one or many plays of /corpora/{corpusname}/plays/
+{playname}/spoken-text-by-character. Rows carry the corpus, play, identifier, label and gender of the character,
+so counts by gender (or any other attribute) are the product of a sparse indicator matrix with the count matrix.
+
+Example:
+    >>> term_matrix = fetch_term_matrix("swe")
+    >>> term_matrix.words_by_group(["rose", "blom", "barn"], by="gender")
+"""
+
+import logging
+import re
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .api import DEFAULT_API_BASE_URL, GENDERS
+from .downloader import download_corpus
+
+# Words (including inner hyphens and apostrophes) and single punctuation characters
+DEFAULT_TOKEN_PATTERN = r"\w+(?:[-'’]\w+)*|[^\w\s]"
+
+# Columns of the row metadata
+ROW_KEYS = ["corpus", "play", "id", "label", "gender"]
+
+
+def get_tokenizer(tokenizer: str = "regex", token_pattern: str = DEFAULT_TOKEN_PATTERN, language: str = "english"):
+    """Get a function that splits the list of speeches of a character into tokens
+
+    Args:
+        tokenizer (str, optional): "regex" for a fast tokenizer based on a regular expression, "nltk" for
+            nltk.word_tokenize applied to every speech (identical to the api-tutorial notebook, but slower).
+            Defaults to "regex".
+        token_pattern (str, optional): Regular expression matching a token, used by the "regex" tokenizer.
+        language (str, optional): Language of the sentence splitter of nltk.word_tokenize. Defaults to "english".
+    """
+    if tokenizer == "regex":
+        find_tokens = re.compile(token_pattern).findall
+
+        def tokenize(speeches: list) -> list:
+            # Tokens never include whitespace, so all speeches can be matched at once
+            return find_tokens("\n".join(speeches))
+    elif tokenizer == "nltk":
+        from nltk.tokenize import word_tokenize
+
+        def tokenize(speeches: list) -> list:
+            return [token for speech in speeches for token in word_tokenize(speech, language=language)]
+    else:
+        raise ValueError(f"Unknown tokenizer '{tokenizer}', use 'regex' or 'nltk'.")
+    return tokenize
+
+
+class TermMatrix:
+    """Counts of the words of a vocabulary in the spoken text of characters
+    """
+
+    def __init__(self, matrix: sparse.csr_matrix, vocabulary: list, rows: pd.DataFrame):
+        """
+
+        Args:
+            matrix (sparse.csr_matrix): Counts, one row per character and one column per word.
+            vocabulary (list): Words in the order of the columns.
+            rows (pd.DataFrame): Metadata of the characters in the order of the rows.
+        """
+        self.matrix = matrix
+        self.vocabulary = list(vocabulary)
+        self.rows = rows.reset_index(drop=True)
+        self.__index = {word: i for i, word in enumerate(self.vocabulary)}
+
+    @property
+    def shape(self) -> tuple:
+        """Number of characters (rows) and words (columns)"""
+        return self.matrix.shape
+
+    def columns(self, words: Iterable[str]) -> np.ndarray:
+        """Get the column numbers of words, -1 for words that are not in the vocabulary"""
+        return np.array([self.__index.get(word, -1) for word in words], dtype=np.int64)
+
+    def __select(self, matrix: sparse.spmatrix, words: list) -> np.ndarray:
+        """Get the dense columns of words, zeros for unknown words"""
+        columns = self.columns(words)
+        known = columns >= 0
+        counts = np.zeros((matrix.shape[0], len(words)), dtype=matrix.dtype)
+        counts[:, known] = matrix[:, columns[known]].toarray()
+        return counts
+
+    def counts(self, words: list) -> pd.DataFrame:
+        """Get the frequencies of words for each character
+
+        Args:
+            words (list): Words to look up.
+
+        Returns:
+            pd.DataFrame: Row metadata followed by one column per word.
+        """
+        return pd.concat([self.rows, pd.DataFrame(self.__select(self.matrix, words), columns=words)], axis=1)
+
+    def group_matrix(self, by="gender", groups: list = None) -> tuple:
+        """Sum the counts of all characters with the same value of one or more attributes
+
+        Args:
+            by (optional): Column or list of columns of the row metadata. Defaults to "gender".
+            groups (list, optional): Values of the attribute(s) to keep, in this order. Defaults to all values.
+
+        Returns:
+            tuple: A sparse matrix with one row per group and one column per word, and the index of the groups.
+        """
+        keys = [by] if isinstance(by, str) else list(by)
+        if len(keys) == 1:
+            group_codes, group_values = pd.factorize(self.rows[keys[0]])
+            group_index = pd.Index(group_values, name=keys[0])
+        else:
+            group_codes, group_index = pd.MultiIndex.from_frame(self.rows[keys]).factorize()
+            group_index = group_index.set_names(keys)
+
+        valid = group_codes >= 0
+        indicator = sparse.csr_matrix((np.ones(valid.sum(), dtype=self.matrix.dtype),
+                                       (group_codes[valid], np.flatnonzero(valid))),
+                                      shape=(len(group_index), self.matrix.shape[0]))
+        grouped = (indicator @ self.matrix).tocsr()
+
+        if groups is not None:
+            positions = group_index.get_indexer(groups)
+            # Groups without characters get empty rows
+            selector = sparse.csr_matrix((np.ones((positions >= 0).sum(), dtype=self.matrix.dtype),
+                                          (np.flatnonzero(positions >= 0), positions[positions >= 0])),
+                                         shape=(len(groups), len(group_index)))
+            grouped = (selector @ grouped).tocsr()
+            group_index = pd.Index(groups, name=keys[0]) if len(keys) == 1 \
+                else pd.MultiIndex.from_tuples(groups, names=keys)
+        return grouped, group_index
+
+    def words_by_group(self, words: list, by="gender", groups: list = None) -> pd.DataFrame:
+        """Get the frequencies of words by group, e.g. the table words_by_gender of the api-tutorial notebook
+
+        Args:
+            words (list): Words to look up.
+            by (optional): Column or list of columns of the row metadata. Defaults to "gender".
+            groups (list, optional): Values of the attribute(s) to keep, in this order.
+                Defaults to ["MALE", "FEMALE", "UNKNOWN"] for gender and all values otherwise.
+
+        Returns:
+            pd.DataFrame: One row per group and one column per word.
+        """
+        if groups is None and by == "gender":
+            groups = GENDERS
+        grouped, group_index = self.group_matrix(by=by, groups=groups)
+        return pd.DataFrame(self.__select(grouped, words), index=group_index, columns=words)
+
+    def frequencies(self) -> pd.Series:
+        """Get the total frequency of each word of the vocabulary, most frequent first"""
+        totals = np.asarray(self.matrix.sum(axis=0)).ravel()
+        return pd.Series(totals, index=self.vocabulary, name="frequency").sort_values(ascending=False)
+
+    def save(self, path_prefix: str):
+        """Save the matrix, vocabulary and row metadata to "{path_prefix}.npz", "_vocabulary.txt" and "_rows.parquet"
+
+        Args:
+            path_prefix (str): Prefix of the files, e.g. "data/swe_terms".
+        """
+        sparse.save_npz(f"{path_prefix}.npz", self.matrix)
+        with open(f"{path_prefix}_vocabulary.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(self.vocabulary))
+        self.rows.to_parquet(f"{path_prefix}_rows.parquet", index=False)
+
+    @classmethod
+    def load(cls, path_prefix: str):
+        """Load a matrix saved with save
+
+        Args:
+            path_prefix (str): Prefix of the files, e.g. "data/swe_terms".
+        """
+        with open(f"{path_prefix}_vocabulary.txt", encoding="utf-8") as f:
+            vocabulary = f.read().split("\n")
+        return cls(sparse.load_npz(f"{path_prefix}.npz").tocsr(), vocabulary,
+                   pd.read_parquet(f"{path_prefix}_rows.parquet"))
+
+
+def build_term_matrix(plays: Iterable[tuple],
+                      tokenizer: str = "regex",
+                      lowercase: bool = False,
+                      **tokenizer_options) -> TermMatrix:
+    """Build the count matrix of the characters of many plays
+
+    The tokens of a play are factorized at once and only the distinct words of the play are looked up in
+    the vocabulary, so the cost per token is a hash lookup in pandas, not in a Python dictionary.
+
+    Args:
+        plays: Tuples (corpusname, playname, characters) with the data returned by
+            /corpora/{corpusname}/plays/{playname}/spoken-text-by-character as characters.
+        tokenizer (str, optional): "regex" or "nltk", see get_tokenizer. Defaults to "regex".
+        lowercase (bool, optional): Convert all tokens to lower case. Defaults to False, as in the notebook.
+        **tokenizer_options: Further arguments of get_tokenizer, e.g. token_pattern or language.
+    """
+    tokenize = get_tokenizer(tokenizer, **tokenizer_options)
+    vocabulary = {}
+    rows = []
+    data = [np.zeros(0, dtype=np.int32)]
+    row_indices = [np.zeros(0, dtype=np.int64)]
+    column_indices = [np.zeros(0, dtype=np.int64)]
+    num_rows = 0
+    num_plays = 0
+
+    for corpusname, playname, characters in plays:
+        num_plays += 1
+        tokens = []
+        lengths = []
+        for character in characters:
+            character_tokens = tokenize(character.get("text", []))
+            tokens.extend(character_tokens)
+            lengths.append(len(character_tokens))
+            rows.append((corpusname, playname, character.get("id"), character.get("label"),
+                         character.get("gender")))
+        if not lengths:
+            continue
+
+        token_series = pd.Series(tokens, dtype=object)
+        if lowercase:
+            token_series = token_series.str.lower()
+        local_codes, local_words = pd.factorize(token_series)
+        global_codes = np.array([vocabulary.setdefault(word, len(vocabulary)) for word in local_words],
+                                dtype=np.int64)
+
+        # Counts of the play: duplicates (character, word) are summed when converting to CSR
+        play_rows = np.repeat(np.arange(len(lengths)), lengths)
+        counts = sparse.coo_matrix((np.ones(len(tokens), dtype=np.int32),
+                                    (play_rows, global_codes[local_codes])),
+                                   shape=(len(lengths), len(vocabulary))).tocsr()
+        coo = counts.tocoo()
+        data.append(coo.data)
+        row_indices.append(coo.row + num_rows)
+        column_indices.append(coo.col)
+        num_rows += len(lengths)
+
+    matrix = sparse.csr_matrix((np.concatenate(data), (np.concatenate(row_indices), np.concatenate(column_indices))),
+                               shape=(num_rows, len(vocabulary)))
+    logging.info(f"Built a matrix of {num_rows} characters of {num_plays} plays and {len(vocabulary)} words.")
+    return TermMatrix(matrix, list(vocabulary), pd.DataFrame(rows, columns=ROW_KEYS))
+
+
+def fetch_term_matrix(corpusname: str,
+                      playnames: list = None,
+                      api_base_url: str = DEFAULT_API_BASE_URL,
+                      max_workers: int = 8,
+                      **options) -> TermMatrix:
+    """Download the spoken text of the characters of a corpus and build the count matrix
+
+    Args:
+        corpusname (str): Name of the corpus, e.g. "swe".
+        playnames (list, optional): Names of the plays. Defaults to all plays of the corpus.
+        api_base_url (str, optional): Base URL of the DraCor API.
+        max_workers (int, optional): Maximum number of concurrent requests. Defaults to 8.
+        **options: Further arguments of build_term_matrix, e.g. tokenizer or lowercase.
+    """
+    results = download_corpus(corpusname, "spoken-text-by-character", playnames=playnames,
+                              api_base_url=api_base_url, max_workers=max_workers, parse_json=True)
+    plays = ((result.corpusname, result.playname, result.data) for result in results if result.ok)
+    return build_term_matrix(plays, **options)